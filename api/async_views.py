@@ -0,0 +1,112 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.settings import api_settings
+
+from .live import live_hub
+from .serializers import ViewportSerializer
+from .spatial import user_index
+from .suggestions import aget_place_recommendations, candidate_places, finish_suggestions, suggestion_cache, suggestion_inputs
+
+
+def authenticate(request):
+    """Run the DRF authentication classes against a plain Django request."""
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        try:
+            result = authentication_class().authenticate(request)
+        except AuthenticationFailed:
+            return None
+        if result is not None:
+            return result[0]
+    return None
+
+
+async def suggested_places(request):
+    """
+    Async twin of SuggestedPlacesView for the ASGI application.
+
+    The LLM round-trip is awaited on the event loop instead of holding a
+    worker thread, and identical prompts in flight share one upstream call.
+    """
+    if request.method != "GET":
+        return JsonResponse({"detail": f'Method "{request.method}" not allowed.'}, status=405)
+
+    user = await sync_to_async(authenticate)(request)
+    if user is None:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+
+    visited_places, top_categories, cache_key = await sync_to_async(suggestion_inputs)(user)
+    cached = suggestion_cache.get(cache_key)
+    if cached is not None:
+        return JsonResponse({"suggestions": cached})
+
+    suggestions, place_data = None, []
+    if settings.SUGGESTION_MODE != "local":
+        place_data = await sync_to_async(candidate_places)(visited_places, top_categories)
+        call = aget_place_recommendations(place_data, top_categories, settings.OPENROUTER_API_KEY)
+        if settings.SUGGESTION_MODE == "hybrid":
+            try:
+                suggestions = await asyncio.wait_for(call, settings.SUGGESTION_LLM_DEADLINE)
+            except asyncio.TimeoutError:
+                suggestions = None
+        else:
+            suggestions = await call
+
+    suggested_ids = await sync_to_async(finish_suggestions)(user, visited_places, cache_key, suggestions, place_data)
+    return JsonResponse({"suggestions": suggested_ids})
+
+
+def _frame(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+async def _live_events(subscription, users):
+    try:
+        yield _frame("snapshot", {"users": users})
+        while True:
+            try:
+                changes = await asyncio.wait_for(subscription.changes(), settings.LIVE_KEEPALIVE)
+            except asyncio.TimeoutError:
+                # Comments keep proxies from closing an idle stream.
+                yield b": keepalive\n\n"
+                continue
+            yield _frame("delta", changes)
+    finally:
+        live_hub.unsubscribe(subscription)
+
+
+async def user_stream(request):
+    """
+    Server-sent events with the users on the map inside a viewport.
+
+    Opens with a snapshot of the viewport, then sends only who entered,
+    moved or left it (see api/live.py). Only served by the ASGI application,
+    a WSGI worker would be held for as long as the stream stays open.
+    """
+    if request.method != "GET":
+        return JsonResponse({"detail": f'Method "{request.method}" not allowed.'}, status=405)
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({"detail": "Streaming needs the ASGI application."}, status=501)
+
+    serializer = ViewportSerializer(data=request.GET)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=400)
+    params = serializer.validated_data
+    bbox = (params["min_x"], params["min_y"], params["max_x"], params["max_y"])
+
+    user = await sync_to_async(authenticate)(request)
+    # Subscribe before reading the snapshot so nothing slips through in between.
+    subscription = live_hub.subscribe(bbox, user.pk if user is not None else None)
+    users = await sync_to_async(user_index.within_bbox)(*bbox, settings.NEARBY_USERS_LIMIT + 1)
+    users = [row for row in users if row["id"] != subscription.user_id][:settings.NEARBY_USERS_LIMIT]
+    subscription.show(users)
+
+    response = StreamingHttpResponse(_live_events(subscription, users), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
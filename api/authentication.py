@@ -0,0 +1,79 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+def user_cache_key(user_id):
+    return f'auth_user:{user_id}'
+
+
+def forget_users(user_ids):
+    """Drop cached users so their next request reads the row again."""
+    cache.delete_many([user_cache_key(user_id) for user_id in user_ids])
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def reset(self):
+        with self._lock:
+            self.hits = self.misses = 0
+
+
+auth_cache_stats = CacheStats()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that keeps the token's user in the Django cache for
+    ``AUTH_USER_CACHE_TTL`` seconds instead of selecting it on every request.
+
+    Any save or delete of the user, and every flush of buffered positions,
+    drops the entry (see api/signals.py and api/positions.py). That only
+    reaches every worker through a shared cache, so without ``CACHE_URL``
+    the TTL defaults to 0 and users are read from the database each time.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        if settings.AUTH_USER_CACHE_TTL <= 0:
+            return super().get_user(validated_token)
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        auth_cache_stats.record(hit=user is not None)
+        if user is None:
+            user = super().get_user(validated_token)
+            cache.set(key, user, timeout=settings.AUTH_USER_CACHE_TTL)
+            return user
+
+        # The checks JWTAuthentication makes after its lookup.
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN and validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+            raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        return user
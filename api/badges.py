@@ -0,0 +1,100 @@
+"""
+Incremental badge rules.
+
+Every visit is folded into per-user counters stored in
+``CustomUser.badge_progress`` and badges are judged from those counters
+alone, so awarding badges costs the same no matter how many places the user
+has already visited. When the rules change, run ``manage.py recompute_badges``
+to rebuild the counters from the visit history.
+"""
+import uuid
+
+from .authentication import forget_users
+
+# Descriptions that count only on an exact (case-insensitive) match.
+EXACT_DESCRIPTIONS = ('library', 'rnr', 'arcade')
+# Keywords that count anywhere in the description.
+DESCRIPTION_KEYWORDS = ('academic', 'hostel')
+
+
+def counters_for(description, category):
+    """Counter keys a visit to a place with this description and category hits."""
+    description = (description or '').lower()
+    category = (category or '').lower()
+    keys = []
+    if description in EXACT_DESCRIPTIONS:
+        keys.append(f'desc:{description}')
+    keys.extend(f'kw:{keyword}' for keyword in DESCRIPTION_KEYWORDS if keyword in description)
+    if category:
+        keys.append(f'cat:{category}')
+    return keys
+
+
+def categories(progress):
+    return {key[4:] for key, count in progress.items() if key.startswith('cat:') and count}
+
+
+RULES = {
+    'nerd': lambda p: p.get('desc:library') or p.get('kw:academic'),
+    'foodie': lambda p: p.get('cat:food'),
+    'gamer': lambda p: p.get('desc:rnr') or p.get('desc:arcade'),
+    'jock': lambda p: p.get('cat:fitness'),
+    'sleepyhead': lambda p: p.get('kw:hostel') and categories(p) == {'campus'},
+}
+
+
+def apply_visit(progress, description, category):
+    """Return a copy of ``progress`` with one more visit folded in."""
+    progress = dict(progress or {})
+    for key in counters_for(description, category):
+        progress[key] = progress.get(key, 0) + 1
+    return progress
+
+
+def badges_for(progress):
+    return sorted(badge for badge, rule in RULES.items() if rule(progress))
+
+
+def recompute_all(user_model, visit_model, chunk_size=500):
+    """
+    Rebuild progress counters and badges for every user from their visits.
+
+    Users are walked in primary key order, ``chunk_size`` at a time, with one
+    query for the users, one for their visits and one bulk update per chunk.
+    Changed users get a new version token and are dropped from the auth
+    cache, as a save would do.
+
+    Returns:
+        tuple: (users processed, users whose badges or counters changed)
+    """
+    processed = changed = 0
+    last_id = 0
+    while True:
+        users = list(
+            user_model.objects.filter(pk__gt=last_id).order_by('pk')
+            .values_list('pk', 'badges', 'badge_progress')[:chunk_size]
+        )
+        if not users:
+            return processed, changed
+        last_id = users[-1][0]
+
+        progress = {user_id: {} for user_id, _, _ in users}
+        visits = visit_model.objects.filter(user_id__in=progress).values_list(
+            'user_id', 'place__description', 'place__category'
+        )
+        for user_id, description, category in visits.iterator():
+            progress[user_id] = apply_visit(progress[user_id], description, category)
+
+        updates = []
+        for user_id, badges, old_progress in users:
+            new_badges = badges_for(progress[user_id])
+            if new_badges != sorted(badges or []) or progress[user_id] != (old_progress or {}):
+                updates.append(user_model(
+                    pk=user_id, badges=new_badges, badge_progress=progress[user_id], version=uuid.uuid4(),
+                ))
+        if updates:
+            user_model.objects.bulk_update(updates, ['badges', 'badge_progress', 'version'])
+            forget_users([user.pk for user in updates])
+
+        processed += len(users)
+        changed += len(updates)
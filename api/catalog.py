@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import CatalogVersion, Visit
+
+VERSION_KEY = 'catalog:version'
+MEMBERSHIP_KEY = 'catalog:membership'
+VISIT_STAMP_KEY = 'catalog:visit-stamp'
+
+
+def current_version():
+    """
+    Latest place catalog version.
+
+    Read through the Django cache; the writing worker refreshes it right
+    away and every other worker sees the new value within
+    ``CATALOG_VERSION_CACHE_TTL`` seconds (immediately with a shared cache).
+    """
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = CatalogVersion.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+        cache.set(VERSION_KEY, version, timeout=settings.CATALOG_VERSION_CACHE_TTL)
+    return version
+
+
+def remember_version(version):
+    if version > (cache.get(VERSION_KEY) or 0):
+        cache.set(VERSION_KEY, version, timeout=settings.CATALOG_VERSION_CACHE_TTL)
+
+
+def current_membership():
+    """
+    Counter that moves only when places are created, approved or deleted.
+
+    For caches that do not care about edits to a place's details. Cached
+    like ``current_version()``.
+    """
+    membership = cache.get(MEMBERSHIP_KEY)
+    if membership is None:
+        membership = CatalogVersion.objects.filter(pk=1).values_list('membership', flat=True).first() or 0
+        cache.set(MEMBERSHIP_KEY, membership, timeout=settings.CATALOG_VERSION_CACHE_TTL)
+    return membership
+
+
+def forget_membership():
+    cache.delete(MEMBERSHIP_KEY)
+
+
+def visit_stamp():
+    """
+    ID of the latest visit, which moves whenever place visit counters do.
+
+    Visits do not take a catalog version, that would make every visit wait
+    for the version row. Cached like ``current_version()``.
+    """
+    stamp = cache.get(VISIT_STAMP_KEY)
+    if stamp is None:
+        stamp = Visit.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        cache.set(VISIT_STAMP_KEY, stamp, timeout=settings.CATALOG_VERSION_CACHE_TTL)
+    return stamp
+
+
+def forget_visit_stamp():
+    cache.delete(VISIT_STAMP_KEY)
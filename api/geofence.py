@@ -0,0 +1,95 @@
+"""
+Automatic visits from position updates.
+
+Every approved place has a geofence of ``GEOFENCE_RADIUS_M`` meters. Each
+reported position is checked against the place grid index (no database
+query), and only fences the user was not already inside count as entered,
+so standing next to a place does not retry its visit on every heartbeat.
+Entered places the user has not been credited for yet go through
+``record_visits`` like any other visit.
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import Place
+from .spatial import place_index
+from .visits import record_visits
+
+
+class GeofenceTracker:
+    """
+    The fences each user is inside right now and the places they were
+    already credited for.
+
+    Users outside every fence take no memory for the first part. Both parts
+    keep only the ``GEOFENCE_TRACKED_USERS`` most recently seen users; a user
+    who falls out simply has their next fence entry checked against the
+    database again, where the Visit unique constraint stops double credit.
+    """
+
+    def __init__(self):
+        self._inside = OrderedDict()
+        self._credited = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _remember(entries, user_id, value):
+        entries[user_id] = value
+        entries.move_to_end(user_id)
+        while len(entries) > settings.GEOFENCE_TRACKED_USERS:
+            entries.popitem(last=False)
+
+    def enter(self, user_id, x, y):
+        """IDs of places whose fence the user just entered and who were not credited yet, nearest first."""
+        radius = settings.GEOFENCE_RADIUS_M
+        hits = place_index.within_radius(x, y, radius) if radius > 0 else []
+        inside = frozenset(place_id for _, place_id in hits)
+        with self._lock:
+            previous = self._inside.pop(user_id, frozenset())
+            if inside:
+                self._remember(self._inside, user_id, inside)
+            credited = self._credited.get(user_id, ())
+            if credited:
+                self._credited.move_to_end(user_id)
+            return [place_id for _, place_id in hits if place_id not in previous and place_id not in credited]
+
+    def credit(self, user_id, place_ids):
+        with self._lock:
+            self._remember(self._credited, user_id, {*self._credited.get(user_id, ()), *place_ids})
+
+    def forget(self, user_id):
+        with self._lock:
+            self._inside.pop(user_id, None)
+            self._credited.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._inside = OrderedDict()
+            self._credited = OrderedDict()
+
+    def __len__(self):
+        return len(self._inside.keys() | self._credited.keys())
+
+
+geofence_tracker = GeofenceTracker()
+
+
+def auto_visit(user, x, y):
+    """
+    Record visits to the places whose geofence ``user`` entered at (x, y).
+
+    Returns:
+        tuple: (places newly visited, nearest first, user). The user is the
+        refreshed instance when anything was recorded.
+    """
+    entered = geofence_tracker.enter(user.pk, x, y)
+    if not entered:
+        return [], user
+
+    places = Place.objects.filter(approved=True).in_bulk(entered)
+    visits = [(places[place_id], None) for place_id in entered if place_id in places]
+    created, user, _ = record_visits(user, visits)
+    geofence_tracker.credit(user.pk, places)
+    return [places[place_id] for place_id in entered if place_id in created], user
@@ -0,0 +1,258 @@
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class SortedKeys:
+    """
+    A sorted list split into chunks of at most ``2 * load`` keys.
+
+    An insert or delete shifts one chunk instead of the whole list, and the
+    chunk holding a key is found by binary search over the chunk maxima. A
+    Fenwick tree over the chunk lengths turns a key into its position and a
+    position into its chunk without walking the chunks before it; it is
+    rebuilt only when a chunk splits or empties. With n keys:
+
+    - insert/remove: O(log n + load), plus an O(n / load) rebuild once per
+      split or emptied chunk
+    - index: O(log n)
+    - slice of k keys starting anywhere: O(log n + k)
+    """
+
+    def __init__(self, keys=(), load=1000):
+        self._load = load
+        keys = sorted(keys)
+        self._chunks = [keys[start:start + load] for start in range(0, len(keys), load)]
+        self._maxes = [chunk[-1] for chunk in self._chunks]
+        self._len = len(keys)
+        self._tree = None
+
+    def __len__(self):
+        return self._len
+
+    def _build_tree(self):
+        tree = [0] + [len(chunk) for chunk in self._chunks]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _resize(self, position, delta):
+        tree = self._tree
+        if tree is None:
+            return
+        i = position + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def _before(self, position):
+        """How many keys are in the chunks before chunk ``position``."""
+        if self._tree is None:
+            self._build_tree()
+        tree, total, i = self._tree, 0, position
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def _locate(self, offset):
+        """(chunk, index within it) of the key at ``offset``, which must be < len(self)."""
+        if self._tree is None:
+            self._build_tree()
+        tree, position, step = self._tree, 0, 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            if position + step < len(tree) and tree[position + step] <= offset:
+                position += step
+                offset -= tree[position]
+            step >>= 1
+        return position, offset
+
+    def add(self, key):
+        if not self._chunks:
+            self._chunks.append([key])
+            self._maxes.append(key)
+            self._tree = None
+        else:
+            position = min(bisect_left(self._maxes, key), len(self._chunks) - 1)
+            chunk = self._chunks[position]
+            insort(chunk, key)
+            self._maxes[position] = chunk[-1]
+            if len(chunk) > 2 * self._load:
+                self._chunks[position:position + 1] = [chunk[:self._load], chunk[self._load:]]
+                self._maxes[position:position + 1] = [chunk[self._load - 1], chunk[-1]]
+                self._tree = None
+            else:
+                self._resize(position, 1)
+        self._len += 1
+
+    def remove(self, key):
+        """Drop ``key`` if present."""
+        position = bisect_left(self._maxes, key)
+        if position == len(self._chunks):
+            return
+        chunk = self._chunks[position]
+        index = bisect_left(chunk, key)
+        if index == len(chunk) or chunk[index] != key:
+            return
+        del chunk[index]
+        self._len -= 1
+        if chunk:
+            self._maxes[position] = chunk[-1]
+            self._resize(position, -1)
+        else:
+            del self._chunks[position]
+            del self._maxes[position]
+            self._tree = None
+
+    def index(self, key):
+        """How many keys sort before ``key``."""
+        position = bisect_left(self._maxes, key)
+        if position == len(self._chunks):
+            return self._len
+        return self._before(position) + bisect_left(self._chunks[position], key)
+
+    def slice(self, offset, limit):
+        if offset >= self._len or limit <= 0:
+            return []
+        position, index = self._locate(offset)
+        keys = []
+        for chunk in self._chunks[position:]:
+            keys.extend(chunk[index:index + limit - len(keys)])
+            index = 0
+            if len(keys) >= limit:
+                break
+        return keys
+
+
+class Leaderboard:
+    """
+    Users ranked by level then XP, highest first, ties broken by id.
+
+    Keeps ``(-level, -xp, id)`` keys in a ``SortedKeys``, so ranks and pages
+    never sort or scan the whole board. It is loaded lazily and kept current
+    by CustomUser saves. Every ``LEADERBOARD_TTL`` seconds it is rebuilt from
+    the database so other workers' updates show up too; the rebuild runs on
+    a background thread while requests keep reading the current board, and
+    updates arriving meanwhile are replayed onto the new one.
+    """
+
+    FIELDS = ('username', 'level', 'xp', 'avatar')
+
+    def __init__(self):
+        self._keys = None
+        self._users = {}
+        self._loaded_at = 0.0
+        self._journal = None
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _key(user_id, level, xp):
+        return (-level, -xp, user_id)
+
+    @classmethod
+    def _read(cls):
+        from .models import CustomUser
+
+        users = {}
+        for user_id, *profile in CustomUser.objects.values_list('id', *cls.FIELDS).iterator():
+            users[user_id] = dict(zip(cls.FIELDS, profile))
+        keys = SortedKeys(cls._key(user_id, u['level'], u['xp']) for user_id, u in users.items())
+        return keys, users
+
+    def _ensure_loaded(self):
+        if self._keys is None:
+            with self._lock:
+                if self._keys is None:
+                    self._keys, self._users = self._read()
+                    self._loaded_at = time.monotonic()
+            return
+        if time.monotonic() - self._loaded_at >= settings.LEADERBOARD_TTL and self._journal is None:
+            with self._lock:
+                if self._journal is not None:
+                    return
+                self._journal = []
+            threading.Thread(target=self._rebuild, name='leaderboard-rebuild', daemon=True).start()
+
+    def _rebuild(self):
+        try:
+            keys, users = self._read()
+            with self._lock:
+                if self._journal is None:
+                    # Reset while we were reading.
+                    return
+                self._keys, self._users = keys, users
+                for user_id, profile in self._journal:
+                    self._apply(user_id, profile)
+                self._loaded_at = time.monotonic()
+        except Exception:
+            logger.exception("Rebuilding the leaderboard failed, retrying after the next request")
+        finally:
+            with self._lock:
+                self._journal = None
+            connection.close()
+
+    def _apply(self, user_id, profile):
+        self._remove(user_id)
+        if profile is not None:
+            self._users[user_id] = profile
+            self._keys.add(self._key(user_id, profile['level'], profile['xp']))
+
+    def _change(self, user_id, profile):
+        with self._lock:
+            if self._keys is None:
+                return
+            self._apply(user_id, profile)
+            if self._journal is not None:
+                self._journal.append((user_id, profile))
+
+    def update(self, user):
+        self._change(user.pk, {field: getattr(user, field) for field in self.FIELDS})
+
+    def discard(self, user_id):
+        self._change(user_id, None)
+
+    def _remove(self, user_id):
+        old = self._users.pop(user_id, None)
+        if old is not None:
+            self._keys.remove(self._key(user_id, old['level'], old['xp']))
+
+    def reset(self):
+        with self._lock:
+            self._keys = None
+            self._users = {}
+            self._journal = None
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._keys)
+
+    def page(self, offset, limit):
+        """Leaderboard rows ranked ``offset + 1`` through ``offset + limit``."""
+        self._ensure_loaded()
+        with self._lock:
+            keys = self._keys.slice(offset, limit)
+            return [
+                {'rank': offset + position, 'id': key[2], **self._users[key[2]]}
+                for position, key in enumerate(keys, start=1)
+            ]
+
+    def entry(self, user_id):
+        """The leaderboard row for ``user_id``, or None if they are not ranked."""
+        self._ensure_loaded()
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None:
+                return None
+            rank = self._keys.index(self._key(user_id, user['level'], user['xp'])) + 1
+            return {'rank': rank, 'id': user_id, **user}
+
+
+leaderboard = Leaderboard()
@@ -0,0 +1,209 @@
+"""
+Live map updates pushed to subscribers instead of polled.
+
+Every position or presence change of a user is published as a small event.
+A ``LiveHub`` in each worker receives them from the pub/sub backend and fans
+them out to the streams it serves. Each subscription watches one viewport
+and remembers who it has shown, so it only hears about users entering,
+moving inside or leaving that box. Changes are coalesced per user until the
+stream picks them up, so a slow client gets the latest state, not a backlog.
+
+The backend is pluggable through ``LIVE_BACKEND``. ``LocalBackend`` delivers
+inside the process, which is all a single worker (or a test) needs;
+``RedisBackend`` shares events between workers.
+"""
+import asyncio
+import json
+import logging
+import threading
+import weakref
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FIELDS = ('username', 'avatar', 'level')
+
+
+class LocalBackend:
+    """Delivers events to the hubs subscribed in this process."""
+
+    def __init__(self):
+        self._callbacks = []
+
+    def publish(self, event):
+        for callback in list(self._callbacks):
+            callback(event)
+
+    def subscribe(self, callback):
+        self._callbacks.append(callback)
+
+
+class RedisBackend:
+    """Shares events between workers over a Redis channel (needs the redis package)."""
+
+    def __init__(self, url=None, channel="vellorun:live"):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImproperlyConfigured("RedisBackend needs the redis package") from e
+        self.client = redis.Redis.from_url(url or settings.LIVE_REDIS_URL)
+        self.channel = channel
+
+    def publish(self, event):
+        self.client.publish(self.channel, json.dumps(event))
+
+    def subscribe(self, callback):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{self.channel: lambda message: callback(json.loads(message["data"]))})
+        pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+
+class Subscription:
+    """
+    One stream's view of the map.
+
+    ``offer`` runs on whichever thread received the event; ``changes`` is
+    awaited on the event loop serving the stream.
+    """
+
+    def __init__(self, bbox, user_id=None):
+        self.bbox = bbox
+        self.user_id = user_id
+        self._shown = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+
+    def contains(self, x, y):
+        min_x, min_y, max_x, max_y = self.bbox
+        return min_x <= x <= max_x and min_y <= y <= max_y
+
+    def show(self, rows):
+        """Mark ``rows`` as already on the client, after sending them in a snapshot."""
+        with self._lock:
+            for row in rows:
+                self._shown[row['id']] = tuple(row[field] for field in PROFILE_FIELDS)
+
+    def offer(self, event):
+        user_id = event['id']
+        if user_id == self.user_id:
+            return
+        with self._lock:
+            shown = self._shown.get(user_id)
+            if event['type'] == 'position' and self.contains(event['coord_x'], event['coord_y']):
+                profile = tuple(event[field] for field in PROFILE_FIELDS)
+                self._shown[user_id] = profile
+                kind = 'move' if shown == profile else 'enter'
+            elif shown is not None:
+                del self._shown[user_id]
+                kind = 'leave'
+            else:
+                return
+            self._merge(user_id, kind, event)
+
+    def _merge(self, user_id, kind, event):
+        previous = self._pending.get(user_id)
+        if previous is not None and previous[0] == 'enter':
+            if kind == 'leave':
+                # The client never saw them arrive.
+                del self._pending[user_id]
+                return
+            kind = 'enter'
+        was_empty = not self._pending
+        self._pending[user_id] = (kind, event)
+        if was_empty:
+            try:
+                self._loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                # The stream's loop is gone, the weak reference will drop us.
+                pass
+
+    async def changes(self):
+        """Wait for the next batch, {"entered": [...], "moved": [...], "left": [...]}."""
+        while True:
+            await self._wakeup.wait()
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._wakeup.clear()
+            if pending:
+                break
+        entered, moved, left = [], [], []
+        for user_id, (kind, event) in pending.items():
+            if kind == 'enter':
+                entered.append({'id': user_id, **{field: event[field] for field in PROFILE_FIELDS},
+                                'coord_x': event['coord_x'], 'coord_y': event['coord_y']})
+            elif kind == 'move':
+                moved.append({'id': user_id, 'coord_x': event['coord_x'], 'coord_y': event['coord_y']})
+            else:
+                left.append(user_id)
+        return {'entered': entered, 'moved': moved, 'left': left}
+
+
+class LiveHub:
+    def __init__(self, backend=None):
+        self._backend = None
+        # Held weakly so a stream that is dropped before it ever runs cannot leak.
+        self._subscriptions = weakref.WeakSet()
+        self._lock = threading.Lock()
+        if backend is not None:
+            self._attach(backend)
+
+    def _connect(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._attach(import_string(settings.LIVE_BACKEND)())
+        return self._backend
+
+    def _attach(self, backend):
+        backend.subscribe(self._receive)
+        self._backend = backend
+
+    @staticmethod
+    def user_event(user, coord_x=None, coord_y=None):
+        """The event announcing ``user``'s current state on the map."""
+        from .presence import presence
+
+        if not (user.visible and user.is_active and presence.is_online(user.pk)):
+            return {'type': 'leave', 'id': user.pk}
+        return {
+            'type': 'position', 'id': user.pk,
+            **{field: getattr(user, field) for field in PROFILE_FIELDS},
+            'coord_x': user.coord_x if coord_x is None else coord_x,
+            'coord_y': user.coord_y if coord_y is None else coord_y,
+        }
+
+    def publish(self, event):
+        # Live updates are best effort, a broken backend must not fail the write.
+        try:
+            self._connect().publish(event)
+        except Exception:
+            logger.exception("Publishing a live map event failed")
+
+    def subscribe(self, bbox, user_id=None):
+        """Start watching ``bbox`` (min_x, min_y, max_x, max_y); call from the stream's event loop."""
+        self._connect()
+        subscription = Subscription(bbox, user_id)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def _receive(self, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            subscription.offer(event)
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+
+live_hub = LiveHub()
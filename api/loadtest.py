@@ -0,0 +1,251 @@
+"""
+Load-test harness that drives the real URL set in process.
+
+A trace is a list of requests by route name (JSON lines on disk), generated
+from a weighted mix or recorded from an earlier run, so the same traffic can
+be replayed against different commits. Replays go through Django's test
+client on worker threads, which exercises URL routing, middleware,
+authentication and the views without a network in between. Google sign-in
+uses a locally generated signing key and the LLM is a stub with fixed
+latency, so no request leaves the machine.
+"""
+import asyncio
+import json
+import math
+import queue
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from .models import CustomUser, Place
+
+# Relative share of each (route, method) in a generated trace, roughly what
+# the app sends while people walk around campus.
+ROUTE_MIX = {
+    ("user-heartbeat", "post"): 20,
+    ("place-list-create", "get"): 10,
+    ("nearby-places", "get"): 10,
+    ("nearby-users", "get"): 6,
+    ("place-detail", "get"): 5,
+    ("user-profile", "get"): 5,
+    ("visit-place", "post"): 8,
+    ("saved-places", "get"): 4,
+    ("saved-places", "post"): 3,
+    ("saved-places", "delete"): 2,
+    ("suggested-places", "get"): 4,
+    ("suggested-places-async", "get"): 2,
+    ("user-leaderboard", "get"): 6,
+    ("user-leaderboard-me", "get"): 4,
+    ("place-leaderboard", "get"): 6,
+    ("google-auth", "post"): 3,
+    ("token-refresh", "post"): 2,
+}
+
+CAMPUS = (12.962, 79.150, 12.978, 79.166)
+GOOGLE_CLIENT_ID = "loadtest-client"
+
+
+def generate_trace(count, user_ids, place_ids, seed=0, mix=ROUTE_MIX):
+    """
+    A random trace of ``count`` requests following ``mix``.
+
+    Each entry names the route, the acting user (None for anonymous calls)
+    and whatever the request needs; tokens are minted at replay time.
+    """
+    rng = random.Random(seed)
+    routes = list(mix)
+    weights = [mix[route] for route in routes]
+    trace = []
+    for route, method in rng.choices(routes, weights=weights, k=count):
+        user = rng.choice(user_ids)
+        place = rng.choice(place_ids)
+        point = {"coord_x": round(rng.uniform(CAMPUS[0], CAMPUS[2]), 6), "coord_y": round(rng.uniform(CAMPUS[1], CAMPUS[3]), 6)}
+        entry = {"route": route, "method": method, "user": user}
+        if route == "user-heartbeat":
+            entry["body"] = point
+        elif route in ("nearby-places", "nearby-users"):
+            entry["query"] = {**point, "radius": rng.choice([100, 300, 1000])}
+        elif route == "place-detail":
+            entry["kwargs"] = {"pk": place}
+        elif route == "visit-place" or (route == "saved-places" and method != "get"):
+            entry["body"] = {"place_id": place}
+        elif route in ("place-list-create", "place-leaderboard", "user-leaderboard"):
+            entry["user"] = None
+        trace.append(entry)
+    return trace
+
+
+def save_trace(trace, path):
+    with open(path, "w") as f:
+        for entry in trace:
+            f.write(json.dumps(entry) + "\n")
+
+
+def load_trace(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class GoogleStandIn:
+    """Signs Google-style ID tokens with a throwaway key the key cache is told to trust."""
+
+    def __init__(self):
+        self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        jwk = jwt.algorithms.RSAAlgorithm.to_jwk(self.private_key.public_key(), as_dict=True)
+        self.jwks = {"keys": [{**jwk, "kid": "loadtest", "alg": "RS256", "use": "sig"}]}
+
+    def id_token(self, email):
+        now = int(time.time())
+        claims = {
+            "iss": "https://accounts.google.com", "aud": GOOGLE_CLIENT_ID, "sub": email, "email": email,
+            "email_verified": True, "iat": now, "exp": now + 3600,
+        }
+        return jwt.encode(claims, self.private_key, algorithm="RS256", headers={"kid": "loadtest"})
+
+
+def _stub_completion(messages):
+    ids = re.findall(r'"id": (\d+)', messages[-1]["content"])[:3]
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=", ".join(ids)))])
+
+
+class StubLLM:
+    """Stands in for the OpenRouter client: answers with the first places in the prompt after ``latency`` seconds."""
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, **kwargs):
+        time.sleep(self.latency)
+        return _stub_completion(messages)
+
+
+class AsyncStubLLM(StubLLM):
+    async def create(self, model, messages, **kwargs):
+        await asyncio.sleep(self.latency)
+        return _stub_completion(messages)
+
+
+def prepare(trace, google):
+    """
+    Turn trace entries into ready-to-send requests, minting every token up
+    front so token creation is not part of the measured time.
+
+    Returns:
+        list: (label, method, path, kwargs for the test client) tuples
+    """
+    user_ids = {entry["user"] for entry in trace if entry.get("user") is not None}
+    users = CustomUser.objects.in_bulk(user_ids)
+    access = {user_id: str(AccessToken.for_user(user)) for user_id, user in users.items()}
+
+    requests = []
+    for entry in trace:
+        route, method, user_id = entry["route"], entry["method"], entry.get("user")
+        user = users.get(user_id)
+        path = reverse(route, kwargs=entry.get("kwargs"))
+        kwargs = {}
+        body = entry.get("body")
+        if route == "google-auth":
+            body, user = {"id_token": google.id_token(user.email if user else "newcomer@example.com")}, None
+        elif route == "token-refresh":
+            body, user = {"refresh": str(RefreshToken.for_user(user))}, None
+        if user is not None:
+            kwargs["headers"] = {"Authorization": f"Bearer {access[user.pk]}"}
+        if method == "get":
+            kwargs["data"] = entry.get("query")
+        elif body is not None:
+            kwargs["data"] = json.dumps(body)
+            kwargs["content_type"] = "application/json"
+        requests.append((f"{method.upper()} {route}", method, path, kwargs))
+    return requests
+
+
+def replay(requests, concurrency):
+    """
+    Send ``requests`` from ``concurrency`` threads, each taking the next one
+    as soon as its previous answer is back.
+
+    Returns:
+        tuple: (list of (label, status, seconds, bytes), wall clock seconds)
+    """
+    pending = queue.SimpleQueue()
+    for request in requests:
+        pending.put(request)
+    results = []
+    results_lock = threading.Lock()
+
+    def worker():
+        client = Client()
+        local = []
+        try:
+            while True:
+                try:
+                    label, method, path, kwargs = pending.get_nowait()
+                except queue.Empty:
+                    break
+                start = time.perf_counter()
+                response = getattr(client, method)(path, **kwargs)
+                body = b"".join(response.streaming_content) if response.streaming else response.content
+                local.append((label, response.status_code, time.perf_counter() - start, len(body)))
+        finally:
+            connection.close()
+            with results_lock:
+                results.extend(local)
+
+    threads = [threading.Thread(target=worker, name=f"loadtest-{n}") for n in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(results, wall):
+    """Per route and overall count, error count, rps, bytes and p50/p95/p99/max latency in milliseconds."""
+    by_route = {}
+    for label, status, seconds, size in results:
+        by_route.setdefault(label, []).append((status, seconds, size))
+
+    def stats(rows):
+        latencies = sorted(seconds * 1000 for _, seconds, _ in rows)
+        return {
+            "requests": len(rows),
+            "errors": sum(1 for status, _, _ in rows if status >= 500),
+            "client_errors": sum(1 for status, _, _ in rows if 400 <= status < 500),
+            "rps": round(len(rows) / wall, 2) if wall else None,
+            "p50_ms": round(percentile(latencies, 0.50), 3),
+            "p95_ms": round(percentile(latencies, 0.95), 3),
+            "p99_ms": round(percentile(latencies, 0.99), 3),
+            "max_ms": round(latencies[-1], 3),
+            "mean_bytes": round(sum(size for _, _, size in rows) / len(rows)),
+        }
+
+    return {
+        "overall": stats([row for rows in by_route.values() for row in rows]) if results else {},
+        "routes": {label: stats(rows) for label, rows in sorted(by_route.items())},
+    }
+
+
+def seeded_ids():
+    return (
+        list(CustomUser.objects.order_by("pk").values_list("pk", flat=True)),
+        list(Place.objects.filter(approved=True).order_by("pk").values_list("pk", flat=True)),
+    )
@@ -0,0 +1,77 @@
+import random
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+
+from api.models import Place
+from api.renderers import ORJSONRenderer
+from api.serializers import PlaceSerializer, place_row_columns, place_rows_from_values
+
+
+class Command(BaseCommand):
+    help = "Compare PlaceSerializer + JSONRenderer with the values() + orjson place list path on in-memory rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000], help="Row counts to benchmark.")
+        parser.add_argument('--repeat', type=int, default=3, help="Runs per path; the best one is reported.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        request = Request(APIRequestFactory().get('/api/places/'))
+        request.user = AnonymousUser()
+        columns = place_row_columns(request)
+        fast_context = {'response': Response()}
+        fast_context['response'].fast_json = True
+
+        for count in options['rows']:
+            values = self.make_values(columns, count, random.Random(options['seed']))
+            places = [Place(**dict(zip(columns, row))) for row in values]
+
+            def serializer_path():
+                data = PlaceSerializer(places, many=True, context={'request': request}).data
+                return JSONRenderer().render(data)
+
+            def fast_path():
+                return ORJSONRenderer().render(place_rows_from_values(columns, values), renderer_context=fast_context)
+
+            slow_time, slow_body = self.best_of(serializer_path, options['repeat'])
+            fast_time, fast_body = self.best_of(fast_path, options['repeat'])
+            if slow_body != fast_body:
+                raise CommandError(f"Outputs differ at {count} rows.")
+
+            self.stdout.write(
+                f"{count} rows, {len(fast_body) / 1e6:.1f} MB: serializer {slow_time * 1000:.0f} ms, "
+                f"values+orjson {fast_time * 1000:.0f} ms ({slow_time / fast_time:.1f}x), identical output"
+            )
+
+    @staticmethod
+    def make_values(columns, count, rng):
+        names = ["Library", "Food Court", "Gym", "Main Building", "Café   Nook", "Hostel \"A\""]
+        generated = {
+            'id': lambda i: i + 1,
+            'name': lambda i: f"{rng.choice(names)} {i}",
+            'type': lambda i: rng.choice(["inside", "outside"]),
+            'description': lambda i: rng.choice(["", "Main campus library", "Open late", "unicode ✓ ok", "line\u2028separator"]),
+            'category': lambda i: rng.choice(["campus", "food", "sports", "hostel"]),
+            'coord_x': lambda i: rng.uniform(12.96, 12.98),
+            'coord_y': lambda i: rng.uniform(79.15, 79.17),
+            'visits': lambda i: rng.randint(0, 5000),
+            'xp_reward': lambda i: rng.choice([10, 20, 50]),
+            'level': lambda i: rng.randint(0, 10),
+        }
+        return [tuple(generated[column](i) for column in columns) for i in range(count)]
+
+    @staticmethod
+    def best_of(func, repeat):
+        best, result = None, None
+        for _ in range(max(repeat, 1)):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
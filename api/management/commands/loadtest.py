@@ -0,0 +1,107 @@
+import json
+import logging
+import subprocess
+import time
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from api import loadtest, suggestions
+from api.google_auth import StaticKeySource, key_cache
+from api.positions import position_buffer
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a generated or recorded request trace against a throwaway seeded database "
+        "and report latency percentiles and throughput per route."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help="Size of a generated trace.")
+        parser.add_argument('--trace', help="Replay this JSON lines trace instead of generating one.")
+        parser.add_argument('--record', help="Also write the trace that was replayed to this file.")
+        parser.add_argument('--concurrency', type=int, default=8, help="Client threads sending requests.")
+        parser.add_argument('--warmup', type=int, default=100, help="Requests sent first and left out of the results.")
+        parser.add_argument('--output', default='loadtest.json', help="Where to write the results as JSON.")
+        parser.add_argument('--llm-latency', type=float, default=0.05, help="Seconds the stub LLM takes to answer.")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--places', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=5000)
+        parser.add_argument('--visits', type=int, default=50000)
+        parser.add_argument('--saved', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        if options['trace'] is None and options['requests'] < 1:
+            raise CommandError("Nothing to replay, pass --trace or a positive --requests.")
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        test_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        request_logger = logging.getLogger('django.request')
+        old_level = request_logger.level
+        try:
+            self.stdout.write(f"Seeding {test_name}...")
+            call_command(
+                'seed_synthetic', places=options['places'], users=options['users'], visits=options['visits'],
+                saved=options['saved'], seed=options['seed'], stdout=StringIO(),
+            )
+            if options['trace']:
+                trace = loadtest.load_trace(options['trace'])
+            else:
+                user_ids, place_ids = loadtest.seeded_ids()
+                trace = loadtest.generate_trace(options['requests'], user_ids, place_ids, seed=options['seed'])
+            if options['record']:
+                loadtest.save_trace(trace, options['record'])
+
+            google = loadtest.GoogleStandIn()
+            key_cache.source = StaticKeySource(google.jwks)
+            # Expected 4xx answers (visiting twice, deleting a save that is gone) are part of the mix.
+            request_logger.setLevel(logging.ERROR)
+            with override_settings(GOOGLE_CLIENT_ID=loadtest.GOOGLE_CLIENT_ID, SUGGESTION_MODE='llm'), \
+                    mock.patch.object(suggestions, 'get_client', lambda api_key: loadtest.StubLLM(options['llm_latency'])), \
+                    mock.patch.object(suggestions, 'get_async_client', lambda api_key: loadtest.AsyncStubLLM(options['llm_latency'])):
+                requests = loadtest.prepare(trace, google)
+                if options['warmup']:
+                    loadtest.replay(requests[:options['warmup']], options['concurrency'])
+                results, wall = loadtest.replay(requests, options['concurrency'])
+        finally:
+            request_logger.setLevel(old_level)
+            key_cache.source = None
+            # Write and forget buffered heartbeats while their database still exists.
+            position_buffer.flush()
+            position_buffer.clear()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            "commit": self.git_commit(),
+            "finished_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "config": {key: options[key] for key in (
+                'requests', 'trace', 'concurrency', 'warmup', 'llm_latency', 'seed', 'places', 'users', 'visits', 'saved',
+            )} | {"database": connection.vendor, "trace_length": len(trace)},
+            "wall_seconds": round(wall, 3),
+            **loadtest.summarize(results, wall),
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+
+        self.stdout.write(f"{'route':<36}{'reqs':>7}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'5xx':>6}")
+        for label, row in [*report['routes'].items(), ("overall", report['overall'])]:
+            self.stdout.write(
+                f"{label:<36}{row['requests']:>7}{row['rps']:>9}{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['errors']:>6}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+    @staticmethod
+    def git_commit():
+        try:
+            result = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=5)
+        except (OSError, subprocess.SubprocessError):
+            return None
+        return result.stdout.strip() or None
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.badges import recompute_all
+from api.models import CustomUser, Visit
+
+
+class Command(BaseCommand):
+    help = "Rebuild badge progress counters and badges for every user from their visit history."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help="Users loaded and updated per batch.")
+
+    def handle(self, *args, **options):
+        processed, changed = recompute_all(CustomUser, Visit, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Recomputed badges for {processed} users, {changed} changed."))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from api.models import Place
+from api.visits import unique_visitor_count
+
+
+class Command(BaseCommand):
+    help = "Find places whose unique_visitors counter drifted from their Visit rows and optionally repair them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help="Write the recounted values back.")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Places repaired per bulk update.")
+
+    def handle(self, *args, **options):
+        drifted = (
+            Place.objects.annotate(actual=unique_visitor_count())
+            .exclude(unique_visitors=F('actual'))
+            .values_list('id', 'unique_visitors', 'actual')
+        )
+
+        repairs = []
+        for place_id, stored, actual in drifted.iterator():
+            self.stdout.write(f"Place {place_id}: unique_visitors={stored}, actual={actual}")
+            repairs.append(Place(id=place_id, unique_visitors=actual))
+
+        if not repairs:
+            self.stdout.write(self.style.SUCCESS("No counter drift found."))
+            return
+
+        if not options['fix']:
+            self.stdout.write(self.style.WARNING(f"{len(repairs)} places drifted, rerun with --fix to repair."))
+            return
+
+        Place.objects.bulk_update(repairs, ['unique_visitors'], batch_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Repaired {len(repairs)} places."))
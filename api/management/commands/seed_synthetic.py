@@ -0,0 +1,144 @@
+import random
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from api.badges import RULES, counters_for
+from api.catalog import forget_visit_stamp
+from api.models import CatalogVersion, CustomUser, Place, SavedPlace, Visit
+
+EMAIL_DOMAIN = "synthetic.invalid"
+# Rough bounding box of the campus the app was built for.
+CAMPUS = (12.962, 79.150, 12.978, 79.166)
+
+PLACE_KINDS = [
+    # (name, description, category, type)
+    ("Library", "library", "campus", "inside"),
+    ("Academic Block", "academic building", "campus", "inside"),
+    ("Hostel", "mens hostel", "campus", "inside"),
+    ("Food Court", "food court", "food", "inside"),
+    ("Cafe", "coffee and snacks", "food", "outside"),
+    ("Gym", "gym", "fitness", "inside"),
+    ("Ground", "football ground", "fitness", "outside"),
+    ("RnR", "rnr", "hangout", "inside"),
+    ("Arcade", "arcade", "hangout", "outside"),
+    ("Gate", "", "campus", "outside"),
+]
+
+
+class Command(BaseCommand):
+    help = "Seed a reproducible synthetic dataset of places, users, visits and saved places with bulk inserts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--places', type=int, default=1000)
+        parser.add_argument('--users', type=int, default=5000)
+        parser.add_argument('--visits', type=int, default=50000, help="Roughly how many visits to create in total.")
+        parser.add_argument('--saved', type=int, default=0, help="Roughly how many saved places to create in total.")
+        parser.add_argument('--seed', type=int, default=42, help="Same seed and sizes give the same data.")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Rows per bulk insert.")
+
+    def handle(self, *args, **options):
+        if CustomUser.objects.filter(email__endswith=f"@seed{options['seed']}.{EMAIL_DOMAIN}").exists():
+            raise CommandError(f"Seed {options['seed']} was already loaded, pick another --seed.")
+        if options['places'] < 1 and options['visits'] + options['saved'] > 0:
+            raise CommandError("Visits and saved places need at least one place.")
+
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        places = self.seed_places(rng, options['places'], batch_size)
+        self.seed_users(rng, options, places, batch_size)
+
+    def seed_places(self, rng, count, batch_size):
+        with transaction.atomic():
+            version = CatalogVersion.advance(membership=True)
+            places = []
+            for i in range(count):
+                name, description, category, place_type = rng.choice(PLACE_KINDS)
+                places.append(Place(
+                    name=f"{name} {i + 1}",
+                    type=place_type,
+                    description=description,
+                    category=category,
+                    coord_x=rng.uniform(CAMPUS[0], CAMPUS[2]),
+                    coord_y=rng.uniform(CAMPUS[1], CAMPUS[3]),
+                    level=rng.randint(1, 5),
+                    xp_reward=rng.choice([10, 20, 30, 50]),
+                    approved=rng.random() < 0.95,
+                    version=version,
+                ))
+            Place.objects.bulk_create(places, batch_size=batch_size)
+        self.stdout.write(f"Created {len(places)} places.")
+        return places
+
+    def seed_users(self, rng, options, places, batch_size):
+        user_count = options['users']
+        visits_per_user = options['visits'] / user_count if user_count else 0
+        saved_per_user = options['saved'] / user_count if user_count else 0
+        now = timezone.now()
+        place_visits = [0] * len(places)
+        totals = {'users': 0, 'visits': 0, 'saved': 0}
+
+        for start in range(0, user_count, batch_size):
+            users, visits, saved = [], [], []
+            for i in range(start, min(start + batch_size, user_count)):
+                user = CustomUser(
+                    email=f"user{i + 1}@seed{options['seed']}.{EMAIL_DOMAIN}",
+                    username=f"explorer{i + 1}",
+                    password="!",  # unusable, these accounts only sign in with tokens
+                    avatar=rng.randint(1, 8),
+                    visible=rng.random() < 0.9,
+                    online=rng.random() < 0.2,
+                    coord_x=rng.uniform(CAMPUS[0], CAMPUS[2]),
+                    coord_y=rng.uniform(CAMPUS[1], CAMPUS[3]),
+                )
+                picked = self.pick(rng, len(places), visits_per_user)
+                visited_at = sorted(now - timedelta(seconds=rng.randint(0, 365 * 86400)) for _ in picked)
+                progress = {}
+                for index, when in zip(picked, visited_at):
+                    place = places[index]
+                    place_visits[index] += 1
+                    # Same XP and level rules as recording the visits one by one.
+                    user.xp += place.xp_reward
+                    if user.xp % 100 == 0:
+                        user.level += 1
+                    for key in counters_for(place.description, place.category):
+                        progress[key] = progress.get(key, 0) + 1
+                    visits.append((user, place, when))
+                user.badge_progress = progress
+                user.badges = sorted(badge for badge, rule in RULES.items() if rule(progress))
+                saved.extend((user, places[index]) for index in self.pick(rng, len(places), saved_per_user))
+                users.append(user)
+
+            with transaction.atomic():
+                CustomUser.objects.bulk_create(users, batch_size=batch_size)
+                Visit.objects.bulk_create(
+                    [Visit(user=user, place=place, visited_at=when) for user, place, when in visits],
+                    batch_size=batch_size,
+                )
+                SavedPlace.objects.bulk_create([SavedPlace(user=user, place=place) for user, place in saved], batch_size=batch_size)
+            totals['users'] += len(users)
+            totals['visits'] += len(visits)
+            totals['saved'] += len(saved)
+            self.stdout.write(f"Created {totals['users']}/{user_count} users, {totals['visits']} visits, {totals['saved']} saved places.")
+
+        for place, count in zip(places, place_visits):
+            place.visits = place.unique_visitors = count
+        Place.objects.bulk_update(places, ['visits', 'unique_visitors'], batch_size=batch_size)
+        forget_visit_stamp()
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(places)} places, {totals['users']} users, {totals['visits']} visits and {totals['saved']} saved places."
+        ))
+
+    @staticmethod
+    def pick(rng, place_count, mean):
+        """Distinct place indexes, ``mean`` of them on average, skewed towards popular places."""
+        count = min(place_count, int(rng.uniform(0, 2 * mean) + 0.5))
+        if count > place_count // 4:
+            # The skewed draw would take ages to find the rare tail, go uniform.
+            return rng.sample(range(place_count), count)
+        picked = set()
+        while len(picked) < count:
+            picked.add(int(place_count * rng.random() ** 2))
+        return list(picked)
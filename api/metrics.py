@@ -0,0 +1,237 @@
+"""
+Per-request performance metrics.
+
+``MetricsMiddleware`` times every request, sync or async, and, through a
+database execute wrapper installed on every connection, every query it
+runs, including those an async view makes from ``sync_to_async`` threads.
+Outbound calls are timed by wrapping them in ``upstream("name")``.
+Everything is folded into per-view histograms that ``metrics_view`` serves
+in the Prometheus text format. Requests slower than ``SLOW_REQUEST_MS`` are
+logged with their queries.
+
+Metrics are kept per worker process; scrape each worker, or run one.
+"""
+import contextvars
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger(__name__)
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+# Most queries kept per request for the slow request log.
+MAX_RECORDED_QUERIES = 200
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, in the Prometheus sense."""
+
+    def __init__(self, name, help_text, buckets, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.label_names = label_names
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def clear(self):
+        with self._lock:
+            self._series = {}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        for labels, counts, total in series:
+            label_text = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels))
+            prefix = label_text + "," if label_text else ""
+            cumulative = 0
+            for bound, count in zip([*self.buckets, "+Inf"], counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {cumulative}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_SECONDS = Histogram("vellorun_request_seconds", "Wall time of requests.", SECONDS_BUCKETS, ("view", "method", "status"))
+APP_SECONDS = Histogram(
+    "vellorun_request_app_seconds", "Request time outside SQL and upstream calls (views, serialization).",
+    SECONDS_BUCKETS, ("view", "method"),
+)
+DB_QUERIES = Histogram("vellorun_db_queries", "SQL queries per request.", QUERY_BUCKETS, ("view", "method"))
+DB_SECONDS = Histogram("vellorun_db_seconds", "Time spent in SQL per request.", SECONDS_BUCKETS, ("view", "method"))
+UPSTREAM_SECONDS = Histogram("vellorun_upstream_seconds", "Duration of outbound calls.", SECONDS_BUCKETS, ("view", "upstream"))
+RESPONSE_BYTES = Histogram("vellorun_response_bytes", "Size of response bodies.", BYTES_BUCKETS, ("view", "method"))
+HISTOGRAMS = (REQUEST_SECONDS, APP_SECONDS, DB_QUERIES, DB_SECONDS, UPSTREAM_SECONDS, RESPONSE_BYTES)
+
+
+class RequestMetrics:
+    def __init__(self, view="unmatched"):
+        self.view = view
+        self.queries = []
+        self.query_count = 0
+        self.db_seconds = 0.0
+        self.upstream_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.query_count += 1
+            self.db_seconds += elapsed
+            if len(self.queries) < MAX_RECORDED_QUERIES:
+                self.queries.append((elapsed, sql))
+
+
+@contextmanager
+def upstream(name):
+    """Time an outbound call to ``name``, attributed to the current request's view if there is one."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.upstream_seconds += elapsed
+        UPSTREAM_SECONDS.observe(elapsed, metrics.view if metrics is not None else "background", name)
+
+
+def _record_query(execute, sql, params, many, context):
+    # Execute wrapper on every connection; the request is found through the
+    # context, which sync_to_async carries over to its threads.
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+def _install(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+connection_created.connect(_install)
+
+
+class MetricsMiddleware:
+    """Records wall time, SQL, upstream time and response size for every request."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        # Connections opened before this module was loaded missed the signal.
+        for connection in connections.all(initialized_only=True):
+            _install(connection)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.observe(request, response, metrics, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.observe(request, response, metrics, time.perf_counter() - start)
+        return response
+
+    @staticmethod
+    def observe(request, response, metrics, elapsed):
+        view, method = metrics.view, request.method
+        REQUEST_SECONDS.observe(elapsed, view, method, str(response.status_code))
+        APP_SECONDS.observe(max(0.0, elapsed - metrics.db_seconds - metrics.upstream_seconds), view, method)
+        DB_QUERIES.observe(metrics.query_count, view, method)
+        DB_SECONDS.observe(metrics.db_seconds, view, method)
+        if not response.streaming:
+            RESPONSE_BYTES.observe(len(response.content), view, method)
+
+        if elapsed * 1000 >= settings.SLOW_REQUEST_MS:
+            logger.warning(
+                "Slow request %s %s (%s) took %.1f ms: %d queries in %.1f ms, upstream %.1f ms\n%s",
+                method, request.path, view, elapsed * 1000, metrics.query_count, metrics.db_seconds * 1000,
+                metrics.upstream_seconds * 1000,
+                "\n".join(f"  {seconds * 1000:8.2f} ms  {sql}" for seconds, sql in metrics.queries),
+            )
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Runs once the URL is resolved, before the view, so upstream calls
+        # made by the view are attributed to it.
+        metrics = _current.get()
+        if metrics is not None:
+            match = request.resolver_match
+            metrics.view = match.url_name or match.view_name
+
+
+def counters():
+    """Hit/miss counters of the in-process caches, as (name, help, value) rows."""
+    from .authentication import auth_cache_stats
+    from .suggestions import suggestion_cache
+
+    return [
+        ("vellorun_auth_user_cache_hits_total", "Authenticated users served from the cache.", auth_cache_stats.hits),
+        ("vellorun_auth_user_cache_misses_total", "Authenticated users read from the database.", auth_cache_stats.misses),
+        ("vellorun_suggestion_cache_hits_total", "Suggestions served from the cache.", suggestion_cache.hits),
+        ("vellorun_suggestion_cache_misses_total", "Suggestions computed.", suggestion_cache.misses),
+    ]
+
+
+def render():
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    for name, help_text, value in counters():
+        lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} counter", f"{name} {value}"])
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint. Set ``METRICS_TOKEN`` to require ``Authorization: Bearer <token>``."""
+    token = settings.METRICS_TOKEN
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type="text/plain; version=0.0.4; charset=utf-8")
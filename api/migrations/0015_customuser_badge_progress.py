@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:56
+
+from django.db import migrations, models
+
+# A frozen copy of the badge rules as they were when this migration was
+# written; later rule changes are applied with ``manage.py recompute_badges``.
+EXACT_DESCRIPTIONS = ('library', 'rnr', 'arcade')
+DESCRIPTION_KEYWORDS = ('academic', 'hostel')
+
+
+def counters_for(description, category):
+    description = (description or '').lower()
+    category = (category or '').lower()
+    keys = []
+    if description in EXACT_DESCRIPTIONS:
+        keys.append(f'desc:{description}')
+    keys.extend(f'kw:{keyword}' for keyword in DESCRIPTION_KEYWORDS if keyword in description)
+    if category:
+        keys.append(f'cat:{category}')
+    return keys
+
+
+def badges_for(progress):
+    categories = {key[4:] for key, count in progress.items() if key.startswith('cat:') and count}
+    rules = {
+        'nerd': progress.get('desc:library') or progress.get('kw:academic'),
+        'foodie': progress.get('cat:food'),
+        'gamer': progress.get('desc:rnr') or progress.get('desc:arcade'),
+        'jock': progress.get('cat:fitness'),
+        'sleepyhead': progress.get('kw:hostel') and categories == {'campus'},
+    }
+    return sorted(badge for badge, earned in rules.items() if earned)
+
+
+def backfill_badge_progress(apps, schema_editor):
+    CustomUser = apps.get_model('api', 'CustomUser')
+    Visit = apps.get_model('api', 'Visit')
+    last_id = 0
+    while True:
+        users = list(CustomUser.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:500])
+        if not users:
+            return
+        last_id = users[-1]
+
+        progress = {user_id: {} for user_id in users}
+        visits = Visit.objects.filter(user_id__in=users).values_list('user_id', 'place__description', 'place__category')
+        for user_id, description, category in visits.iterator():
+            for key in counters_for(description, category):
+                progress[user_id][key] = progress[user_id].get(key, 0) + 1
+
+        CustomUser.objects.bulk_update(
+            [CustomUser(pk=user_id, badges=badges_for(counters), badge_progress=counters) for user_id, counters in progress.items()],
+            ['badges', 'badge_progress'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_remove_place_tags_delete_placeimage_delete_tag'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='badge_progress',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.RunPython(backfill_badge_progress, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:57
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_unique_visitors(apps, schema_editor):
+    Place = apps.get_model('api', 'Place')
+    Visit = apps.get_model('api', 'Visit')
+    visitors = (
+        Visit.objects.filter(place=OuterRef('pk'))
+        .order_by().values('place')
+        .annotate(count=Count('user', distinct=True))
+        .values('count')
+    )
+    Place.objects.update(unique_visitors=Coalesce(Subquery(visitors), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_customuser_badge_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='place',
+            name='unique_visitors',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='place',
+            index=models.Index(fields=['-unique_visitors', '-visits'], name='place_leaderboard_idx'),
+        ),
+        migrations.RunPython(backfill_unique_visitors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_place_unique_visitors'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PlaceTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('place_id', models.BigIntegerField(unique=True)),
+                ('version', models.PositiveBigIntegerField(db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='place',
+            name='version',
+            field=models.PositiveBigIntegerField(db_index=True, default=0),
+        ),
+    ]
@@ -1,4 +1,8 @@
-from django.db import models
+import uuid
+
+from django.db import models, transaction
+from django.db.models import F
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 
 class CustomUser(AbstractUser):
@@ -13,10 +17,20 @@ class CustomUser(AbstractUser):
     coord_x = models.FloatField(default=0)
     coord_y = models.FloatField(default=0)
     badges = models.JSONField(default=list, blank=True)
+    badge_progress = models.JSONField(default=dict, blank=True)
+    # Replaced on every write of what the user's bundle shows, for its ETag
+    # (see api/user_versions.py).
+    version = models.UUIDField(default=uuid.uuid4, editable=False)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
 
+    def save(self, *args, **kwargs):
+        self.version = uuid.uuid4()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        super().save(*args, **kwargs)
+
 
 class Place(models.Model):
     created_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, related_name='contributed_places')
@@ -33,18 +47,75 @@ class Place(models.Model):
     coord_x = models.FloatField()
     coord_y = models.FloatField()
     visits = models.PositiveIntegerField(default=0)
+    unique_visitors = models.PositiveIntegerField(default=0)
     level = models.PositiveIntegerField(default=1)
     xp_reward = models.IntegerField(default=20)
     approved = models.BooleanField(default=False)
+    # Catalog version of the last write, for delta sync. Visit counters are
+    # bumped with F() updates and deliberately do not move it (see api/catalog.py).
+    version = models.PositiveBigIntegerField(default=0, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-unique_visitors', '-visits'], name='place_leaderboard_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'approved' in field_names:
+            instance._loaded_approved = values[field_names.index('approved')]
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Unknown when ``approved`` was deferred, then count it as changed.
+        membership = self._state.adding or getattr(self, '_loaded_approved', None) != self.approved
+        with transaction.atomic():
+            self.version = CatalogVersion.advance(membership=membership)
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+            super().save(*args, **kwargs)
+        self._loaded_approved = self.approved
+
+
+class CatalogVersion(models.Model):
+    """Single-row counter handing out place catalog versions."""
+    version = models.PositiveBigIntegerField(default=0)
+    # Moves only when a place is created, approved or unapproved, or deleted,
+    # i.e. when the set of places changes rather than one place's details.
+    membership = models.PositiveBigIntegerField(default=0)
+
+    @classmethod
+    def advance(cls, membership=False):
+        """
+        Take the next catalog version, moving ``membership`` too if asked.
+
+        The counter row stays locked until the caller's transaction commits,
+        so versions become visible in the order they were handed out and a
+        client syncing from version N never misses a slower writer's N - 1.
+        """
+        changes = {'version': F('version') + 1}
+        if membership:
+            changes['membership'] = F('membership') + 1
+        if not cls.objects.filter(pk=1).update(**changes):
+            cls.objects.get_or_create(pk=1)
+            cls.objects.filter(pk=1).update(**changes)
+        return cls.objects.values_list('version', flat=True).get(pk=1)
+
+
+class PlaceTombstone(models.Model):
+    """Remembers deleted places so delta sync can tell clients to drop them."""
+    place_id = models.BigIntegerField(unique=True)
+    version = models.PositiveBigIntegerField(db_index=True)
+
 
 class Visit(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     place = models.ForeignKey(Place, on_delete=models.CASCADE)
-    visited_at = models.DateTimeField(auto_now_add=True)
+    visited_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         unique_together = ('user', 'place')
@@ -0,0 +1,69 @@
+from bisect import bisect_right
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+
+class OptionalCursorPagination(CursorPagination):
+    """
+    Keyset pagination on an increasing column, so pages stay stable while
+    rows are inserted.
+
+    Only used when the client asks for it with ``?cursor=`` or
+    ``?page_size=``; without either the endpoint returns its full list as
+    it always has.
+    """
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    @staticmethod
+    def requested(request):
+        return 'cursor' in request.query_params or 'page_size' in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.requested(request):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+def paginate_ids(request, queryset, field, view=None):
+    """
+    Page through the ``field`` values of ``queryset`` when the client asked for pages.
+
+    Returns:
+        tuple: (list of values, link to the next page or None, whether the result is paginated)
+    """
+    paginator = OptionalCursorPagination()
+    paginator.ordering = field
+    page = paginator.paginate_queryset(queryset.values(field), request, view)
+    if page is None:
+        return list(queryset.values_list(field, flat=True)), None, False
+    return [row[field] for row in page], paginator.get_next_link(), True
+
+
+def paginate_id_set(request, ids, view=None):
+    """
+    Like ``paginate_ids`` for IDs already in memory, so they never go into a query whole.
+
+    Returns:
+        tuple: (sorted IDs on this page, link to the next page or None, whether the result is paginated)
+    """
+    ids = sorted(ids)
+    paginator = OptionalCursorPagination()
+    if not paginator.requested(request):
+        return ids, None, False
+    paginator.base_url = request.build_absolute_uri()
+    page_size = paginator.get_page_size(request)
+    cursor = paginator.decode_cursor(request)
+    start = 0
+    if cursor is not None and cursor.position is not None:
+        try:
+            start = bisect_right(ids, int(cursor.position))
+        except ValueError:
+            raise NotFound(paginator.invalid_cursor_message)
+    page = ids[start:start + page_size]
+    if start + page_size >= len(ids):
+        return page, None, True
+    return page, paginator.encode_cursor(Cursor(offset=0, reverse=False, position=page[-1])), True
@@ -0,0 +1,289 @@
+"""
+Write-coalescing buffer for user positions.
+
+Heartbeats land here instead of in the users table. The buffer keeps only
+the newest position per user and a background thread writes them back with
+one batched UPDATE every ``POSITION_FLUSH_INTERVAL`` seconds, so a user
+reporting their position several times a minute costs one row write per
+interval at most. Reads that show positions overlay the buffered ones, so
+nothing looks stale in the meantime.
+
+Where positions wait is pluggable through ``POSITION_BACKEND``, like
+presence: ``MemoryPositions`` keeps them in the worker, which is enough for
+a single worker and tests; ``CachePositions`` keeps them in the Django
+cache, shared by every worker pointed at the same cache server. Only then
+do a user's heartbeats handled by different workers end in one entry, so
+the newest always wins, and one worker per interval takes the flush lock
+and writes them all.
+"""
+import atexit
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from .authentication import forget_users
+from .spatial import user_index
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryPositions:
+    shared = False
+
+    def __init__(self):
+        self._pending = {}
+        # Positions taken by a flush that has not committed yet; still
+        # overlaid so reads never fall back to the old row.
+        self._flushing = {}
+        self._lock = threading.Lock()
+
+    def put(self, user_id, x, y):
+        with self._lock:
+            self._pending[user_id] = (x, y)
+
+    def get(self, user_id):
+        with self._lock:
+            return self._pending.get(user_id) or self._flushing.get(user_id)
+
+    def overlay(self):
+        with self._lock:
+            return {**self._flushing, **self._pending}
+
+    def take(self):
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            self._flushing = batch
+        return batch
+
+    def settle(self, batch, written):
+        with self._lock:
+            if not written:
+                # Put the positions back unless a newer one arrived meanwhile.
+                self._pending = {**batch, **self._pending}
+            self._flushing = {}
+
+    def discard(self, user_id):
+        with self._lock:
+            self._pending.pop(user_id, None)
+            self._flushing.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._pending = {}
+            self._flushing = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+
+class CachePositions:
+    """
+    Positions as expiring cache keys, one per user.
+
+    Every entry carries a token and the token last written to the database
+    is kept next to it, so a flush only writes positions that changed and a
+    heartbeat racing a flush is never marked written. Entries outlive their
+    flush by ``USER_INDEX_TTL`` seconds, so other workers can move users on
+    their map before they reload it. User IDs are listed in roster sets
+    split by user ID, like in api/presence.py.
+    """
+
+    SHARDS = 64
+    shared = True
+
+    def __init__(self, alias="default"):
+        self.cache = caches[alias]
+
+    @staticmethod
+    def _key(user_id):
+        return f"positions:user:{user_id}"
+
+    @staticmethod
+    def _written_key(user_id):
+        return f"positions:written:{user_id}"
+
+    def _roster_key(self, user_id):
+        return f"positions:roster:{user_id % self.SHARDS}"
+
+    @staticmethod
+    def _ttl():
+        return settings.USER_INDEX_TTL + 2 * settings.POSITION_FLUSH_INTERVAL
+
+    def _entries(self):
+        """{user_id: (x, y, token)} for every live entry, dropping expired IDs from the rosters."""
+        rosters = self.cache.get_many([f"positions:roster:{shard}" for shard in range(self.SHARDS)])
+        listed = set().union(*rosters.values()) if rosters else set()
+        found = self.cache.get_many([self._key(user_id) for user_id in listed])
+        entries = {user_id: found[self._key(user_id)] for user_id in listed if self._key(user_id) in found}
+        for roster_key, roster in rosters.items():
+            if not roster <= entries.keys():
+                self.cache.set(roster_key, roster & entries.keys(), None)
+        return entries
+
+    def _unwritten(self):
+        entries = self._entries()
+        written = self.cache.get_many([self._written_key(user_id) for user_id in entries])
+        return {
+            user_id: entry for user_id, entry in entries.items()
+            if written.get(self._written_key(user_id)) != entry[2]
+        }
+
+    def put(self, user_id, x, y):
+        self.cache.set(self._key(user_id), (x, y, uuid.uuid4().hex), self._ttl())
+        roster_key = self._roster_key(user_id)
+        roster = self.cache.get(roster_key) or set()
+        if user_id not in roster:
+            self.cache.set(roster_key, roster | {user_id}, None)
+
+    def get(self, user_id):
+        entry = self.cache.get(self._key(user_id))
+        return entry[:2] if entry is not None else None
+
+    def overlay(self):
+        return {user_id: entry[:2] for user_id, entry in self._entries().items()}
+
+    def take(self):
+        self._taken = self._unwritten()
+        return {user_id: entry[:2] for user_id, entry in self._taken.items()}
+
+    def settle(self, batch, written):
+        if written:
+            self.cache.set_many(
+                {self._written_key(user_id): entry[2] for user_id, entry in self._taken.items()}, self._ttl(),
+            )
+        self._taken = {}
+
+    def discard(self, user_id):
+        self.cache.delete_many([self._key(user_id), self._written_key(user_id)])
+
+    def clear(self):
+        rosters = self.cache.get_many([f"positions:roster:{shard}" for shard in range(self.SHARDS)])
+        listed = [user_id for roster in rosters.values() for user_id in roster]
+        self.cache.delete_many([self._key(user_id) for user_id in listed] + [self._written_key(user_id) for user_id in listed])
+        self.cache.delete_many(list(rosters))
+
+    def __len__(self):
+        return len(self._unwritten())
+
+
+class PositionBuffer:
+    FLUSH_LOCK_KEY = "positions:flush-lock"
+
+    def __init__(self):
+        self._backend = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = import_string(settings.POSITION_BACKEND)()
+        return self._backend
+
+    def push(self, user_id, x, y):
+        """Record the latest position of ``user_id`` and move them on the live map."""
+        self.backend.put(user_id, x, y)
+        user_index.move(user_id, x, y)
+        if settings.POSITION_FLUSH_INTERVAL <= 0:
+            self.flush()
+        else:
+            self._ensure_flusher()
+
+    def get(self, user_id):
+        """The buffered (coord_x, coord_y) of ``user_id``, or None if the row is current."""
+        return self.backend.get(user_id)
+
+    def overlay(self):
+        """Every buffered position, {user_id: (coord_x, coord_y)}."""
+        return self.backend.overlay()
+
+    def apply(self, users):
+        """Set the buffered positions on ``users`` (model instances) and return them as a list."""
+        overlay = self.overlay()
+        users = list(users)
+        for user in users:
+            position = overlay.get(user.pk)
+            if position is not None:
+                user.coord_x, user.coord_y = position
+        return users
+
+    def discard(self, user_id):
+        """Forget the buffered position, for when coordinates were written directly."""
+        self.backend.discard(user_id)
+
+    def clear(self):
+        self.backend.clear()
+
+    def __len__(self):
+        return len(self.backend)
+
+    def flush(self):
+        """
+        Write every buffered position with batched UPDATEs.
+
+        Returns:
+            int: Number of users written, 0 when another worker holds the
+            flush lock for this interval
+        """
+        from .models import CustomUser
+
+        with self._flush_lock:
+            backend = self.backend
+            interval = settings.POSITION_FLUSH_INTERVAL
+            # Held a little under one interval, so each interval one worker writes.
+            if backend.shared and interval > 0 and not backend.cache.add(self.FLUSH_LOCK_KEY, 1, interval * 0.9):
+                return 0
+            batch = backend.take()
+            if not batch:
+                return 0
+            try:
+                version = uuid.uuid4()
+                CustomUser.objects.bulk_update(
+                    [CustomUser(pk=user_id, coord_x=x, coord_y=y, version=version) for user_id, (x, y) in batch.items()],
+                    ['coord_x', 'coord_y', 'version'],
+                    batch_size=settings.POSITION_FLUSH_BATCH,
+                )
+            except Exception:
+                backend.settle(batch, written=False)
+                raise
+            backend.settle(batch, written=True)
+            # bulk_update sends no signals, so drop the cached copies here.
+            forget_users(batch)
+            return len(batch)
+
+    def _ensure_flusher(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='position-flusher', daemon=True)
+                self._thread.start()
+                atexit.register(self._flush_at_exit)
+
+    def _run(self):
+        while True:
+            time.sleep(settings.POSITION_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Flushing buffered positions failed, retrying next interval")
+            finally:
+                connection.close()
+
+    def _flush_at_exit(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Flushing buffered positions at exit failed")
+
+
+position_buffer = PositionBuffer()
@@ -0,0 +1,224 @@
+"""
+Who is online, decided by heartbeats instead of a flag the client sets.
+
+Every heartbeat refreshes the user's entry for ``PRESENCE_TTL`` seconds; a
+client that crashes or loses signal simply stops refreshing and drops off
+the map once it expires. Online lists read the store, and every
+``PRESENCE_SYNC_INTERVAL`` seconds a background thread takes expired users
+off the map.
+
+Where entries live is pluggable through ``PRESENCE_BACKEND``:
+``MemoryPresence`` keeps them in the worker, which is enough for a single
+worker and tests; ``CachePresence`` keeps them in the Django cache, shared
+by every worker pointed at the same cache server. Only a shared store knows
+everyone who is online, so only then is it copied into the ``online``
+column, by whichever worker takes the sync lock for that interval, with a
+few batched UPDATEs. Otherwise profiles read the store directly.
+"""
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from .authentication import forget_users
+from .live import live_hub
+from .spatial import user_index
+from .user_versions import bump_user_versions
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryPresence:
+    shared = False
+
+    def __init__(self):
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    def touch(self, user_id, ttl):
+        now = time.monotonic()
+        with self._lock:
+            arrived = self._expires.get(user_id, 0.0) <= now
+            self._expires[user_id] = now + ttl
+        return arrived
+
+    def remove(self, user_id):
+        with self._lock:
+            self._expires.pop(user_id, None)
+
+    def contains(self, user_id):
+        return self._expires.get(user_id, 0.0) > time.monotonic()
+
+    def online(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [user_id for user_id, expires in self._expires.items() if expires <= now]
+            for user_id in expired:
+                del self._expires[user_id]
+            return set(self._expires)
+
+    def clear(self):
+        with self._lock:
+            self._expires = {}
+
+
+class CachePresence:
+    """
+    Entries as expiring cache keys, one per user.
+
+    Caches cannot list their keys, so user IDs are also kept in a few roster
+    sets. A roster is only rewritten when a user is missing from it or has
+    expired, and rosters are split by user ID so concurrent workers rarely
+    write the same one; a heartbeat puts back any ID a race dropped.
+    """
+
+    SHARDS = 64
+    shared = True
+
+    def __init__(self, alias="default"):
+        self.cache = caches[alias]
+
+    @staticmethod
+    def _key(user_id):
+        return f"presence:user:{user_id}"
+
+    def _roster_key(self, user_id):
+        return f"presence:roster:{user_id % self.SHARDS}"
+
+    def touch(self, user_id, ttl):
+        key = self._key(user_id)
+        arrived = self.cache.add(key, 1, ttl)
+        if not arrived and not self.cache.touch(key, ttl):
+            # Expired between the two calls.
+            self.cache.set(key, 1, ttl)
+            arrived = True
+        roster_key = self._roster_key(user_id)
+        roster = self.cache.get(roster_key) or set()
+        if user_id not in roster:
+            self.cache.set(roster_key, roster | {user_id}, None)
+        return arrived
+
+    def remove(self, user_id):
+        self.cache.delete(self._key(user_id))
+
+    def contains(self, user_id):
+        return self.cache.get(self._key(user_id)) is not None
+
+    def online(self):
+        rosters = self.cache.get_many([f"presence:roster:{shard}" for shard in range(self.SHARDS)])
+        listed = set().union(*rosters.values()) if rosters else set()
+        present = self.cache.get_many([self._key(user_id) for user_id in listed])
+        online = {user_id for user_id in listed if self._key(user_id) in present}
+        for roster_key, roster in rosters.items():
+            if not roster <= online:
+                self.cache.set(roster_key, roster & online, None)
+        return online
+
+    def clear(self):
+        rosters = self.cache.get_many([f"presence:roster:{shard}" for shard in range(self.SHARDS)])
+        self.cache.delete_many([self._key(user_id) for roster in rosters.values() for user_id in roster])
+        self.cache.delete_many(list(rosters))
+
+
+class PresenceStore:
+    SYNC_LOCK_KEY = "presence:sync-lock"
+
+    def __init__(self):
+        self._backend = None
+        # Who was online at the last sync, for stores the column does not follow.
+        self._online = set()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = import_string(settings.PRESENCE_BACKEND)()
+        return self._backend
+
+    def touch(self, user_id):
+        """
+        Refresh ``user_id``'s presence.
+
+        Returns:
+            bool: True if they were not online before
+        """
+        arrived = self.backend.touch(user_id, settings.PRESENCE_TTL)
+        self._ensure_syncer()
+        return arrived
+
+    def leave(self, user_id):
+        self.backend.remove(user_id)
+
+    def is_online(self, user_id):
+        return self.backend.contains(user_id)
+
+    def online_ids(self):
+        return self.backend.online()
+
+    def clear(self):
+        self.backend.clear()
+        self._online = set()
+
+    def sync(self):
+        """
+        Take expired users off the map and, with a shared store, copy it into the ``online`` column.
+
+        Returns:
+            tuple: (users marked online, users marked offline) in the database,
+            (0, 0) when this worker did not write the column
+        """
+        from .models import CustomUser
+
+        online = self.online_ids()
+        for user_id in [user_id for user_id in list(user_index.profiles) if user_id not in online]:
+            user_index.discard(user_id)
+            live_hub.publish({'type': 'leave', 'id': user_id})
+
+        if not self.backend.shared:
+            # Profiles read this worker's store, have the ones that changed refetched.
+            changed, self._online = sorted(online ^ self._online), online
+            bump_user_versions(changed, settings.PRESENCE_SYNC_BATCH)
+            return 0, 0
+        interval = settings.PRESENCE_SYNC_INTERVAL
+        # Held a little under one interval, so each interval one worker writes.
+        if interval > 0 and not self.backend.cache.add(self.SYNC_LOCK_KEY, 1, interval * 0.9):
+            return 0, 0
+
+        stored = set(CustomUser.objects.filter(online=True).values_list('id', flat=True))
+        arrived, left = sorted(online - stored), sorted(stored - online)
+        batch = settings.PRESENCE_SYNC_BATCH
+        for flag, user_ids in ((True, arrived), (False, left)):
+            for start in range(0, len(user_ids), batch):
+                CustomUser.objects.filter(pk__in=user_ids[start:start + batch]).update(online=flag, version=uuid.uuid4())
+        # update() sends no signals, so drop the cached copies here.
+        forget_users(arrived + left)
+        return len(arrived), len(left)
+
+    def _ensure_syncer(self):
+        if self._thread is not None or settings.PRESENCE_SYNC_INTERVAL <= 0:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='presence-sync', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(settings.PRESENCE_SYNC_INTERVAL)
+            try:
+                self.sync()
+            except Exception:
+                logger.exception("Syncing presence failed, retrying next interval")
+            finally:
+                connection.close()
+
+
+presence = PresenceStore()
@@ -0,0 +1,84 @@
+from collections import Counter
+
+import numpy as np
+from django.conf import settings
+
+from .models import Place
+from .spatial import EARTH_RADIUS_M
+
+# Relative weight of each signal in the final score.
+WEIGHTS = {
+    "affinity": 0.4,
+    "popularity": 0.25,
+    "proximity": 0.25,
+    "reward": 0.1,
+}
+
+
+def score_places(categories, visits, coord_x, coord_y, xp_reward, category_counts, origin=None):
+    """
+    Score candidate places in one vectorized pass.
+
+    Args:
+        categories (np.ndarray): Category of each candidate
+        visits, coord_x, coord_y, xp_reward (np.ndarray): Per-candidate columns
+        category_counts (Counter): How often the user visited each category
+        origin (tuple): The user's (coord_x, coord_y), or None to ignore distance
+
+    Returns:
+        np.ndarray: One score per candidate, higher is better
+    """
+    total = sum(category_counts.values())
+    labels, inverse = np.unique(categories, return_inverse=True)
+    shares = np.array([category_counts.get(label, 0) / total if total else 0.0 for label in labels])
+    affinity = shares[inverse]
+
+    popularity = np.log1p(visits)
+    popularity = popularity / popularity.max() if popularity.max() > 0 else popularity
+
+    reward = xp_reward / xp_reward.max() if xp_reward.max() > 0 else np.zeros_like(xp_reward)
+
+    scores = WEIGHTS["affinity"] * affinity + WEIGHTS["popularity"] * popularity + WEIGHTS["reward"] * reward
+
+    if origin is not None:
+        lat1, lng1 = np.radians(origin[0]), np.radians(origin[1])
+        lat2, lng2 = np.radians(coord_x), np.radians(coord_y)
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+        distance = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+        scores += WEIGHTS["proximity"] * np.exp(-distance / settings.SUGGESTION_DISTANCE_SCALE_M)
+
+    return scores
+
+
+def recommend_places(user, visited_places, count=3):
+    """
+    Rank every approved place the user has not visited and return the best IDs.
+
+    ``visited_places`` is a list of (id, category) pairs for the user's visits.
+    Runs one query for the candidates and no network calls.
+    """
+    visited_ids = [place_id for place_id, _ in visited_places]
+    rows = list(
+        Place.objects.filter(approved=True).exclude(id__in=visited_ids)
+        .values_list("id", "category", "visits", "coord_x", "coord_y", "xp_reward")
+    )
+    if not rows:
+        return []
+
+    ids, categories, visits, coord_x, coord_y, xp_reward = zip(*rows)
+    # The model defaults coordinates to 0, which means "never reported".
+    origin = (user.coord_x, user.coord_y) if (user.coord_x or user.coord_y) else None
+    scores = score_places(
+        np.array(categories, dtype=object),
+        np.array(visits, dtype=float),
+        np.array(coord_x, dtype=float),
+        np.array(coord_y, dtype=float),
+        np.array(xp_reward, dtype=float),
+        Counter(category for _, category in visited_places if category),
+        origin,
+    )
+
+    count = min(count, len(ids))
+    best = np.argpartition(-scores, count - 1)[:count]
+    best = best[np.argsort(-scores[best], kind="stable")]
+    return [ids[i] for i in best]
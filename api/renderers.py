@@ -0,0 +1,27 @@
+import orjson
+from rest_framework.renderers import JSONRenderer
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that hands responses marked ``fast_json`` to orjson.
+
+    Only the view knows the payload is plain JSON types with finite floats,
+    the case where orjson writes exactly the bytes the stock renderer would,
+    so everything else (errors, pretty printing, unmarked data) goes through
+    the stock renderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        renderer_context = renderer_context or {}
+        response = renderer_context.get('response')
+        if (
+            data is None
+            or not getattr(response, 'fast_json', False)
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        # Same JavaScript-safety escaping as the stock renderer.
+        return orjson.dumps(data).replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
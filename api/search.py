@@ -0,0 +1,215 @@
+"""
+In-process full-text index over approved places.
+
+Name, category and description are split into lowercase, accent-free
+tokens with postings ``token -> {place_id: weight}``; a name hit weighs more
+than a category hit, which weighs more than a description hit. Queries
+match every term, the last one as a prefix so results follow the user's
+keystrokes, and are ranked by the weights scaled with how rare each term
+is, optionally boosted by closeness to a point.
+
+Like the spatial index it is loaded lazily, kept current by Place signals
+and reloaded every ``SEARCH_INDEX_TTL`` seconds; a query never touches the
+database.
+"""
+import heapq
+import math
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .spatial import haversine
+
+FIELD_WEIGHTS = {"name": 3.0, "category": 2.0, "description": 1.0}
+# A prefix hit counts a little less than the whole word.
+PREFIX_FACTOR = 0.8
+# Most vocabulary words a prefix expands to, the most common ones win.
+MAX_PREFIX_EXPANSIONS = 64
+RESULT_CACHE_SIZE = 2048
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    text = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode().lower()
+    return _TOKEN.findall(text)
+
+
+class SearchIndex:
+    def __init__(self):
+        self._postings = None
+        self._vocabulary = []
+        self._docs = {}
+        self._generation = 0
+        self._results = OrderedDict()
+        self._loaded_at = 0.0
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _weights(doc):
+        weights = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in set(tokenize(doc[field])):
+                weights[token] = weights.get(token, 0.0) + weight
+        return weights
+
+    @staticmethod
+    def _doc(place_id, name, description, category, place_type, coord_x, coord_y):
+        return {
+            "id": place_id, "name": name, "type": place_type, "category": category,
+            "description": description, "coord_x": coord_x, "coord_y": coord_y,
+        }
+
+    def _ensure_loaded(self):
+        ttl = settings.SEARCH_INDEX_TTL
+        if self._postings is not None and time.monotonic() - self._loaded_at < ttl:
+            return
+        with self._lock:
+            if self._postings is None or time.monotonic() - self._loaded_at >= ttl:
+                from .models import Place
+
+                rows = Place.objects.filter(approved=True).values_list(
+                    "id", "name", "description", "category", "type", "coord_x", "coord_y",
+                )
+                docs, postings = {}, {}
+                for row in rows.iterator():
+                    doc = docs[row[0]] = self._doc(*row)
+                    for token, weight in self._weights(doc).items():
+                        postings.setdefault(token, {})[doc["id"]] = weight
+                self._docs, self._postings = docs, postings
+                self._vocabulary = sorted(postings)
+                self._generation += 1
+                self._loaded_at = time.monotonic()
+
+    def sync(self, place):
+        if not place.approved:
+            self.discard(place.pk)
+            return
+        doc = self._doc(place.pk, place.name, place.description, place.category, place.type, place.coord_x, place.coord_y)
+        self._write(place.pk, doc)
+
+    def discard(self, place_id):
+        self._write(place_id, None)
+
+    def _write(self, place_id, doc):
+        # Postings are replaced rather than changed in place, so queries
+        # running meanwhile keep iterating a consistent copy.
+        with self._lock:
+            if self._postings is None:
+                return
+            old = self._docs.get(place_id)
+            old_weights = self._weights(old) if old else {}
+            new_weights = self._weights(doc) if doc else {}
+            vocabulary_changed = False
+            for token in old_weights.keys() | new_weights.keys():
+                posting = dict(self._postings.get(token, {}))
+                if token in new_weights:
+                    posting[place_id] = new_weights[token]
+                else:
+                    posting.pop(place_id, None)
+                if posting:
+                    vocabulary_changed |= token not in self._postings
+                    self._postings[token] = posting
+                elif token in self._postings:
+                    del self._postings[token]
+                    vocabulary_changed = True
+            if doc:
+                self._docs[place_id] = doc
+            else:
+                self._docs.pop(place_id, None)
+            if vocabulary_changed:
+                self._vocabulary = sorted(self._postings)
+            self._generation += 1
+
+    def reset(self):
+        with self._lock:
+            self._postings = None
+            self._vocabulary = []
+            self._docs = {}
+            self._results.clear()
+
+    def _expand(self, prefix):
+        vocabulary, postings = self._vocabulary, self._postings
+        start = bisect_left(vocabulary, prefix)
+        end = bisect_left(vocabulary, prefix + "\uffff", start)
+        words = vocabulary[start:end]
+        if len(words) > MAX_PREFIX_EXPANSIONS:
+            words = heapq.nlargest(MAX_PREFIX_EXPANSIONS, words, key=lambda word: len(postings.get(word, ())))
+        return words
+
+    def _scores(self, terms):
+        postings, total = self._postings, max(len(self._docs), 1)
+        scores = None
+        for position, term in enumerate(terms):
+            term_scores = {}
+            words = self._expand(term) if position == len(terms) - 1 else [term]
+            for word in words:
+                posting = postings.get(word)
+                if not posting:
+                    continue
+                factor = 1.0 if word == term else PREFIX_FACTOR
+                idf = math.log(1 + total / len(posting))
+                for place_id, weight in posting.items():
+                    score = idf * weight * factor
+                    if score > term_scores.get(place_id, 0.0):
+                        term_scores[place_id] = score
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {place_id: score + term_scores[place_id] for place_id, score in scores.items() if place_id in term_scores}
+            if not scores:
+                return {}
+        return scores
+
+    def search(self, query, limit=20, origin=None):
+        """
+        Approved places matching every word of ``query``, best first.
+
+        Args:
+            query (str): What the user typed so far
+            limit (int): Most results to return
+            origin (tuple): Optional (coord_x, coord_y); closer places rank higher
+
+        Returns:
+            list: Place dicts with ``score`` and, with an origin, ``distance`` in meters
+        """
+        self._ensure_loaded()
+        terms = tokenize(query)
+        if not terms:
+            return []
+        key = (self._generation, tuple(terms), limit, origin)
+        cached = self._results.get(key)
+        if cached is not None:
+            return cached
+
+        scores = self._scores(terms)
+        docs = self._docs
+        if origin is not None:
+            scale, boost = settings.SEARCH_DISTANCE_SCALE_M, settings.SEARCH_DISTANCE_BOOST
+            distances = {}
+            for place_id in scores:
+                doc = docs[place_id]
+                distances[place_id] = haversine(origin[0], origin[1], doc["coord_x"], doc["coord_y"])
+                scores[place_id] *= 1 + boost * math.exp(-distances[place_id] / scale)
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+
+        results = []
+        for place_id, score in best:
+            result = {**docs[place_id], "score": round(score, 4)}
+            if origin is not None:
+                result["distance"] = round(distances[place_id], 1)
+            results.append(result)
+
+        with self._lock:
+            self._results[key] = results
+            while len(self._results) > RESULT_CACHE_SIZE:
+                self._results.popitem(last=False)
+        return results
+
+
+search_index = SearchIndex()
@@ -1,6 +1,10 @@
+from math import isfinite
+
+from django.conf import settings
 from rest_framework import serializers
 from django.contrib.auth.password_validation import validate_password
 from .models import CustomUser, Place, SavedPlace
+from .presence import presence
 
 class GoogleAuthSerializer(serializers.Serializer):
     id_token = serializers.CharField()
@@ -26,8 +30,49 @@ class ProfileSerializer(serializers.ModelSerializer):
         fields = ['username', 'email', 'avatar', 'badges', 'xp', 'level', 'visible', 'online', 'coord_x', 'coord_y']
         read_only_fields = ['username', 'xp', 'level', 'badges']
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if 'online' in data and not presence.backend.shared:
+            # The column only follows shared stores (see api/presence.py).
+            data['online'] = presence.is_online(instance.pk)
+        return data
+
+    def update(self, instance, validated_data):
+        # The instance may be a cached copy (see api/authentication.py), so
+        # write only what the client sent and never its stale xp or badges.
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        instance.save(update_fields=list(validated_data))
+        return instance
+
+
+def requested_fields(request, allowed):
+    """
+    Field names picked with ``?fields=a,b,c``, limited to ``allowed``.
+
+    Returns None when the client did not narrow the fields (or named none we know).
+    """
+    if request is None or not request.query_params.get('fields'):
+        return None
+    fields = [name for name in dict.fromkeys(request.query_params['fields'].split(',')) if name in allowed]
+    return fields or None
+
+
+class SparseFieldsMixin:
+    """Drops every field not named in ``?fields=`` on read requests."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return
+        fields = requested_fields(request, self.fields)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
 
-class PlaceSerializer(serializers.ModelSerializer):
+
+class PlaceSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Place
         fields = ['id', 'name', 'type', 'description', 'category', 'coord_x', 'coord_y', 'visits', 'xp_reward', 'level']
@@ -37,15 +82,135 @@ class PlaceSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         data = super().to_representation(instance)
         request = self.context.get('request')
-        if request and request.user.is_superuser:
+        if request and request.user.is_superuser and self.wants_approved(request):
             data['approved'] = instance.approved
         return data
 
+    @staticmethod
+    def wants_approved(request):
+        fields = requested_fields(request, PlaceSerializer.Meta.fields + ['approved'])
+        return fields is None or 'approved' in fields
+
+
+class NearbyPlacesSerializer(serializers.Serializer):
+    coord_x = serializers.FloatField(min_value=-90, max_value=90)
+    coord_y = serializers.FloatField(min_value=-180, max_value=180)
+    radius = serializers.FloatField(min_value=1, max_value=50000, required=False)
+    k = serializers.IntegerField(min_value=1, max_value=100, required=False)
+
+    def validate(self, attrs):
+        if 'radius' not in attrs and 'k' not in attrs:
+            raise serializers.ValidationError("Either radius or k is required.")
+        return attrs
+
+
+class PlaceSearchSerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=100)
+    coord_x = serializers.FloatField(min_value=-90, max_value=90, required=False)
+    coord_y = serializers.FloatField(min_value=-180, max_value=180, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=50, default=20)
+
+    def validate(self, attrs):
+        if ('coord_x' in attrs) != ('coord_y' in attrs):
+            raise serializers.ValidationError("Pass both coord_x and coord_y, or neither.")
+        return attrs
+
+
+class HeartbeatSerializer(serializers.Serializer):
+    coord_x = serializers.FloatField(min_value=-90, max_value=90)
+    coord_y = serializers.FloatField(min_value=-180, max_value=180)
+
+
+class NearbyUsersSerializer(serializers.Serializer):
+    coord_x = serializers.FloatField(min_value=-90, max_value=90, required=False)
+    coord_y = serializers.FloatField(min_value=-180, max_value=180, required=False)
+    radius = serializers.FloatField(min_value=1, max_value=50000, required=False)
+    min_x = serializers.FloatField(min_value=-90, max_value=90, required=False)
+    min_y = serializers.FloatField(min_value=-180, max_value=180, required=False)
+    max_x = serializers.FloatField(min_value=-90, max_value=90, required=False)
+    max_y = serializers.FloatField(min_value=-180, max_value=180, required=False)
+
+    def validate(self, attrs):
+        circle = {'coord_x', 'coord_y', 'radius'}
+        box = {'min_x', 'min_y', 'max_x', 'max_y'}
+        if circle <= attrs.keys():
+            return attrs
+        if box <= attrs.keys():
+            if attrs['min_x'] > attrs['max_x'] or attrs['min_y'] > attrs['max_y']:
+                raise serializers.ValidationError("min_x/min_y must not exceed max_x/max_y.")
+            return attrs
+        raise serializers.ValidationError("Pass coord_x, coord_y and radius, or min_x, min_y, max_x and max_y.")
+
+
+class ViewportSerializer(serializers.Serializer):
+    min_x = serializers.FloatField(min_value=-90, max_value=90)
+    min_y = serializers.FloatField(min_value=-180, max_value=180)
+    max_x = serializers.FloatField(min_value=-90, max_value=90)
+    max_y = serializers.FloatField(min_value=-180, max_value=180)
+
+    def validate(self, attrs):
+        if attrs['min_x'] > attrs['max_x'] or attrs['min_y'] > attrs['max_y']:
+            raise serializers.ValidationError("min_x/min_y must not exceed max_x/max_y.")
+        return attrs
+
+
+class LeaderboardPageSerializer(serializers.Serializer):
+    page = serializers.IntegerField(min_value=1, default=1)
+    page_size = serializers.IntegerField(min_value=1, max_value=100, default=100)
+
+
+class CatalogSinceSerializer(serializers.Serializer):
+    since = serializers.IntegerField(min_value=0)
+
+
+def place_row_columns(request):
+    """Columns PlaceSerializer would output for this request, in output order."""
+    requested = requested_fields(request, PlaceSerializer.Meta.fields)
+    # The serializer keeps its declared field order whatever order ?fields= names them in.
+    columns = [name for name in PlaceSerializer.Meta.fields if requested is None or name in requested]
+    if request is not None and request.user.is_superuser and PlaceSerializer.wants_approved(request):
+        columns = columns + ['approved']
+    return columns
+
+
+def place_rows_from_values(columns, values):
+    """
+    Build PlaceSerializer-identical dicts from value tuples in ``columns`` order.
+
+    The database already hands back the types the serializer fields would
+    produce, so each row is just a zip. Returns None if a float is NaN or
+    infinite, which the stock JSON renderer writes differently than orjson,
+    so the caller can fall back to the serializer.
+    """
+    float_positions = [i for i, column in enumerate(columns) if column in ('coord_x', 'coord_y')]
+    rows = []
+    for row in values:
+        for i in float_positions:
+            if not isfinite(row[i]):
+                return None
+        rows.append(dict(zip(columns, row)))
+    return rows
+
+
+def place_rows(queryset, request):
+    """Fast read-only PlaceSerializer output for ``queryset``, or None to fall back."""
+    columns = place_row_columns(request)
+    return place_rows_from_values(columns, queryset.values_list(*columns).iterator(chunk_size=2000))
+
 
 class VisitSerializer(serializers.Serializer):
     place_id = serializers.IntegerField()
 
 
+class BatchVisitItemSerializer(serializers.Serializer):
+    place_id = serializers.IntegerField()
+    visited_at = serializers.DateTimeField(required=False)
+
+
+class BatchVisitSerializer(serializers.Serializer):
+    visits = BatchVisitItemSerializer(many=True, allow_empty=False, max_length=settings.VISIT_BATCH_LIMIT)
+
+
 class SavedPlaceSerializer(serializers.ModelSerializer):
     place = PlaceSerializer(read_only=True)
     place_id = serializers.IntegerField(write_only=True)
@@ -55,5 +220,10 @@ class SavedPlaceSerializer(serializers.ModelSerializer):
         fields = ['place', 'place_id', 'saved_at'] 
 
 
+class SavedPlaceIdsSerializer(serializers.Serializer):
+    place_ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False,
+                                      max_length=settings.SAVED_PLACES_BULK_LIMIT)
+
+
 class SuggestedPlaceSerializer(serializers.Serializer):
     suggestions = serializers.CharField()
\ No newline at end of file
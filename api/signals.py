@@ -0,0 +1,62 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import forget_users
+from .catalog import forget_membership, remember_version
+from .geofence import geofence_tracker
+from .leaderboard import leaderboard
+from .live import live_hub
+from .models import CatalogVersion, CustomUser, Place, PlaceTombstone
+from .search import search_index
+from .positions import position_buffer
+from .presence import presence
+from .spatial import place_index, user_index
+
+
+@receiver(post_save, sender=Place)
+def place_saved(sender, instance, **kwargs):
+    place_index.sync(instance)
+    search_index.sync(instance)
+    # Publishing the version before the row is visible would let a reader
+    # hand out an ETag for content that does not include it yet.
+    version = instance.version
+    transaction.on_commit(lambda: remember_version(version))
+    transaction.on_commit(forget_membership)
+
+
+@receiver(post_delete, sender=Place)
+def place_deleted(sender, instance, **kwargs):
+    place_index.discard(instance.pk)
+    search_index.discard(instance.pk)
+    # Runs inside the delete's transaction, so the tombstone commits with it.
+    version = CatalogVersion.advance(membership=True)
+    PlaceTombstone.objects.update_or_create(place_id=instance.pk, defaults={'version': version})
+    transaction.on_commit(lambda: remember_version(version))
+    transaction.on_commit(forget_membership)
+
+
+@receiver(post_save, sender=CustomUser)
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    # Again after commit, a request in between may have cached the old row.
+    user_id = instance.pk
+    forget_users([user_id])
+    transaction.on_commit(lambda: forget_users([user_id]))
+    fields = set(update_fields) if update_fields is not None else None
+    if fields is None or fields & {'online', 'visible', 'is_active', 'coord_x', 'coord_y', *user_index.FIELDS}:
+        user_index.sync(instance)
+        event = live_hub.user_event(instance, *(position_buffer.get(instance.pk) or ()))
+        transaction.on_commit(lambda: live_hub.publish(event))
+    if fields is None or fields & set(leaderboard.FIELDS):
+        leaderboard.update(instance)
+
+
+@receiver(post_delete, sender=CustomUser)
+def user_deleted(sender, instance, **kwargs):
+    user_id = instance.pk
+    forget_users([instance.pk])
+    user_index.discard(instance.pk)
+    presence.leave(user_id)
+    transaction.on_commit(lambda: live_hub.publish({'type': 'leave', 'id': user_id}))
+    geofence_tracker.forget(instance.pk)
+    leaderboard.discard(instance.pk)
@@ -0,0 +1,340 @@
+import math
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+from .utils import in_batches
+
+# coord_x is latitude and coord_y is longitude, in degrees.
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = EARTH_RADIUS_M * math.pi / 180
+
+
+def haversine(x1, y1, x2, y2):
+    """Great-circle distance in meters between two (lat, lng) points."""
+    lat1, lat2 = math.radians(x1), math.radians(x2)
+    dlat = lat2 - lat1
+    dlng = math.radians(y2 - y1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _lng_scale(x):
+    # Meters per degree of longitude shrink with latitude; clamp so the poles
+    # do not blow the search window up to infinity.
+    return max(math.cos(math.radians(min(abs(x), 89.0))), 0.01)
+
+
+class GridIndex:
+    """
+    Uniform lat/lng grid over keyed points.
+
+    Every point lives in exactly one cell, so radius and bounding box queries
+    only look at the handful of cells that overlap the search window instead
+    of scanning every point.
+    """
+
+    def __init__(self, cell_size=0.002):
+        self.cell_size = cell_size
+        self._cells = defaultdict(dict)
+        self._points = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, key):
+        return key in self._points
+
+    def _cell(self, x, y):
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def get(self, key):
+        return self._points.get(key)
+
+    def insert(self, key, x, y):
+        with self._lock:
+            self._remove(key)
+            self._points[key] = (x, y)
+            self._cells[self._cell(x, y)][key] = (x, y)
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        point = self._points.pop(key, None)
+        if point is None:
+            return
+        cell = self._cell(*point)
+        bucket = self._cells.get(cell)
+        if bucket is not None:
+            bucket.pop(key, None)
+            if not bucket:
+                del self._cells[cell]
+
+    def rebuild(self, points):
+        """Replace the whole index with ``points``, an iterable of (key, x, y)."""
+        cells = defaultdict(dict)
+        lookup = {}
+        for key, x, y in points:
+            lookup[key] = (x, y)
+            cells[self._cell(x, y)][key] = (x, y)
+        with self._lock:
+            self._cells = cells
+            self._points = lookup
+
+    def _scan(self, min_cx, max_cx, min_cy, max_cy):
+        cells = self._cells
+        if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) > len(cells):
+            # The window covers more cells than exist, walk the occupied ones.
+            for (cx, cy), bucket in list(cells.items()):
+                if min_cx <= cx <= max_cx and min_cy <= cy <= max_cy:
+                    yield from list(bucket.items())
+            return
+        for cx in range(min_cx, max_cx + 1):
+            for cy in range(min_cy, max_cy + 1):
+                bucket = cells.get((cx, cy))
+                if bucket:
+                    yield from list(bucket.items())
+
+    def within_bbox(self, min_x, min_y, max_x, max_y, limit=None):
+        """Keys of points inside the box, at most ``limit`` of them."""
+        min_cx, min_cy = self._cell(min_x, min_y)
+        max_cx, max_cy = self._cell(max_x, max_y)
+        keys = []
+        for key, (x, y) in self._scan(min_cx, max_cx, min_cy, max_cy):
+            if min_x <= x <= max_x and min_y <= y <= max_y:
+                keys.append(key)
+                if limit is not None and len(keys) >= limit:
+                    break
+        return keys
+
+    def within_radius(self, x, y, radius, limit=None):
+        """(distance, key) pairs within ``radius`` meters, nearest first."""
+        dx = radius / METERS_PER_DEGREE
+        dy = dx / _lng_scale(x)
+        min_cx, min_cy = self._cell(x - dx, y - dy)
+        max_cx, max_cy = self._cell(x + dx, y + dy)
+        hits = []
+        for key, (px, py) in self._scan(min_cx, max_cx, min_cy, max_cy):
+            distance = haversine(x, y, px, py)
+            if distance <= radius:
+                hits.append((distance, key))
+        hits.sort()
+        return hits[:limit] if limit is not None else hits
+
+    def nearest(self, x, y, k, max_radius=None):
+        """The ``k`` nearest (distance, key) pairs, optionally bounded by ``max_radius`` meters."""
+        if not self._points or k <= 0:
+            return []
+        cx, cy = self._cell(x, y)
+        ring_meters = self.cell_size * METERS_PER_DEGREE * _lng_scale(abs(x) + self.cell_size)
+        hits = []
+        for ring, buckets in self._rings(cx, cy):
+            for bucket in buckets:
+                for key, (px, py) in list(bucket.items()):
+                    distance = haversine(x, y, px, py)
+                    if max_radius is None or distance <= max_radius:
+                        hits.append((distance, key))
+            hits.sort()
+            del hits[k:]
+            # Anything outside the rings walked so far is at least this far away.
+            bound = ring * ring_meters
+            if len(hits) == k and hits[-1][0] <= bound:
+                break
+            if max_radius is not None and bound > max_radius:
+                break
+        return hits
+
+    def _rings(self, cx, cy):
+        """Yield (ring, buckets) outward from cell (cx, cy), skipping empty rings."""
+        cells = self._cells
+        ring = 0
+        while 8 * ring <= len(cells):
+            if ring == 0:
+                cell_ids = [(cx, cy)]
+            else:
+                cell_ids = [(cx + i, cy + j) for i in (-ring, ring) for j in range(-ring, ring + 1)]
+                cell_ids += [(cx + i, cy + j) for j in (-ring, ring) for i in range(-ring + 1, ring)]
+            buckets = [cells[c] for c in cell_ids if c in cells]
+            if buckets:
+                yield ring, buckets
+            ring += 1
+        # The ring perimeter now exceeds the number of occupied cells, so it
+        # is cheaper to group the occupied cells by ring than to keep probing.
+        by_ring = defaultdict(list)
+        for (px, py), bucket in list(cells.items()):
+            distance = max(abs(px - cx), abs(py - cy))
+            if distance >= ring:
+                by_ring[distance].append(bucket)
+        for distance in sorted(by_ring):
+            yield distance, by_ring[distance]
+
+
+class PlaceIndex:
+    """
+    Grid index over approved places.
+
+    Loaded lazily from the database and then kept current by the Place
+    signals. Other workers only see those updates through the periodic
+    reload, so the index is refreshed every ``PLACE_INDEX_TTL`` seconds.
+    """
+
+    def __init__(self):
+        self.grid = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        ttl = settings.PLACE_INDEX_TTL
+        if self.grid is not None and time.monotonic() - self._loaded_at < ttl:
+            return self.grid
+        with self._lock:
+            if self.grid is None or time.monotonic() - self._loaded_at >= ttl:
+                from .models import Place
+
+                grid = GridIndex(cell_size=settings.PLACE_INDEX_CELL_DEG)
+                grid.rebuild(Place.objects.filter(approved=True).values_list('id', 'coord_x', 'coord_y').iterator())
+                self.grid = grid
+                self._loaded_at = time.monotonic()
+        return self.grid
+
+    def sync(self, place):
+        if self.grid is None:
+            return
+        if place.approved:
+            self.grid.insert(place.pk, place.coord_x, place.coord_y)
+        else:
+            self.grid.remove(place.pk)
+
+    def discard(self, place_id):
+        if self.grid is not None:
+            self.grid.remove(place_id)
+
+    def reset(self):
+        self.grid = None
+
+    def within_radius(self, x, y, radius, limit=None):
+        return self._ensure_loaded().within_radius(x, y, radius, limit=limit)
+
+    def nearest(self, x, y, k, max_radius=None):
+        return self._ensure_loaded().nearest(x, y, k, max_radius=max_radius)
+
+
+place_index = PlaceIndex()
+
+
+class UserIndex:
+    """
+    Grid index over online, visible users with the handful of profile
+    fields the map needs, so nearby user polls never touch the database.
+
+    Who is online comes from the presence store (api/presence.py). Fed by
+    CustomUser saves and heartbeats and reloaded every ``USER_INDEX_TTL``
+    seconds. With a shared position buffer, moves reported to other workers
+    are picked up from it every ``POSITION_FLUSH_INTERVAL`` seconds.
+    """
+
+    FIELDS = ('username', 'avatar', 'level')
+
+    def __init__(self):
+        self.grid = None
+        self.profiles = {}
+        self._loaded_at = 0.0
+        self._caught_up_at = 0.0
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        ttl = settings.USER_INDEX_TTL
+        if self.grid is not None and time.monotonic() - self._loaded_at < ttl:
+            self._catch_up()
+            return self.grid
+        with self._lock:
+            if self.grid is None or time.monotonic() - self._loaded_at >= ttl:
+                from .models import CustomUser
+                from .positions import position_buffer
+                from .presence import presence
+
+                rows = in_batches(
+                    CustomUser.objects.filter(visible=True).values_list('id', 'coord_x', 'coord_y', *self.FIELDS),
+                    presence.online_ids(),
+                )
+                grid = GridIndex(cell_size=settings.USER_INDEX_CELL_DEG)
+                profiles = {}
+                points = []
+                # Positions still waiting in the heartbeat buffer are newer than the rows.
+                buffered = position_buffer.overlay()
+                for user_id, x, y, *profile in rows:
+                    x, y = buffered.get(user_id, (x, y))
+                    points.append((user_id, x, y))
+                    profiles[user_id] = tuple(profile)
+                grid.rebuild(points)
+                self.grid, self.profiles = grid, profiles
+                self._loaded_at = self._caught_up_at = time.monotonic()
+        return self.grid
+
+    def _catch_up(self):
+        from .positions import position_buffer
+
+        if not position_buffer.backend.shared:
+            return
+        now = time.monotonic()
+        if now - self._caught_up_at < settings.POSITION_FLUSH_INTERVAL:
+            return
+        self._caught_up_at = now
+        for user_id, (x, y) in position_buffer.overlay().items():
+            self.move(user_id, x, y)
+
+    def sync(self, user):
+        if self.grid is None:
+            return
+        from .presence import presence
+
+        if user.visible and user.is_active and presence.is_online(user.pk):
+            from .positions import position_buffer
+
+            x, y = position_buffer.get(user.pk) or (user.coord_x, user.coord_y)
+            self.profiles[user.pk] = tuple(getattr(user, field) for field in self.FIELDS)
+            self.grid.insert(user.pk, x, y)
+        else:
+            self.discard(user.pk)
+
+    def move(self, user_id, x, y):
+        """Move a user who is already on the map; anyone else is left off."""
+        grid = self.grid
+        if grid is not None and user_id in self.profiles:
+            grid.insert(user_id, x, y)
+
+    def discard(self, user_id):
+        if self.grid is not None:
+            self.grid.remove(user_id)
+            self.profiles.pop(user_id, None)
+
+    def reset(self):
+        self.grid = None
+        self.profiles = {}
+
+    def _rows(self, keys):
+        grid, profiles = self.grid, self.profiles
+        rows = []
+        for user_id in keys:
+            point, profile = grid.get(user_id), profiles.get(user_id)
+            if point is None or profile is None:
+                continue
+            row = {'id': user_id, **dict(zip(self.FIELDS, profile)), 'coord_x': point[0], 'coord_y': point[1]}
+            rows.append(row)
+        return rows
+
+    def within_radius(self, x, y, radius, limit):
+        hits = self._ensure_loaded().within_radius(x, y, radius, limit=limit)
+        return self._rows(user_id for _, user_id in hits)
+
+    def within_bbox(self, min_x, min_y, max_x, max_y, limit):
+        keys = self._ensure_loaded().within_bbox(min_x, min_y, max_x, max_y, limit=limit)
+        return self._rows(keys)
+
+
+user_index = UserIndex()
@@ -1,22 +1,135 @@
+import asyncio
+import contextvars
+import hashlib
 import json
-from openai import OpenAI
+import math
+import threading
+import time
+import weakref
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 
-def get_place_recommendations(data, selected_categories, api_key, model="meta-llama/llama-3.3-8b-instruct:free", num_recommendations=3):
+from django.conf import settings
+from django.db.models import Count
+from openai import AsyncOpenAI, OpenAI
+
+from .catalog import current_membership
+from .metrics import upstream
+from .models import Place
+from .recommender import recommend_places
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+DEFAULT_MODEL = "meta-llama/llama-3.3-8b-instruct:free"
+
+
+class SuggestionCache:
     """
-    Get place recommendations based on selected categories using an LLM.
-    
-    Args:
-        data (list): List of place dictionaries with at least _id, name, description, isActive, and category fields
-        selected_categories (list): List of category names to filter places by
-        api_key (str): Your OpenRouter API key
-        model (str): The LLM model to use for recommendations
-        num_recommendations (int): Number of recommendations to request
-        
+    In-process LRU cache of suggested place IDs with a per-entry TTL.
+
+    Keys combine a fingerprint of the user's visited places, their top
+    categories and the catalog membership counter, so a new visit, a shift in
+    interests or a created, approved or deleted place all miss the cache
+    naturally; visits and edits by others do not. Local rankings
+    also depend on where the user is, so their keys carry a coarse grid cell
+    of the user's position too.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(visited_ids, categories, membership, cell=None):
+        fingerprint = hashlib.blake2b(",".join(map(str, sorted(visited_ids))).encode(), digest_size=16).hexdigest()
+        return (fingerprint, tuple(categories), membership, cell)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+suggestion_cache = SuggestionCache(settings.SUGGESTION_CACHE_SIZE, settings.SUGGESTION_CACHE_TTL)
+
+# LLM calls that overrun their deadline keep running here instead of holding
+# up the request thread. A slot is held per call until it finishes, so calls
+# never queue up behind a slow LLM.
+_llm_executor = ThreadPoolExecutor(max_workers=settings.SUGGESTION_LLM_WORKERS, thread_name_prefix="llm")
+_llm_slots = threading.BoundedSemaphore(settings.SUGGESTION_LLM_WORKERS)
+
+
+def parse_place_ids(text, allowed_ids):
+    """Pull place IDs out of an LLM answer, keeping only ones that were offered."""
+    if not text:
+        return []
+    ids = [int(pid.strip()) for pid in text.split(",") if pid.strip().isdigit()]
+    return [pid for pid in dict.fromkeys(ids) if pid in allowed_ids]
+
+
+def call_with_deadline(func, deadline, *args, on_late=None, **kwargs):
+    """
+    Run ``func`` on the LLM pool and return its result, or None after ``deadline`` seconds.
+
+    Returns None straight away when every worker is busy. A call that
+    overruns keeps going and hands its result to ``on_late``, if given.
+    """
+    if not _llm_slots.acquire(blocking=False):
+        return None
+    # Carry the request context along so the call is still attributed to it.
+    future = _llm_executor.submit(contextvars.copy_context().run, func, *args, **kwargs)
+    future.add_done_callback(lambda _: _llm_slots.release())
+    try:
+        return future.result(timeout=deadline)
+    except TimeoutError:
+        if not future.cancel() and on_late is not None:
+            def deliver(done):
+                if done.exception() is None:
+                    on_late(done.result())
+            future.add_done_callback(deliver)
+        return None
+
+
+def cache_late_answer(cache_key, place_data):
+    """``on_late`` callback caching an LLM answer nobody waited for under ``cache_key``."""
+    def remember(llm_answer):
+        suggested_ids = parse_place_ids(llm_answer, {place["id"] for place in place_data})
+        if suggested_ids:
+            suggestion_cache.set(cache_key, suggested_ids)
+    return remember
+
+
+def build_messages(data, selected_categories, num_recommendations=3):
+    """
+    Build the chat messages asking the LLM to pick places.
+
     Returns:
-        str: The LLM's recommendation response
-        
-    Raises:
-        Exception: If there's an issue with the API call or no valid response is received
+        list: The messages, or None when there are no approved places to pick from
     """
     # Filter active places by selected categories
     filtered_places = [
@@ -30,13 +143,12 @@ def get_place_recommendations(data, selected_categories, api_key, model="meta-ll
         for place in data
         if place.get("approved", False)
     ]
-    
+
     # Check if we have places to recommend
     if not filtered_places:
-        return f"No active places found in the selected categories: {', '.join(selected_categories)}"
-    
-    # Build the messages for the LLM
-    messages = [
+        return None
+
+    return [
         {
             "role": "system",
             "content": "You are a campus guide assistant."
@@ -52,19 +164,57 @@ def get_place_recommendations(data, selected_categories, api_key, model="meta-ll
             )
         }
     ]
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(api_key):
+    """Shared OpenRouter client per API key, so connections are pooled across requests."""
+    client = _clients.get(api_key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(api_key)
+            if client is None:
+                client = OpenAI(
+                    base_url=OPENROUTER_BASE_URL,
+                    api_key=api_key,
+                    timeout=settings.SUGGESTION_LLM_TIMEOUT,
+                    max_retries=0,
+                )
+                _clients[api_key] = client
+    return client
+
+
+def get_place_recommendations(data, selected_categories, api_key, model=DEFAULT_MODEL, num_recommendations=3):
+    """
+    Get place recommendations based on selected categories using an LLM.
     
-    # Initialize OpenAI client with OpenRouter base URL
-    client = OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=api_key,
-    )
-    
+    Args:
+        data (list): List of place dictionaries with at least _id, name, description, isActive, and category fields
+        selected_categories (list): List of category names to filter places by
+        api_key (str): Your OpenRouter API key
+        model (str): The LLM model to use for recommendations
+        num_recommendations (int): Number of recommendations to request
+        
+    Returns:
+        str: The LLM's recommendation response
+        
+    Raises:
+        Exception: If there's an issue with the API call or no valid response is received
+    """
+    messages = build_messages(data, selected_categories, num_recommendations)
+    if messages is None:
+        return f"No active places found in the selected categories: {', '.join(selected_categories)}"
+
     try:
         # Send request to the LLM
-        completion = client.chat.completions.create(
-            model=model,
-            messages=messages
-        )
+        with upstream("openrouter"):
+            completion = get_client(api_key).chat.completions.create(
+                model=model,
+                messages=messages
+            )
         
         if completion and completion.choices:
             return completion.choices[0].message.content
@@ -72,4 +222,141 @@ def get_place_recommendations(data, selected_categories, api_key, model="meta-ll
             raise Exception("No valid response received from the LLM")
     
     except Exception as e:
-        return f"Error getting recommendations: {str(e)}"
\ No newline at end of file
+        return f"Error getting recommendations: {str(e)}"
+
+
+# Async clients and in-flight calls are bound to the event loop that made them.
+_async_clients = weakref.WeakKeyDictionary()
+_inflight = weakref.WeakKeyDictionary()
+
+
+def get_async_client(api_key):
+    """Shared async OpenRouter client per API key on the running event loop."""
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(api_key)
+    if client is None:
+        client = clients[api_key] = AsyncOpenAI(
+            base_url=OPENROUTER_BASE_URL,
+            api_key=api_key,
+            timeout=settings.SUGGESTION_LLM_TIMEOUT,
+            max_retries=0,
+        )
+    return client
+
+
+async def _complete(api_key, model, messages):
+    try:
+        with upstream("openrouter"):
+            completion = await get_async_client(api_key).chat.completions.create(model=model, messages=messages)
+        if completion and completion.choices:
+            return completion.choices[0].message.content
+        raise Exception("No valid response received from the LLM")
+    except Exception as e:
+        return f"Error getting recommendations: {str(e)}"
+
+
+async def aget_place_recommendations(data, selected_categories, api_key, model=DEFAULT_MODEL, num_recommendations=3):
+    """
+    Async get_place_recommendations that coalesces identical prompts.
+
+    Callers asking the same question while a call is already in flight wait
+    on that call instead of starting their own, so a burst of users with the
+    same interests costs one upstream request.
+    """
+    messages = build_messages(data, selected_categories, num_recommendations)
+    if messages is None:
+        return f"No active places found in the selected categories: {', '.join(selected_categories)}"
+
+    key = hashlib.blake2b(json.dumps([api_key, model, messages]).encode(), digest_size=16).hexdigest()
+    inflight = _inflight.setdefault(asyncio.get_running_loop(), {})
+    task = inflight.get(key)
+    if task is None:
+        task = inflight[key] = asyncio.ensure_future(_complete(api_key, model, messages))
+        task.add_done_callback(lambda _: inflight.pop(key, None))
+    # Shielded so a caller that gives up does not cancel the call for everyone.
+    return await asyncio.shield(task)
+
+
+def origin_cell(user):
+    """
+    The ``SUGGESTION_CACHE_CELL_M`` grid cell ``user`` is in, when local rankings use it.
+
+    LLM answers ignore the user's position, so they get None and stay shared
+    by everyone with the same history.
+    """
+    # The model defaults coordinates to 0, which means "never reported".
+    if settings.SUGGESTION_MODE != "local" or not (user.coord_x or user.coord_y):
+        return None
+    # About 111 km per degree; cells are narrower east-west away from the
+    # equator, which only makes them finer.
+    step = settings.SUGGESTION_CACHE_CELL_M / 111_320
+    return (math.floor(user.coord_x / step), math.floor(user.coord_y / step))
+
+
+def suggestion_inputs(user):
+    """
+    Load what a suggestion depends on.
+
+    Returns:
+        tuple: (visited (id, category) pairs, top categories, cache key)
+    """
+    visited_places = list(Place.objects.filter(visit__user=user, approved=True).values_list("id", "category"))
+    visited_place_ids = [place_id for place_id, _ in visited_places]
+
+    if visited_places:
+        category_counts = Counter(category for _, category in visited_places if category)
+        top_categories = [cat for cat, _ in category_counts.most_common(3)]
+    else:
+        top_categories = list(
+            Place.objects.filter(approved=True)
+            .values("category")
+            .annotate(num_places=Count("id"))
+            .order_by("-num_places")
+            .values_list("category", flat=True)[:3]
+        )
+
+    cache_key = suggestion_cache.key(visited_place_ids, top_categories, current_membership(), origin_cell(user))
+    return visited_places, top_categories, cache_key
+
+
+def candidate_places(visited_places, top_categories):
+    """Unvisited approved places in the user's top categories, shaped for the LLM prompt."""
+    unvisited_places = (
+        Place.objects
+        .filter(approved=True)
+        .exclude(id__in=[place_id for place_id, _ in visited_places])
+        .filter(category__in=top_categories)
+    )
+
+    return [
+        {
+            "id": place.id,
+            "name": place.name,
+            "description": place.description,
+            "category": place.category,
+            "visits": place.visits,
+            "approved": place.approved
+        }
+        for place in unvisited_places
+    ]
+
+
+def finish_suggestions(user, visited_places, cache_key, llm_answer, place_data):
+    """
+    Turn an LLM answer into place IDs, falling back to the local ranking.
+
+    ``llm_answer`` is None when the LLM was skipped or missed its deadline.
+    """
+    mode = settings.SUGGESTION_MODE
+    suggested_ids = parse_place_ids(llm_answer, {place["id"] for place in place_data})
+
+    # An LLM error or timeout leaves no IDs. Fallback rankings are cheap to
+    # redo, so only LLM answers and local-mode rankings are cached.
+    cacheable = bool(suggested_ids)
+    if mode != "llm" and not suggested_ids:
+        suggested_ids = recommend_places(user, visited_places)
+        cacheable = mode == "local"
+
+    if cacheable:
+        suggestion_cache.set(cache_key, suggested_ids)
+    return suggested_ids
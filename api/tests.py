@@ -1,3 +1,1380 @@
-from django.test import TestCase
+import asyncio
+import threading
+import time
+from bisect import bisect_left
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import urls
+from .authentication import auth_cache_stats
+from .geofence import geofence_tracker
+from .google_auth import StaticKeySource, key_cache
+from .leaderboard import SortedKeys, leaderboard
+from .live import LiveHub, LocalBackend, live_hub
+from .loadtest import percentile
+from .metrics import DB_QUERIES, HISTOGRAMS, REQUEST_SECONDS, RESPONSE_BYTES, MetricsMiddleware
+from .models import CustomUser, Place, SavedPlace, Visit
+from .pagination import OptionalCursorPagination
+from .positions import CachePositions, MemoryPositions, PositionBuffer, position_buffer
+from .presence import CachePresence, MemoryPresence, PresenceStore, presence
+from .search import search_index
+from .serializers import PlaceSerializer
+from .spatial import GridIndex, haversine, place_index, user_index
+from .suggestions import call_with_deadline, suggestion_cache
+from .visits import record_visit
+
+
+def make_place(**kwargs):
+    defaults = {"name": "Library", "type": "inside", "description": "library", "category": "campus",
+                "coord_x": 12.9692, "coord_y": 79.1559, "approved": True}
+    defaults.update(kwargs)
+    return Place.objects.create(**defaults)
+
+
+def make_user(n=0, **kwargs):
+    return CustomUser.objects.create(email=f"user{n}@example.com", username=f"user{n}", **kwargs)
+
+
+class VisitPlaceViewTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_first_visit_credits_xp_and_counters(self):
+        place = make_place(xp_reward=30)
+        response = self.client.post("/api/visit/", {"place_id": place.id}, format="json")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["user_xp"], 30)
+        self.assertEqual(response.data["total_visits_to_place"], 1)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.xp, 30)
+        self.assertEqual(self.user.badges, ["nerd"])
+
+    def test_repeat_visit_changes_nothing(self):
+        place = make_place()
+        self.client.post("/api/visit/", {"place_id": place.id}, format="json")
+        response = self.client.post("/api/visit/", {"place_id": place.id}, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        place.refresh_from_db()
+        self.assertEqual(place.visits, 1)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.xp, 20)
+
+    def test_level_up_on_hundred_xp(self):
+        place = make_place(xp_reward=100)
+        response = self.client.post("/api/visit/", {"place_id": place.id}, format="json")
+        self.assertEqual(response.data["user_level"], 2)
+
+    def test_query_count_does_not_grow_with_history(self):
+        # Inside TestCase the visit transaction runs as a savepoint, which
+        # adds the SAVEPOINT/RELEASE pair to the count.
+        first = make_place(name="First")
+        with self.assertNumQueries(10):
+            self.client.post("/api/visit/", {"place_id": first.id}, format="json")
+
+        for i in range(20):
+            Visit.objects.create(user=self.user, place=make_place(name=f"Old {i}"))
+        latest = make_place(name="Latest")
+        with self.assertNumQueries(10):
+            self.client.post("/api/visit/", {"place_id": latest.id}, format="json")
+
+
+class PlaceCatalogSyncTests(TestCase):
+    def setUp(self):
+        reset_process_state()
+        self.place = make_place()
+        self.client = APIClient()
+
+    def list(self, **headers):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.get("/api/places/", **headers)
+
+    def test_unchanged_catalog_answers_304(self):
+        first = self.list()
+        self.assertEqual(first.status_code, 200)
+        second = self.list(HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second["X-Catalog-Version"], first["X-Catalog-Version"])
+
+    def test_visits_move_the_list_etag_but_not_the_version(self):
+        first = self.list()
+        user = make_user()
+        self.client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post("/api/visit/", {"place_id": self.place.pk}, format="json")
+
+        second = self.list(HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json()[0]["visits"], 1)
+        self.assertEqual(second["X-Catalog-Version"], first["X-Catalog-Version"])
+
+        delta = self.client.get("/api/places/", {"since": first["X-Catalog-Version"]}).json()
+        self.assertEqual(delta["changed"], [])
+
+    def test_since_lists_changes_and_deletions(self):
+        version = self.list()["X-Catalog-Version"]
+        with self.captureOnCommitCallbacks(execute=True):
+            make_place(name="Gym")
+            hidden = make_place(name="Old Gym")
+        version_after_adding = self.list()["X-Catalog-Version"]
+        with self.captureOnCommitCallbacks(execute=True):
+            hidden.approved = False
+            hidden.save()
+            deleted_id = self.place.pk
+            self.place.delete()
+
+        delta = self.client.get("/api/places/", {"since": version}).json()
+        self.assertEqual([row["name"] for row in delta["changed"]], ["Gym"])
+        self.assertCountEqual(delta["deleted"], [deleted_id, hidden.pk])
+
+        delta = self.client.get("/api/places/", {"since": version_after_adding}).json()
+        self.assertEqual(delta["changed"], [])
+        self.assertEqual(delta["version"], int(self.list()["X-Catalog-Version"]))
+
+
+class BatchVisitTests(TestCase):
+    def setUp(self):
+        reset_process_state()
+        self.user = make_user()
+        self.places = [make_place(name=f"Place {n}", xp_reward=10) for n in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def visit(self, *items):
+        return self.client.post("/api/visit/batch/", {"visits": list(items)}, format="json")
+
+    def test_reports_each_item(self):
+        Visit.objects.create(user=self.user, place=self.places[0])
+        first, second = self.places[1:]
+        response = self.visit(
+            {"place_id": self.places[0].pk}, {"place_id": first.pk},
+            {"place_id": first.pk}, {"place_id": 10**6}, {"place_id": second.pk, "visited_at": "2025-03-01T10:15:00Z"},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row["status"] for row in response.data["results"]],
+                         ["already_visited", "visited", "duplicate", "not_found", "visited"])
+        self.assertEqual(response.data["user_xp"], 20)
+        self.assertEqual(Visit.objects.get(user=self.user, place=second).visited_at.year, 2025)
+        first.refresh_from_db()
+        self.assertEqual((first.visits, first.unique_visitors), (1, 1))
+
+    def test_future_times_are_clamped(self):
+        self.visit({"place_id": self.places[0].pk, "visited_at": "2999-01-01T00:00:00Z"})
+        self.assertLess(Visit.objects.get().visited_at.year, 2999)
+
+    def test_rejects_empty_and_oversized_batches(self):
+        self.assertEqual(self.visit().status_code, 400)
+        too_many = [{"place_id": self.places[0].pk}] * (settings.VISIT_BATCH_LIMIT + 1)
+        self.assertEqual(self.visit(*too_many).status_code, 400)
+        self.assertFalse(Visit.objects.exists())
+
+    def test_survives_repeated_concurrent_inserts(self):
+        atomic = transaction.atomic
+        # Nothing races the outer transaction, then another request records
+        # one of these visits before each of the first two insert attempts.
+        racing = iter([None, *self.places[1:]])
+
+        def racing_atomic(*args, **kwargs):
+            # Django's own blocks inside bulk_create() and save() skip the savepoint.
+            if kwargs.get("savepoint", True):
+                place = next(racing, None)
+                if place is not None:
+                    Visit.objects.create(user=self.user, place=place)
+            return atomic(*args, **kwargs)
+
+        with mock.patch("api.visits.transaction.atomic", side_effect=racing_atomic):
+            response = self.visit(*({"place_id": place.pk} for place in self.places))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row["status"] for row in response.data["results"]],
+                         ["visited", "already_visited", "already_visited"])
+        self.assertEqual(Visit.objects.filter(user=self.user).count(), 3)
+
+
+@override_settings(POSITION_FLUSH_INTERVAL=0, PRESENCE_SYNC_INTERVAL=0, GEOFENCE_RADIUS_M=30)
+class GeofenceTests(TestCase):
+    HERE = {"coord_x": 12.9692, "coord_y": 79.1559}
+    AWAY = {"coord_x": 12.9792, "coord_y": 79.1559}
+
+    def setUp(self):
+        reset_process_state()
+        self.place = make_place(xp_reward=25)
+        make_place(name="Pending", approved=False)
+        self.user = make_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def heartbeat(self, position, client=None):
+        return (client or self.client).post("/api/user/heartbeat/", position, format="json")
+
+    def test_entering_a_fence_visits_once(self):
+        response = self.heartbeat(self.HERE)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["visited"], [{"place_id": self.place.pk, "place_name": "Library", "xp_gained": 25}])
+        self.assertEqual(response.data["user_xp"], 25)
+
+        self.assertEqual(self.heartbeat(self.HERE).status_code, 204)
+        self.assertEqual(self.heartbeat(self.AWAY).status_code, 204)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.heartbeat(self.HERE).status_code, 204)
+        # Only the position write, the credited place is not looked up again.
+        self.assertFalse([query for query in queries.captured_queries if "api_visit" in query["sql"]])
+        self.assertEqual(Visit.objects.filter(user=self.user).count(), 1)
+
+    def test_evicted_users_fall_back_to_the_database(self):
+        other = APIClient()
+        other.force_authenticate(make_user(1))
+        self.heartbeat(self.HERE)
+
+        with override_settings(GEOFENCE_TRACKED_USERS=1):
+            self.heartbeat(self.HERE, other)
+            self.assertEqual(len(geofence_tracker), 1)
+            self.assertEqual(self.heartbeat(self.HERE).status_code, 204)
+
+        self.assertEqual(Visit.objects.filter(user=self.user).count(), 1)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.xp, 25)
+
+    def test_profile_coordinates_visit_too(self):
+        self.client.patch("/api/user/profile/", self.HERE, format="json")
+        self.assertTrue(Visit.objects.filter(user=self.user, place=self.place).exists())
+
+
+@override_settings(AUTH_USER_CACHE_TTL=60)
+class AuthCacheTests(TestCase):
+    def setUp(self):
+        reset_process_state()
+        auth_cache_stats.reset()
+        self.user = make_user(xp=40)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}")
+
+    def profile(self):
+        response = self.client.get("/api/user/profile/")
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_second_request_is_served_from_the_cache(self):
+        self.profile()
+        with self.assertNumQueries(0):
+            self.profile()
+        self.assertEqual((auth_cache_stats.hits, auth_cache_stats.misses), (1, 1))
+
+    def test_saves_drop_the_cached_user(self):
+        self.profile()
+        self.user.xp = 90
+        self.user.save()
+        self.assertEqual(self.profile()["xp"], 90)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get("/api/user/profile/").status_code, 401)
+
+    def test_profile_update_keeps_fields_it_was_not_sent(self):
+        self.profile()
+        # Credited by another worker, whose invalidation this one missed.
+        CustomUser.objects.filter(pk=self.user.pk).update(xp=75, badges=["nerd"])
+
+        response = self.client.patch("/api/user/profile/", {"avatar": 4}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.avatar, self.user.xp, self.user.badges), (4, 75, ["nerd"]))
+
+    @override_settings(AUTH_USER_CACHE_TTL=0)
+    def test_off_without_a_shared_cache(self):
+        self.profile()
+        CustomUser.objects.filter(pk=self.user.pk).update(xp=75)
+        self.assertEqual(self.profile()["xp"], 75)
+        self.assertEqual((auth_cache_stats.hits, auth_cache_stats.misses), (0, 0))
+
+
+class PlaceListFastPathTests(TestCase):
+    def setUp(self):
+        reset_process_state()
+        make_place(name="Library", visits=3, coord_x=12.9692123456789)
+        make_place(name="Caf\u00e9 \u2028 Hall", type="outside", category="food", visits=0, level=2)
+        make_place(name="Pending lab", approved=False)
+        self.admin = make_user(0, is_superuser=True)
+        self.client = APIClient()
+
+    def assertSameBytes(self, query):
+        fast = self.client.get("/api/places/", query)
+        with mock.patch("api.views.place_rows", return_value=None):
+            slow = self.client.get("/api/places/", query)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast.content, slow.content)
+        return fast.json()
+
+    def test_matches_the_serializer_byte_for_byte(self):
+        queries = [{}, {"fields": "name,id,visits"}, {"type": "outside"}, {"visits__gte": 1},
+                   {"name__icontains": "caf"}, {"level__lte": 1, "fields": "coord_x,coord_y"}, {"since": 0}]
+        for query in queries:
+            with self.subTest(query=query):
+                self.assertSameBytes(query)
+
+    def test_superusers_see_approved_unless_they_narrow_it_away(self):
+        self.client.force_authenticate(self.admin)
+        rows = self.assertSameBytes({})
+        self.assertEqual([row["approved"] for row in rows], [True, True, False])
+        self.assertEqual(list(self.assertSameBytes({"fields": "id,approved"})[0]), ["id", "approved"])
+        self.assertNotIn("approved", self.assertSameBytes({"fields": "id,name"})[0])
+        self.assertSameBytes({"since": 0})
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        reset_process_state()
+        self.places = [make_place(name=f"Place {n}") for n in range(5)]
+        self.user = make_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_full_list_without_page_params(self):
+        rows = self.client.get("/api/places/").json()
+        self.assertEqual([row["id"] for row in rows], [place.pk for place in self.places])
+
+    def test_cursor_pages_stay_stable_across_inserts(self):
+        first = self.client.get("/api/places/", {"page_size": 2}).json()
+        self.assertEqual([row["id"] for row in first["results"]], [place.pk for place in self.places[:2]])
+        make_place(name="Newest")
+
+        seen = [row["id"] for row in first["results"]]
+        next_link = first["next"]
+        while next_link:
+            page = self.client.get(next_link).json()
+            seen += [row["id"] for row in page["results"]]
+            next_link = page["next"]
+        self.assertEqual(seen[:5], [place.pk for place in self.places])
+        self.assertEqual(len(seen), 6)
+
+    def test_page_size_is_capped(self):
+        with mock.patch.object(OptionalCursorPagination, "max_page_size", 3):
+            page = self.client.get("/api/places/", {"page_size": 50}).json()
+        self.assertEqual(len(page["results"]), 3)
+
+    def test_fields_narrow_the_rows(self):
+        rows = self.client.get("/api/places/", {"fields": "id,name,bogus"}).json()
+        self.assertEqual(rows[0], {"id": self.places[0].pk, "name": "Place 0"})
+
+        page = self.client.get("/api/places/", {"fields": "id,coord_x", "page_size": 2}).json()
+        self.assertEqual(set(page["results"][0]), {"id", "coord_x"})
+
+        rows = self.client.get("/api/places/", {"fields": "bogus"}).json()
+        self.assertIn("description", rows[0])
+
+    def test_visited_ids_page(self):
+        for place in self.places:
+            Visit.objects.create(user=self.user, place=place)
+        self.assertEqual(self.client.get("/api/places/visited/").json(),
+                         {"visited_place_ids": [place.pk for place in self.places]})
+
+        first = self.client.get("/api/places/visited/", {"page_size": 3}).json()
+        self.assertEqual(first["visited_place_ids"], [place.pk for place in self.places[:3]])
+        second = self.client.get(first["next"]).json()
+        self.assertEqual(second, {"visited_place_ids": [place.pk for place in self.places[3:]], "next": None})
+
+
+class NearbyPlacesTests(TestCase):
+    ORIGIN = (12.97, 79.155)
+    # About 111 km per degree of latitude.
+    METERS = 1 / 111_195
+
+    def setUp(self):
+        reset_process_state()
+        x, y = self.ORIGIN
+        self.near = make_place(name="Near", coord_x=x + 50 * self.METERS, coord_y=y)
+        self.middle = make_place(name="Middle", coord_x=x - 300 * self.METERS, coord_y=y)
+        self.far = make_place(name="Far", coord_x=x + 2000 * self.METERS, coord_y=y)
+        self.hidden = make_place(name="Hidden", coord_x=x, coord_y=y + 10 * self.METERS, approved=False)
+        self.client = APIClient()
+
+    def nearby(self, **params):
+        response = self.client.get("/api/places/nearby/", {"coord_x": self.ORIGIN[0], "coord_y": self.ORIGIN[1], **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def ids(self, **params):
+        return [row["id"] for row in self.nearby(**params)]
+
+    def test_radius_lists_approved_places_nearest_first(self):
+        rows = self.nearby(radius=500)
+        self.assertEqual([row["id"] for row in rows], [self.near.pk, self.middle.pk])
+        self.assertAlmostEqual(rows[0]["distance"], 50, delta=1)
+        self.assertAlmostEqual(rows[1]["distance"], 300, delta=1)
+        self.assertEqual(set(rows[0]), set(PlaceSerializer.Meta.fields) | {"distance"})
+
+    def test_k_nearest_with_an_optional_radius(self):
+        self.assertEqual(self.ids(k=2), [self.near.pk, self.middle.pk])
+        self.assertEqual(self.ids(k=5), [self.near.pk, self.middle.pk, self.far.pk])
+        self.assertEqual(self.ids(k=5, radius=1000), [self.near.pk, self.middle.pk])
+
+    def test_index_follows_place_changes(self):
+        self.assertEqual(self.ids(radius=100), [self.near.pk])
+        self.hidden.approved = True
+        self.hidden.save()
+        self.assertEqual(self.ids(radius=100), [self.hidden.pk, self.near.pk])
+        self.near.delete()
+        self.assertEqual(self.ids(radius=100), [self.hidden.pk])
+
+    def test_needs_a_radius_or_k(self):
+        response = self.client.get("/api/places/nearby/", {"coord_x": 12.97, "coord_y": 79.155})
+        self.assertEqual(response.status_code, 400)
+
+    def test_grid_matches_a_full_scan(self):
+        import random
+
+        rng = random.Random(1)
+        grid = GridIndex(cell_size=0.002)
+        points = {key: (12.96 + rng.random() * 0.03, 79.15 + rng.random() * 0.03) for key in range(400)}
+        points[400] = (13.5, 80.0)
+        grid.rebuild((key, x, y) for key, (x, y) in points.items())
+        for _ in range(30):
+            x, y = 12.96 + rng.random() * 0.03, 79.15 + rng.random() * 0.03
+            scan = sorted((haversine(x, y, px, py), key) for key, (px, py) in points.items())
+            self.assertEqual(grid.nearest(x, y, 7), scan[:7])
+            self.assertEqual(grid.within_radius(x, y, 600), [hit for hit in scan if hit[0] <= 600])
+        self.assertEqual(grid.nearest(12.97, 79.16, 401)[-1][1], 400)
+
+
+class NearbyUsersTests(TestCase):
+    def setUp(self):
+        reset_process_state()
+        self.me = make_user(0, coord_x=12.97, coord_y=79.155)
+        self.others = [make_user(n, coord_x=12.97 + n * 0.0001, coord_y=79.155) for n in range(1, 6)]
+        self.hidden = make_user(6, coord_x=12.97, coord_y=79.155, visible=False)
+        self.offline = make_user(7, coord_x=12.97, coord_y=79.155)
+        for user in [self.me, *self.others, self.hidden]:
+            presence.touch(user.pk)
+        self.client = APIClient()
+        self.client.force_authenticate(self.me)
+
+    def nearby(self, **params):
+        response = self.client.get("/api/user/nearby/", params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_lists_visible_online_users_in_a_compact_payload(self):
+        rows = self.nearby(coord_x=12.97, coord_y=79.155, radius=500)
+        self.assertEqual([row["id"] for row in rows], [user.pk for user in self.others])
+        self.assertEqual(rows[0], {"id": self.others[0].pk, "username": "user1", "avatar": None, "level": 1,
+                                   "coord_x": self.others[0].coord_x, "coord_y": 79.155})
+
+    def test_viewport(self):
+        rows = self.nearby(min_x=12.97025, min_y=79.15, max_x=12.98, max_y=79.16)
+        self.assertCountEqual([row["id"] for row in rows], [user.pk for user in self.others[2:]])
+
+    @override_settings(NEARBY_USERS_LIMIT=3)
+    def test_results_are_capped_without_counting_the_caller(self):
+        rows = self.nearby(coord_x=12.97, coord_y=79.155, radius=500)
+        self.assertEqual([row["id"] for row in rows], [user.pk for user in self.others[:3]])
+        self.assertEqual(len(self.nearby(min_x=12.9, min_y=79.1, max_x=13.0, max_y=79.2)), 3)
+
+    def test_needs_a_circle_or_a_box(self):
+        response = self.client.get("/api/user/nearby/", {"coord_x": 12.97, "coord_y": 79.155})
+        self.assertEqual(response.status_code, 400)
+
+
+class PlaceSearchTests(TestCase):
+    def setUp(self):
+        reset_process_state()
+        self.library = make_place(name="Main Library", description="Books and quiet rooms")
+        self.cafe = make_place(name="Library Cafe", category="food", description="Coffee", coord_x=12.99)
+        self.gym = make_place(name="Gym", category="fitness", description="Weights near the library")
+
+    def search(self, **params):
+        response = self.client.get("/api/places/search/", params)
+        self.assertEqual(response.status_code, 200)
+        return [row["name"] for row in response.json()]
+
+    def test_name_hits_outrank_description_hits(self):
+        names = self.search(q="library")
+        self.assertCountEqual(names[:2], ["Main Library", "Library Cafe"])
+        self.assertEqual(names[2], "Gym")
+
+    def test_last_word_matches_as_prefix(self):
+        self.assertEqual(self.search(q="libr caf"), [])
+        self.assertEqual(self.search(q="library caf"), ["Library Cafe"])
+
+    def test_distance_boost_prefers_nearby_places(self):
+        names = self.search(q="library", coord_x=12.99, coord_y=79.1559)
+        self.assertEqual(names[0], "Library Cafe")
+
+    def test_follows_saves_and_deletes(self):
+        self.search(q="gym")
+        self.gym.name = "Sports Hall"
+        self.gym.save()
+        pending = make_place(name="Gymnasium", approved=False)
+        self.assertEqual(self.search(q="gym"), [])
+        self.assertEqual(self.search(q="sports"), ["Sports Hall"])
+        pending.approved = True
+        pending.save()
+        self.assertEqual(self.search(q="gym"), ["Gymnasium"])
+        pending.delete()
+        self.assertEqual(self.search(q="gym"), [])
+
+
+class ReconcilePlaceCountersTests(TestCase):
+    def setUp(self):
+        users = [make_user(n) for n in range(2)]
+        self.correct, self.over, self.under = (make_place(name=name) for name in ("Correct", "Over", "Under"))
+        for user in users:
+            record_visit(user, self.correct)
+        Visit.objects.create(user=users[0], place=self.over)
+        Place.objects.filter(pk=self.over.pk).update(unique_visitors=5)
+        for user in users:
+            Visit.objects.create(user=user, place=self.under)
+
+    def reconcile(self, *args):
+        out = StringIO()
+        call_command("reconcile_place_counters", *args, stdout=out)
+        return out.getvalue()
+
+    def counters(self):
+        return dict(Place.objects.values_list("name", "unique_visitors"))
+
+    def test_reports_drift_and_repairs_it_with_fix(self):
+        report = self.reconcile()
+        self.assertIn(f"Place {self.over.pk}: unique_visitors=5, actual=1", report)
+        self.assertIn(f"Place {self.under.pk}: unique_visitors=0, actual=2", report)
+        self.assertNotIn(f"Place {self.correct.pk}:", report)
+        self.assertIn("2 places drifted", report)
+        self.assertEqual(self.counters(), {"Correct": 2, "Over": 5, "Under": 0})
+
+        self.assertIn("Repaired 2 places.", self.reconcile("--fix"))
+        self.assertEqual(self.counters(), {"Correct": 2, "Over": 1, "Under": 2})
+        self.assertIn("No counter drift found.", self.reconcile())
+
+
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        reset_process_state()
+
+    def test_sorted_keys_match_a_sorted_list(self):
+        import random
+
+        rng = random.Random(5)
+        keys, expected = SortedKeys(load=4), []
+        for _ in range(500):
+            key = (rng.randrange(-5, 0), rng.randrange(50))
+            if expected and rng.random() < 0.4:
+                key = rng.choice(expected)
+                keys.remove(key)
+                expected.remove(key)
+            else:
+                keys.add(key)
+                expected.append(key)
+                expected.sort()
+            self.assertEqual(len(keys), len(expected))
+            # Between splits the chunk lengths are kept up to date in place.
+            offset = rng.randrange(len(expected) + 1)
+            self.assertEqual(keys.slice(offset, 3), expected[offset:offset + 3])
+            self.assertEqual(keys.index(key), bisect_left(expected, key))
+        self.assertEqual(keys.slice(0, len(expected)), expected)
+        self.assertEqual(keys.slice(7, 5), expected[7:12])
+        for key in expected[::9]:
+            self.assertEqual(keys.index(key), expected.index(key))
+
+    def test_rebuild_keeps_updates_made_while_reading(self):
+        users = [make_user(n, level=n + 1) for n in range(3)]
+        self.assertEqual(leaderboard.entry(users[0].pk)["rank"], 3)
+
+        leaderboard._journal = []
+        CustomUser.objects.filter(pk=users[1].pk).update(level=10)
+        users[0].level = 20
+        leaderboard.update(users[0])
+        leaderboard._rebuild()
+
+        self.assertEqual([row["id"] for row in leaderboard.page(0, 3)], [users[0].pk, users[1].pk, users[2].pk])
+        self.assertIsNone(leaderboard._journal)
+
+
+@override_settings(SUGGESTION_MODE="local")
+class SuggestionCacheTests(TestCase):
+    def setUp(self):
+        reset_process_state()
+        self.user = make_user(coord_x=12.9692, coord_y=79.1559)
+        self.near = make_place(name="Near", coord_x=12.9692, coord_y=79.1559)
+        self.far = make_place(name="Far", coord_x=13.0692, coord_y=79.1559)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def suggest(self):
+        response = self.client.get("/api/suggestions/")
+        self.assertEqual(response.status_code, 200)
+        return response.json()["suggestions"]
+
+    def test_local_rankings_are_cached_per_cell(self):
+        self.assertEqual(self.suggest()[0], self.near.pk)
+        self.assertEqual(self.suggest()[0], self.near.pk)
+        self.assertEqual((suggestion_cache.hits, suggestion_cache.misses), (1, 1))
+
+        self.user.coord_x = 13.0692
+        self.user.save()
+        self.assertEqual(self.suggest()[0], self.far.pk)
+        self.assertEqual(suggestion_cache.misses, 2)
+
+    def test_only_changes_to_the_set_of_places_invalidate(self):
+        self.suggest()
+        other = make_user(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            record_visit(other, self.far)
+            self.near.description = "quiet library"
+            self.near.save()
+        self.suggest()
+        self.assertEqual((suggestion_cache.hits, suggestion_cache.misses), (1, 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            pending = make_place(name="Pending", approved=False)
+        self.suggest()
+        with self.captureOnCommitCallbacks(execute=True):
+            pending.approved = True
+            pending.save()
+        self.suggest()
+        with self.captureOnCommitCallbacks(execute=True):
+            pending.delete()
+        self.suggest()
+        self.assertEqual((suggestion_cache.hits, suggestion_cache.misses), (1, 4))
+
+    @override_settings(SUGGESTION_MODE="hybrid", SUGGESTION_LLM_DEADLINE=0.01)
+    def test_late_llm_answers_are_cached(self):
+        answered, release = threading.Event(), threading.Event()
+
+        def slow_llm(place_data, categories, api_key):
+            release.wait(5)
+            return str(self.far.pk)
+
+        def set_and_signal(*args, original=suggestion_cache.set):
+            original(*args)
+            answered.set()
+
+        with mock.patch("api.views.get_place_recommendations", slow_llm), \
+                mock.patch.object(suggestion_cache, "set", set_and_signal):
+            self.assertEqual(self.suggest()[0], self.near.pk)
+            release.set()
+            self.assertTrue(answered.wait(5))
+        self.assertEqual(self.suggest(), [self.far.pk])
+        self.assertEqual(suggestion_cache.hits, 1)
+
+    def test_busy_llm_pool_is_skipped(self):
+        release = threading.Event()
+        for _ in range(settings.SUGGESTION_LLM_WORKERS):
+            call_with_deadline(release.wait, 0, 5)
+        calls = []
+        self.assertIsNone(call_with_deadline(calls.append, 5, "queued"))
+        release.set()
+        self.assertEqual(calls, [])
+
+        # Slots come back as the calls finish.
+        for _ in range(100):
+            if call_with_deadline(lambda: "answer", 5) == "answer":
+                break
+            time.sleep(0.01)
+        else:
+            self.fail("LLM pool never freed up")
+
+
+@override_settings(SUGGESTION_MODE="llm")
+class AsyncSuggestionTests(TestCase):
+    def setUp(self):
+        reset_process_state()
+        self.place = make_place(name="Library")
+        self.visited = make_place(name="Gym")
+        self.users = [make_user(n) for n in range(4)]
+        Visit.objects.create(user=self.users[3], place=self.visited)
+        self.tokens = {user: str(RefreshToken.for_user(user).access_token) for user in self.users}
+
+    def slow_llm(self, calls):
+        async def complete(api_key, model, messages):
+            calls.append(messages)
+            # Long enough for every request to find this call in flight.
+            await asyncio.sleep(0.2)
+            return str(self.place.pk)
+        return mock.patch("api.suggestions._complete", complete)
+
+    async def suggest(self, user):
+        return await AsyncClient().get("/api/suggestions/async/", headers={"Authorization": f"Bearer {self.tokens[user]}"})
+
+    async def test_identical_prompts_share_one_llm_call(self):
+        calls = []
+        with self.slow_llm(calls):
+            responses = await asyncio.gather(*(self.suggest(user) for user in self.users))
+        self.assertEqual([response.status_code for response in responses], [200] * 4)
+        self.assertEqual([response.json()["suggestions"] for response in responses[:3]], [[self.place.pk]] * 3)
+        # The user who visited the gym gets a different prompt, so a call of their own.
+        self.assertEqual(len(calls), 2)
+
+    async def test_answers_are_cached(self):
+        calls = []
+        with self.slow_llm(calls):
+            await self.suggest(self.users[0])
+            response = await self.suggest(self.users[0])
+        self.assertEqual(response.json()["suggestions"], [self.place.pk])
+        self.assertEqual(len(calls), 1)
+
+
+@override_settings(GOOGLE_CLIENT_ID="test-client")
+class GoogleAuthTests(TestCase):
+    def setUp(self):
+        self.signing_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        jwk = jwt.algorithms.RSAAlgorithm.to_jwk(self.signing_key.public_key(), as_dict=True)
+        self.source = StaticKeySource({"keys": [{**jwk, "kid": "test", "alg": "RS256", "use": "sig"}]})
+        self.fetches = 0
+        fetch = self.source.fetch
+
+        def counting_fetch():
+            self.fetches += 1
+            time.sleep(0.01)
+            return fetch()
+
+        self.source.fetch = counting_fetch
+        key_cache.source = self.source
+        self.addCleanup(setattr, key_cache, "source", None)
+
+    def sign_in(self, audience="test-client"):
+        now = int(time.time())
+        claims = {"iss": "https://accounts.google.com", "aud": audience, "sub": "1", "email": "new@example.com",
+                  "email_verified": True, "iat": now, "exp": now + 600}
+        token = jwt.encode(claims, self.signing_key, algorithm="RS256", headers={"kid": "test"})
+        return self.client.post("/api/auth/google/", {"id_token": token})
+
+    def test_checks_the_audience(self):
+        self.assertEqual(self.sign_in().status_code, 200)
+        self.assertEqual(self.sign_in(audience="someone-else").status_code, 400)
+
+    def test_refuses_without_a_client_id(self):
+        with override_settings(GOOGLE_CLIENT_ID=""):
+            response = self.sign_in()
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(CustomUser.objects.exists())
+
+    def test_concurrent_cold_lookups_fetch_once(self):
+        threads = [threading.Thread(target=key_cache.get, args=("test",)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.fetches, 1)
+
+
+class PercentileTests(SimpleTestCase):
+    def test_nearest_rank(self):
+        values = list(range(1, 11))
+        self.assertEqual(percentile(values, 0.5), 5)
+        self.assertEqual(percentile(values, 0.95), 10)
+        self.assertEqual(percentile(values, 0.25), 3)
+        self.assertEqual(percentile(values, 0.0), 1)
+        self.assertEqual(percentile(values, 1.0), 10)
+
+    def test_even_products_take_that_rank(self):
+        # fraction * n lands exactly on a rank here, which is that rank, not the next one.
+        self.assertEqual(percentile([1, 2, 3, 4], 0.5), 2)
+        self.assertEqual(percentile(list(range(1, 101)), 0.99), 99)
+        self.assertEqual(percentile(list(range(1, 21)), 0.95), 19)
+
+    def test_edges(self):
+        self.assertIsNone(percentile([], 0.5))
+        self.assertEqual(percentile([7], 0.99), 7)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        reset_process_state()
+        for histogram in HISTOGRAMS:
+            histogram.clear()
+        self.user = make_user()
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        make_place()
+
+    @staticmethod
+    def observed(histogram, *labels):
+        """(observations, sum) recorded for ``labels``."""
+        counts, total = histogram._series.get(labels, ([], 0))
+        return sum(counts), total
+
+    def test_sync_requests_are_timed_with_their_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/api/places/")
+        self.assertEqual(self.observed(DB_QUERIES, "place-list-create", "GET"), (1, len(queries)))
+        self.assertEqual(self.observed(REQUEST_SECONDS, "place-list-create", "GET", "200")[0], 1)
+        self.assertEqual(self.observed(RESPONSE_BYTES, "place-list-create", "GET")[0], 1)
+
+    @override_settings(SUGGESTION_MODE="local")
+    async def test_async_views_are_timed_with_their_queries(self):
+        response = await AsyncClient().get("/api/suggestions/async/", headers={"Authorization": f"Bearer {self.token}"})
+        self.assertEqual(response.status_code, 200)
+        count, queries = self.observed(DB_QUERIES, "suggested-places-async", "GET")
+        self.assertEqual(count, 1)
+        self.assertGreater(queries, 0)
+
+    def test_middleware_follows_the_chain(self):
+        async def async_view(request):
+            return None
+
+        self.assertTrue(iscoroutinefunction(MetricsMiddleware(async_view)))
+        self.assertFalse(iscoroutinefunction(MetricsMiddleware(lambda request: None)))
+
+    @override_settings(METRICS_TOKEN="scrape")
+    def test_endpoint_needs_the_token(self):
+        self.client.get("/api/places/")
+        self.assertEqual(self.client.get("/api/metrics/").status_code, 403)
+        response = self.client.get("/api/metrics/", HTTP_AUTHORIZATION="Bearer scrape")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'vellorun_request_seconds_bucket{view="place-list-create",method="GET",status="200",le="+Inf"} 1',
+                      response.content)
+
+
+class LiveHubTests(SimpleTestCase):
+    def position(self, user_id, x, y, level=1):
+        return {"type": "position", "id": user_id, "username": f"user{user_id}", "avatar": None, "level": level,
+                "coord_x": x, "coord_y": y}
+
+    async def test_sends_viewport_deltas_across_workers(self):
+        backend = LocalBackend()
+        worker, other_worker = LiveHub(backend), LiveHub(backend)
+        subscription = worker.subscribe((0, 0, 1, 1), user_id=9)
+        subscription.show([{"id": 1, "username": "user1", "avatar": None, "level": 1}])
+
+        other_worker.publish(self.position(1, 0.5, 0.5))
+        other_worker.publish(self.position(2, 0.2, 0.2))
+        other_worker.publish(self.position(3, 5, 5))
+        other_worker.publish(self.position(9, 0.5, 0.5))
+        changes = await asyncio.wait_for(subscription.changes(), 1)
+        self.assertEqual(changes["moved"], [{"id": 1, "coord_x": 0.5, "coord_y": 0.5}])
+        self.assertEqual([row["id"] for row in changes["entered"]], [2])
+        self.assertEqual(changes["left"], [])
+
+        other_worker.publish(self.position(1, 5, 5))
+        other_worker.publish(self.position(2, 0.3, 0.3, level=2))
+        other_worker.publish({"type": "leave", "id": 3})
+        changes = await asyncio.wait_for(subscription.changes(), 1)
+        self.assertEqual(changes["left"], [1])
+        self.assertEqual(changes["entered"][0]["level"], 2)
+
+    async def test_coalesces_until_the_stream_reads(self):
+        hub = LiveHub(LocalBackend())
+        subscription = hub.subscribe((0, 0, 1, 1))
+        for step in range(5):
+            hub.publish(self.position(1, 0.1 * step, 0.1))
+        hub.publish(self.position(2, 0.5, 0.5))
+        hub.publish({"type": "leave", "id": 2})
+        changes = await asyncio.wait_for(subscription.changes(), 1)
+        self.assertEqual(changes, {"entered": [{"id": 1, "username": "user1", "avatar": None, "level": 1,
+                                                "coord_x": 0.4, "coord_y": 0.1}], "moved": [], "left": []})
+
+
+class UserStreamTests(TestCase):
+    async def test_streams_snapshot_then_deltas(self):
+        user = await CustomUser.objects.acreate(email="walker@example.com", username="walker", coord_x=12.97, coord_y=79.155)
+        await asyncio.to_thread(reset_process_state)
+        presence.touch(user.pk)
+        response = await AsyncClient().get("/api/user/stream/", {"min_x": 12.96, "min_y": 79.15, "max_x": 12.98, "max_y": 79.16})
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = aiter(response.streaming_content)
+        snapshot = await anext(events)
+        self.assertTrue(snapshot.startswith(b"event: snapshot\n"))
+        self.assertIn(b'"walker"', snapshot)
+
+        user.coord_x = 12.975
+        live_hub.publish(live_hub.user_event(user))
+        delta = await asyncio.wait_for(anext(events), 1)
+        self.assertIn(b'"moved": [{"id": %d, "coord_x": 12.975' % user.pk, delta)
+        await events.aclose()
+
+    def test_needs_the_asgi_application(self):
+        response = self.client.get("/api/user/stream/", {"min_x": 0, "min_y": 0, "max_x": 1, "max_y": 1})
+        self.assertEqual(response.status_code, 501)
+
+
+@override_settings(POSITION_FLUSH_INTERVAL=60)
+class PositionBufferTests(TestCase):
+    def setUp(self):
+        reset_process_state()
+        self.users = [make_user(n) for n in range(3)]
+        patcher = mock.patch.object(position_buffer, "_ensure_flusher")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def use(self, store):
+        store.clear()
+        self.addCleanup(store.clear)
+        self.addCleanup(setattr, position_buffer, "_backend", None)
+        position_buffer._backend = store
+
+    def test_flush_writes_the_newest_positions_in_one_update(self):
+        for store in (MemoryPositions(), CachePositions()):
+            with self.subTest(store=type(store).__name__):
+                self.use(store)
+                cache.delete(PositionBuffer.FLUSH_LOCK_KEY)
+                first, second, untouched = self.users
+                position_buffer.push(first.pk, 1.0, 1.0)
+                position_buffer.push(first.pk, 2.0, 2.0)
+                position_buffer.push(second.pk, 3.0, 3.0)
+                self.assertEqual(len(position_buffer), 2)
+                self.assertEqual(position_buffer.get(first.pk), (2.0, 2.0))
+
+                with CaptureQueriesContext(connection) as queries:
+                    self.assertEqual(position_buffer.flush(), 2)
+                self.assertEqual([q["sql"].split()[0] for q in queries if "api_customuser" in q["sql"]], ["UPDATE"])
+                rows = dict((pk, (x, y)) for pk, x, y in CustomUser.objects.values_list("pk", "coord_x", "coord_y"))
+                self.assertEqual(rows, {first.pk: (2.0, 2.0), second.pk: (3.0, 3.0), untouched.pk: (0, 0)})
+                self.assertEqual(len(position_buffer), 0)
+                CustomUser.objects.update(coord_x=0, coord_y=0)
+
+    def test_shared_positions_are_flushed_once_by_one_worker(self):
+        self.use(CachePositions())
+        other_worker = PositionBuffer()
+        other_worker._backend = CachePositions()
+        position_buffer.push(self.users[0].pk, 1.0, 1.0)
+        other_worker.backend.put(self.users[0].pk, 2.0, 2.0)
+        self.assertEqual(position_buffer.get(self.users[0].pk), (2.0, 2.0))
+
+        self.assertEqual(other_worker.flush(), 1)
+        position_buffer.push(self.users[1].pk, 3.0, 3.0)
+        # The lock is held for this interval.
+        self.assertEqual(position_buffer.flush(), 0)
+        self.users[0].refresh_from_db()
+        self.assertEqual((self.users[0].coord_x, self.users[0].coord_y), (2.0, 2.0))
+
+    def test_nearby_follows_moves_reported_to_other_workers(self):
+        self.use(CachePositions())
+        walker = self.users[0]
+        presence.touch(walker.pk)
+        position_buffer.push(walker.pk, 12.97, 79.155)
+        client = APIClient()
+        client.force_authenticate(self.users[1])
+
+        def nearby(x):
+            response = client.get("/api/user/nearby/", {"coord_x": x, "coord_y": 79.155, "radius": 100})
+            return [row["id"] for row in response.json()]
+
+        self.assertEqual(nearby(12.97), [walker.pk])
+        CachePositions().put(walker.pk, 12.98, 79.155)
+        with override_settings(POSITION_FLUSH_INTERVAL=0.001):
+            time.sleep(0.002)
+            self.assertEqual(nearby(12.98), [walker.pk])
+
+    def test_position_arriving_during_a_flush_stays_unwritten(self):
+        self.use(CachePositions())
+        store = position_buffer.backend
+        store.put(self.users[0].pk, 1.0, 1.0)
+        batch = store.take()
+        store.put(self.users[0].pk, 2.0, 2.0)
+        store.settle(batch, written=True)
+        self.assertEqual(store.take(), {self.users[0].pk: (2.0, 2.0)})
+
+
+@override_settings(PRESENCE_SYNC_INTERVAL=0)
+class PresenceTests(TestCase):
+    def setUp(self):
+        reset_process_state()
+        self.walker = make_user(0, online=False, coord_x=12.97, coord_y=79.155)
+        self.stale = make_user(1, online=True, coord_x=12.97, coord_y=79.155)
+
+    def test_backends_expire_entries(self):
+        for store in (MemoryPresence(), CachePresence()):
+            with self.subTest(store=type(store).__name__):
+                self.assertTrue(store.touch(1, 0.05))
+                self.assertFalse(store.touch(1, 0.05))
+                store.touch(2, 60)
+                self.assertEqual(store.online(), {1, 2})
+                time.sleep(0.1)
+                self.assertFalse(store.contains(1))
+                self.assertEqual(store.online(), {2})
+                store.remove(2)
+                self.assertEqual(store.online(), set())
+
+    def test_heartbeats_decide_who_is_online(self):
+        client = APIClient()
+        client.force_authenticate(self.walker)
+        client.post("/api/user/heartbeat/", {"coord_x": 12.97, "coord_y": 79.155}, format="json")
+
+        online = self.client.get("/api/user/online/").json()
+        self.assertEqual([row["email"] for row in online], [self.walker.email])
+        nearby = self.client.get("/api/user/nearby/", {"coord_x": 12.97, "coord_y": 79.155, "radius": 100}).json()
+        self.assertEqual([row["id"] for row in nearby], [self.walker.pk])
+
+    def shared_store(self):
+        store = CachePresence()
+        self.addCleanup(setattr, presence, "_backend", None)
+        presence._backend = store
+        return store
+
+    def test_sync_batches_the_column_and_drops_expired_users(self):
+        self.shared_store()
+        presence.touch(self.walker.pk)
+        self.client.get("/api/user/nearby/", {"coord_x": 12.97, "coord_y": 79.155, "radius": 100})
+        self.assertEqual(presence.sync(), (1, 1))
+        self.assertEqual(set(CustomUser.objects.filter(online=True).values_list("id", flat=True)), {self.walker.pk})
+
+        presence.leave(self.walker.pk)
+        with self.assertNumQueries(2):
+            self.assertEqual(presence.sync(), (0, 1))
+        self.assertEqual(user_index.profiles, {})
+
+    @override_settings(PRESENCE_SYNC_INTERVAL=15)
+    def test_one_worker_writes_the_column_per_interval(self):
+        self.shared_store()
+        self.assertEqual(presence.sync(), (0, 1))
+        presence.touch(self.walker.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(presence.sync(), (0, 0))
+        cache.delete(PresenceStore.SYNC_LOCK_KEY)
+        self.assertEqual(presence.sync(), (1, 0))
+
+    def test_worker_local_store_leaves_the_column_alone(self):
+        presence.touch(self.walker.pk)
+        # Only the walker's version token moves.
+        with self.assertNumQueries(1):
+            self.assertEqual(presence.sync(), (0, 0))
+        self.assertTrue(CustomUser.objects.get(pk=self.stale.pk).online)
+
+        client = APIClient()
+        client.force_authenticate(self.stale)
+        self.assertFalse(client.get("/api/user/profile/").json()["online"])
+        client.force_authenticate(self.walker)
+        self.assertTrue(client.get("/api/user/profile/").json()["online"])
+
+    def test_online_users_page_over_the_presence_set(self):
+        users = [self.walker, self.stale, *(make_user(n) for n in range(2, 7))]
+        for user in users:
+            presence.touch(user.pk)
+
+        seen, url, params = [], "/api/user/online/", {"page_size": 3}
+        while url:
+            with self.assertNumQueries(1):
+                page = self.client.get(url, params).json()
+            seen += [row["email"] for row in page["results"]]
+            url, params = page["next"], None
+        self.assertEqual(seen, [user.email for user in users])
+
+        with mock.patch("api.utils.in_batches.__defaults__", (2,)):
+            with self.assertNumQueries(4):
+                rows = self.client.get("/api/user/online/").json()
+        self.assertEqual(len(rows), len(users))
+        self.assertEqual(self.client.get("/api/user/online/", {"cursor": "bogus"}).status_code, 404)
+
+
+class MeBundleTests(TestCase):
+    def setUp(self):
+        reset_process_state()
+        self.user = make_user()
+        self.client = APIClient()
+        # A real token, so each request loads the user and its version like in production.
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(self.user).access_token}")
+        self.visited, self.saved, self.mine = make_place(name="Visited"), make_place(name="Saved"), make_place(created_by=self.user)
+        Visit.objects.create(user=self.user, place=self.visited)
+        SavedPlace.objects.create(user=self.user, place=self.saved)
+
+    def assertUnchanged(self, etag, unchanged=True):
+        response = self.client.get("/api/user/me/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304 if unchanged else 200)
+        return response["ETag"]
+
+    def test_bundle_lists_every_relation(self):
+        response = self.client.get("/api/user/me/")
+        self.assertEqual(response.data["profile"]["email"], self.user.email)
+        self.assertEqual(response.data["visited_place_ids"], [self.visited.pk])
+        self.assertEqual(response.data["contributed_place_ids"], [self.mine.pk])
+        self.assertEqual(response.data["saved_place_ids"], [self.saved.pk])
+
+    def test_unchanged_bundle_is_a_304_on_the_authenticated_row(self):
+        etag = self.client.get("/api/user/me/")["ETag"]
+        with self.assertNumQueries(1):
+            self.assertUnchanged(etag)
+        # The version lives in the database, so a worker with an empty cache agrees.
+        cache.clear()
+        self.assertUnchanged(etag)
+
+    @override_settings(POSITION_FLUSH_INTERVAL=0, PRESENCE_SYNC_INTERVAL=0)
+    def test_flushed_positions_move_the_etag(self):
+        self.client.post("/api/user/heartbeat/", {"coord_x": 1.0, "coord_y": 2.0}, format="json")
+        etag = self.client.get("/api/user/me/")["ETag"]
+        self.client.post("/api/user/heartbeat/", {"coord_x": 1.5, "coord_y": 2.0}, format="json")
+        self.assertUnchanged(etag, unchanged=False)
+
+    def test_changes_move_the_etag(self):
+        etag = self.client.get("/api/user/me/")["ETag"]
+        self.client.post("/api/places/saved/", {"place_id": self.visited.pk}, format="json")
+        etag = self.assertUnchanged(etag, unchanged=False)
+        self.client.post("/api/visit/", {"place_id": self.saved.pk}, format="json")
+        etag = self.assertUnchanged(etag, unchanged=False)
+        self.client.patch("/api/user/profile/", {"avatar": 4}, format="json")
+        etag = self.assertUnchanged(etag, unchanged=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.visited.delete()
+        response = self.client.get("/api/user/me/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.data["visited_place_ids"], [self.saved.pk])
+
+    def test_other_users_and_place_edits_keep_the_304(self):
+        etag = self.client.get("/api/user/me/")["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            record_visit(make_user(1), self.visited)
+            self.saved.description = "reading room"
+            self.saved.save()
+        self.assertUnchanged(etag)
+
+    @override_settings(AUTH_USER_CACHE_TTL=60)
+    def test_recomputed_badges_move_the_etag(self):
+        etag = self.client.get("/api/user/me/")["ETag"]
+        call_command("recompute_badges", stdout=StringIO())
+        response = self.client.get("/api/user/me/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["profile"]["badges"], ["nerd"])
+
+
+class SavedPlacesTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.places = [make_place(name=f"Place {n}") for n in range(4)]
+        SavedPlace.objects.create(user=self.user, place=self.places[0])
+
+    def test_expanded_list_is_one_query_however_long(self):
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/places/saved/", {"expand": 1})
+        self.assertEqual(response.data["saved_places"][0]["place"]["name"], "Place 0")
+
+        for place in self.places[1:]:
+            SavedPlace.objects.create(user=self.user, place=place)
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/places/saved/", {"expand": 1})
+        self.assertEqual([row["place"]["id"] for row in response.data["saved_places"]], [p.pk for p in self.places])
+
+        response = self.client.get("/api/places/saved/", {"expand": 1, "page_size": 2})
+        self.assertEqual(len(response.data["saved_places"]), 2)
+        self.assertIsNotNone(response.data["next"])
+
+    def test_bulk_save_and_unsave(self):
+        ids = [p.pk for p in self.places]
+        response = self.client.post("/api/places/saved/bulk/", {"place_ids": ids + [ids[1], 10**6]}, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {"saved": ids[1:], "already_saved": ids[:1], "not_found": [10**6]})
+        self.assertEqual(SavedPlace.objects.filter(user=self.user).count(), 4)
+
+        response = self.client.delete("/api/places/saved/bulk/", {"place_ids": ids[:2] + [10**6]}, format="json")
+        self.assertEqual(response.data, {"removed": ids[:2], "not_saved": [10**6]})
+        self.assertEqual(set(SavedPlace.objects.filter(user=self.user).values_list("place_id", flat=True)), set(ids[2:]))
+
+        response = self.client.post("/api/places/saved/bulk/", {"place_ids": []}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+
+class ConcurrentVisitTests(TransactionTestCase):
+    def run_concurrently(self, jobs):
+        barrier = threading.Barrier(len(jobs))
+        errors = []
+
+        def worker(job):
+            try:
+                barrier.wait()
+                job()
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(job,)) for job in jobs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_no_lost_place_increments(self):
+        place = make_place()
+        users = [make_user(n) for n in range(8)]
+
+        self.run_concurrently([lambda user=user: record_visit(user, place) for user in users])
+
+        place.refresh_from_db()
+        self.assertEqual(place.visits, len(users))
+        self.assertEqual(Visit.objects.filter(place=place).count(), len(users))
+
+    def test_no_lost_user_xp(self):
+        user = make_user()
+        places = [make_place(name=f"Place {n}", xp_reward=7) for n in range(8)]
+
+        self.run_concurrently([lambda place=place: record_visit(user, place) for place in places])
+
+        user.refresh_from_db()
+        self.assertEqual(user.xp, 7 * len(places))
+
+
+def reset_process_state():
+    """Forget everything the in-process indexes and caches picked up."""
+    cache.clear()
+    for index in (place_index, user_index, search_index, leaderboard):
+        index.reset()
+    for store in (suggestion_cache, position_buffer, geofence_tracker, presence):
+        store.clear()
+
+
+# SQL queries each endpoint may run against the QueryCountTests dataset,
+# starting from cold caches and indexes. Every URL name in api/urls.py must
+# be listed, so a new endpoint cannot slip in without a budget.
+QUERY_BUDGETS = {
+    ("google-auth", "post"): 6,
+    ("token-refresh", "post"): 7,
+    ("user-profile", "get"): 1,
+    ("user-profile", "patch"): 2,
+    ("user-me", "get"): 3,
+    ("online-users", "get"): 1,
+    ("nearby-users", "get"): 2,
+    ("user-heartbeat", "post"): 3,
+    ("user-stream", "get"): 1,
+    ("place-list-create", "get"): 3,
+    ("place-list-create", "post"): 6,
+    ("nearby-places", "get"): 2,
+    ("place-search", "get"): 1,
+    ("place-detail", "get"): 1,
+    ("place-detail", "patch"): 7,
+    ("place-detail", "delete"): 13,
+    ("visit-place", "post"): 11,
+    ("visit-batch", "post"): 16,
+    ("approve-place", "post"): 7,
+    ("visited-places", "get"): 2,
+    ("contributed-places", "get"): 2,
+    ("saved-places", "get"): 2,
+    ("saved-places", "post"): 7,
+    ("saved-places", "delete"): 4,
+    ("saved-places-bulk", "post"): 4,
+    ("saved-places-bulk", "delete"): 4,
+    ("suggested-places", "get"): 4,
+    ("suggested-places-async", "get"): 4,
+    ("user-leaderboard", "get"): 1,
+    ("user-leaderboard-me", "get"): 2,
+    ("place-leaderboard", "get"): 1,
+    ("metrics", "get"): 0,
+}
+# Streams only the ASGI application serves; their budget covers the opening snapshot.
+ASGI_ONLY = {"user-stream"}
+
+
+@override_settings(SUGGESTION_MODE="local", POSITION_FLUSH_INTERVAL=0, PRESENCE_SYNC_INTERVAL=0, GOOGLE_CLIENT_ID="test-client")
+class QueryCountTests(TestCase):
+    """
+    Pins the number of SQL queries behind every URL.
+
+    The dataset has several rows behind every relation an endpoint touches,
+    so a per-row query (N+1) or a dropped select_related shows up as a
+    different count.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_user(0, coord_x=12.9692, coord_y=79.1559)
+        cls.admin = make_user(1, is_superuser=True, is_staff=True)
+        for n in range(2, 6):
+            make_user(n, coord_x=12.9692 + n / 10000, coord_y=79.1559)
+        cls.places = [
+            make_place(name=f"Place {n}", coord_x=12.97 + n / 1000, created_by=cls.user,
+                       category=["campus", "food", "fitness"][n % 3])
+            for n in range(8)
+        ]
+        cls.pending = make_place(name="Pending", approved=False, created_by=cls.user)
+        cls.online = list(CustomUser.objects.values_list("id", flat=True))
+        for place in cls.places[:4]:
+            Visit.objects.create(user=cls.user, place=place)
+        for place in cls.places[2:6]:
+            SavedPlace.objects.create(user=cls.user, place=place)
+
+    def setUp(self):
+        reset_process_state()
+        self.signing_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        jwk = jwt.algorithms.RSAAlgorithm.to_jwk(self.signing_key.public_key(), as_dict=True)
+        key_cache.source = StaticKeySource({"keys": [{**jwk, "kid": "test", "alg": "RS256", "use": "sig"}]})
+        self.addCleanup(setattr, key_cache, "source", None)
+
+    def google_token(self, email):
+        now = int(time.time())
+        claims = {"iss": "https://accounts.google.com", "aud": "test-client", "sub": email, "email": email,
+                  "email_verified": True, "name": "New Explorer", "iat": now, "exp": now + 600}
+        return jwt.encode(claims, self.signing_key, algorithm="RS256", headers={"kid": "test"})
+
+    def client_for(self, user):
+        client = APIClient()
+        if user is not None:
+            client.credentials(HTTP_AUTHORIZATION=f"Bearer {RefreshToken.for_user(user).access_token}")
+        return client
+
+    def request_for(self, name, method):
+        """(user, path, payload) for one call of ``method`` on the URL named ``name``."""
+        place, pending, unvisited = self.places[0], self.pending, self.places[6]
+        near = {"coord_x": 12.9692, "coord_y": 79.1559}
+        requests = {
+            ("google-auth", "post"): (None, "/api/auth/google/", {"id_token": self.google_token("new@example.com")}),
+            ("token-refresh", "post"): (None, "/api/token/refresh/", {"refresh": str(RefreshToken.for_user(self.user))}),
+            ("user-profile", "get"): (self.user, "/api/user/profile/", None),
+            ("user-profile", "patch"): (self.user, "/api/user/profile/", {"visible": False}),
+            ("user-me", "get"): (self.user, "/api/user/me/", None),
+            ("online-users", "get"): (None, "/api/user/online/", None),
+            ("nearby-users", "get"): (self.user, "/api/user/nearby/", {**near, "radius": 500}),
+            ("user-heartbeat", "post"): (self.user, "/api/user/heartbeat/", {"coord_x": 12.9, "coord_y": 79.1}),
+            ("user-stream", "get"): (None, "/api/user/stream/", {"min_x": 12.96, "min_y": 79.15, "max_x": 12.98, "max_y": 79.16}),
+            ("place-list-create", "get"): (None, "/api/places/", None),
+            ("place-list-create", "post"): (self.user, "/api/places/", {"name": "New", "type": "inside", "coord_x": 12.97, "coord_y": 79.15}),
+            ("nearby-places", "get"): (None, "/api/places/nearby/", {**near, "k": 5}),
+            ("place-search", "get"): (None, "/api/places/search/", {**near, "q": "place fo"}),
+            ("place-detail", "get"): (None, f"/api/places/{place.pk}/", None),
+            ("place-detail", "patch"): (self.admin, f"/api/places/{place.pk}/", {"name": "Renamed"}),
+            ("place-detail", "delete"): (self.admin, f"/api/places/{unvisited.pk}/", None),
+            ("visit-place", "post"): (self.user, "/api/visit/", {"place_id": unvisited.pk}),
+            ("visit-batch", "post"): (self.user, "/api/visit/batch/", {"visits": [{"place_id": p.pk} for p in self.places]}),
+            ("approve-place", "post"): (self.admin, f"/api/places/{pending.pk}/approve/", None),
+            ("visited-places", "get"): (self.user, "/api/places/visited/", None),
+            ("contributed-places", "get"): (self.user, "/api/places/contributed/", None),
+            ("saved-places", "get"): (self.user, "/api/places/saved/", None),
+            ("saved-places", "post"): (self.user, "/api/places/saved/", {"place_id": unvisited.pk}),
+            ("saved-places", "delete"): (self.user, "/api/places/saved/", {"place_id": self.places[2].pk}),
+            ("saved-places-bulk", "post"): (self.user, "/api/places/saved/bulk/", {"place_ids": [p.pk for p in self.places] + [10**6]}),
+            ("saved-places-bulk", "delete"): (self.user, "/api/places/saved/bulk/", {"place_ids": [p.pk for p in self.places]}),
+            ("suggested-places", "get"): (self.user, "/api/suggestions/", None),
+            ("suggested-places-async", "get"): (self.user, "/api/suggestions/async/", None),
+            ("user-leaderboard", "get"): (None, "/api/user/leaderboard/", None),
+            ("user-leaderboard-me", "get"): (self.user, "/api/user/leaderboard/me/", None),
+            ("place-leaderboard", "get"): (None, "/api/places/leaderboard/", None),
+            ("metrics", "get"): (None, "/api/metrics/", None),
+        }
+        return requests[(name, method)]
+
+    def test_every_url_has_a_budget(self):
+        names = {pattern.name for pattern in urls.urlpatterns if isinstance(pattern, URLPattern)}
+        self.assertEqual(names, {name for name, _ in QUERY_BUDGETS})
+
+    def test_query_counts(self):
+        for (name, method), budget in QUERY_BUDGETS.items():
+            with self.subTest(url=name, method=method):
+                user, path, payload = self.request_for(name, method)
+                client = self.client_for(user)
+                reset_process_state()
+                for user_id in self.online:
+                    presence.touch(user_id)
+                # Each call runs against the same dataset.
+                with transaction.atomic():
+                    with CaptureQueriesContext(connection) as queries:
+                        if name in ASGI_ONLY:
+                            response = async_to_sync(getattr(AsyncClient(), method))(path, payload)
+                        else:
+                            kwargs = {"format": "json"} if method != "get" else {}
+                            response = getattr(client, method)(path, payload, **kwargs)
+                    transaction.set_rollback(True)
+                self.assertLess(response.status_code, 400, b"" if response.streaming else response.content)
+                self.assertEqual(len(queries), budget, "\n".join(q["sql"] for q in queries.captured_queries))
@@ -1,20 +1,33 @@
 from django.urls import path
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from .views import GoogleAuthView, ProfileView, PlaceListCreateView, PlaceDetailView, VisitPlaceView, ApprovePlaceView, SavedPlaceView, VisibleUsersView, SuggestedPlacesView, VisitedPlacesView, ContributedPlacesView, UserLeaderboardView, PlacesLeaderboardView
+from .async_views import suggested_places as suggested_places_async, user_stream
+from .metrics import metrics_view
+from .views import GoogleAuthView, ProfileView, PlaceListCreateView, PlaceDetailView, VisitPlaceView, ApprovePlaceView, SavedPlaceView, VisibleUsersView, SuggestedPlacesView, VisitedPlacesView, ContributedPlacesView, UserLeaderboardView, PlacesLeaderboardView, NearbyPlacesView, NearbyUsersView, MyLeaderboardRankView, BatchVisitView, HeartbeatView, PlaceSearchView, MeView, SavedPlaceBulkView
 
 urlpatterns = [
     path('auth/google/', GoogleAuthView.as_view(), name='google-auth'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token-refresh'),
     path('user/profile/', ProfileView.as_view(), name='user-profile'),
+    path('user/me/', MeView.as_view(), name='user-me'),
     path('user/online/', VisibleUsersView.as_view(), name='online-users'),
+    path('user/nearby/', NearbyUsersView.as_view(), name='nearby-users'),
+    path('user/heartbeat/', HeartbeatView.as_view(), name='user-heartbeat'),
+    path('user/stream/', user_stream, name='user-stream'),
     path('places/', PlaceListCreateView.as_view(), name='place-list-create'),
+    path('places/nearby/', NearbyPlacesView.as_view(), name='nearby-places'),
+    path('places/search/', PlaceSearchView.as_view(), name='place-search'),
     path('places/<int:pk>/', PlaceDetailView.as_view(), name='place-detail'),
     path('visit/', VisitPlaceView.as_view(), name='visit-place'),
+    path('visit/batch/', BatchVisitView.as_view(), name='visit-batch'),
     path('places/<int:pk>/approve/', ApprovePlaceView.as_view(), name='approve-place'),
     path('places/visited/', VisitedPlacesView.as_view(), name='visited-places'),
     path('places/contributed/', ContributedPlacesView.as_view(), name='contributed-places'),
     path('places/saved/', SavedPlaceView.as_view(), name='saved-places'),
+    path('places/saved/bulk/', SavedPlaceBulkView.as_view(), name='saved-places-bulk'),
     path('suggestions/', SuggestedPlacesView.as_view(), name='suggested-places'),
+    path('suggestions/async/', suggested_places_async, name='suggested-places-async'),
     path('user/leaderboard/', UserLeaderboardView.as_view(), name='user-leaderboard'),
+    path('user/leaderboard/me/', MyLeaderboardRankView.as_view(), name='user-leaderboard-me'),
     path('places/leaderboard/', PlacesLeaderboardView.as_view(), name='place-leaderboard'),
+    path('metrics/', metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -0,0 +1,22 @@
+"""
+Per-user version tokens for conditional GETs of per-user data.
+
+The token is ``CustomUser.version``, a UUID replaced on every save of the
+user and by ``bump_user_versions`` for changes that do not save the row
+(saved places, buffered positions, presence). Living in the row, it comes
+with the user authentication loads anyway and every worker agrees on it.
+"""
+import uuid
+
+from .authentication import forget_users
+
+
+def bump_user_versions(user_ids, batch=500):
+    """Give ``user_ids`` new tokens, one UPDATE per ``batch`` users."""
+    from .models import CustomUser
+
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), batch):
+        CustomUser.objects.filter(pk__in=user_ids[start:start + batch]).update(version=uuid.uuid4())
+    # update() sends no signals, so drop the cached copies here.
+    forget_users(user_ids)
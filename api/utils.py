@@ -1,10 +1,10 @@
+from django.utils.http import parse_etags, quote_etag
 from rest_framework import permissions
-from .models import Place
+from .badges import apply_visit, badges_for
 
 def check_and_level_up(user):
     if user.xp%100 == 0:
         user.level += 1
-    user.save()
 
 
 class IsSuperUserOrReadOnly(permissions.BasePermission):
@@ -19,26 +19,41 @@ class IsSuperUserOrReadOnly(permissions.BasePermission):
         return request.user and request.user.is_authenticated and request.user.is_superuser
 
 
-def update_user_badges(user):
-    visited_places = Place.objects.filter(visit__user=user)
-    place_description = {place.description.lower() for place in visited_places}
-    categories = {place.category.lower() for place in visited_places if place.category}
-    badges = []
+def update_user_badges(user, place):
+    """
+    Fold a new visit to ``place`` into the user's badge counters.
+
+    Only touches ``user.badges`` when the set of badges actually changes.
+    Returns True in that case so the caller knows to save the field.
+    """
+    user.badge_progress = apply_visit(user.badge_progress, place.description, place.category)
+    badges = badges_for(user.badge_progress)
+    if badges == sorted(user.badges or []):
+        return False
+    user.badges = badges
+    return True
 
-    if "library" in place_description or any("academic" in name for name in place_description):
-        badges.append("nerd")
 
-    if "food" in categories:
-        badges.append("foodie")
+def in_batches(queryset, ids, size=500):
+    """
+    Rows of ``queryset`` whose primary key is in ``ids``, in primary key order.
+
+    Asks for at most ``size`` keys per query, so a large ID set never turns
+    into one huge IN list.
+    """
+    ids = sorted(ids)
+    for start in range(0, len(ids), size):
+        yield from queryset.filter(pk__in=ids[start:start + size]).order_by('pk')
 
-    if "rnr" in place_description or "arcade" in place_description:
-        badges.append("gamer")
 
-    if "fitness" in categories:
-        badges.append("jock")
+def make_etag(*parts):
+    return quote_etag("-".join(str(part) for part in parts))
 
-    if any("hostel" in name for name in place_description) and categories == {"campus"}:
-        badges.append("sleepyhead")
 
-    user.badges = list(set(badges))
-    user.save()
+def etag_matches(request, etag):
+    """True when the request's If-None-Match already names ``etag``."""
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return etags == ["*"] or etag in etags
@@ -1,19 +1,32 @@
-import requests
+import hashlib
 from random import randint
-from collections import Counter
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView
 from django_filters.rest_framework import DjangoFilterBackend
 from django.shortcuts import get_object_or_404
 from django.conf import settings
-from django.db.models import Q, Count
-from .serializers import RegisterSerializer, ProfileSerializer, PlaceSerializer, VisitSerializer, GoogleAuthSerializer, SavedPlaceSerializer, SuggestedPlaceSerializer
-from .utils import IsSuperUserOrReadOnly, check_and_level_up, update_user_badges
-from .models import CustomUser, Place, Visit, SavedPlace
-from .suggestions import get_place_recommendations
+from django.db.models import Q, Exists, OuterRef, Value
+from .serializers import requested_fields, place_rows, RegisterSerializer, ProfileSerializer, PlaceSerializer, VisitSerializer, BatchVisitSerializer, GoogleAuthSerializer, SavedPlaceSerializer, SavedPlaceIdsSerializer, SuggestedPlaceSerializer, NearbyPlacesSerializer, NearbyUsersSerializer, PlaceSearchSerializer, HeartbeatSerializer, LeaderboardPageSerializer, CatalogSinceSerializer
+from .utils import IsSuperUserOrReadOnly, in_batches, make_etag, etag_matches
+from .models import CustomUser, Place, Visit, SavedPlace, PlaceTombstone
+from .catalog import current_membership, current_version, visit_stamp
+from .user_versions import bump_user_versions
+from .pagination import OptionalCursorPagination, paginate_ids, paginate_id_set
+from .renderers import ORJSONRenderer
+from .suggestions import get_place_recommendations, suggestion_cache, call_with_deadline, cache_late_answer, suggestion_inputs, candidate_places, finish_suggestions
+from .spatial import place_index, user_index
+from .search import search_index
+from .positions import position_buffer
+from .presence import presence
+from .geofence import auto_visit
+from .live import live_hub
+from .leaderboard import leaderboard
+from .visits import record_visit, record_visits
+from .google_auth import verify_id_token, InvalidGoogleToken, GoogleKeysUnavailable, GoogleAuthNotConfigured
 
 class GoogleAuthView(APIView):
     permission_classes = [permissions.AllowAny]
@@ -23,16 +36,14 @@ class GoogleAuthView(APIView):
         serializer.is_valid(raise_exception=True)
         id_token = serializer.validated_data["id_token"]
 
-        response = requests.get(f"https://oauth2.googleapis.com/tokeninfo?id_token={id_token}")
-        if response.status_code != 200:
+        try:
+            payload = verify_id_token(id_token)
+        except InvalidGoogleToken:
             return Response({"error": "Invalid Google ID token"}, status=400)
-
-        payload = response.json()
-        
-        '''
-        if payload["aud"] != settings.GOOGLE_CLIENT_ID:
-            return Response({"error": "Invalid audience"}, status=400)
-        '''
+        except GoogleKeysUnavailable:
+            return Response({"error": "Could not reach Google to verify the token"}, status=503)
+        except GoogleAuthNotConfigured:
+            return Response({"error": "Google sign-in is not configured"}, status=503)
 
         email = payload["email"]
         username = payload.get("name", email.split("@")[0])
@@ -53,13 +64,98 @@ class ProfileView(generics.RetrieveUpdateAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self):
-        return self.request.user
+        return position_buffer.apply([self.request.user])[0]
+
+    def perform_update(self, serializer):
+        # Settle presence first, the save signal puts the user on or off the map from it.
+        online = serializer.validated_data.get('online')
+        if online is True:
+            presence.touch(self.request.user.pk)
+        elif online is False:
+            presence.leave(self.request.user.pk)
+        user = serializer.save()
+        if {'coord_x', 'coord_y'} & set(serializer.validated_data):
+            # Written straight to the row, an older heartbeat must not win later.
+            position_buffer.discard(user.pk)
+            auto_visit(user, user.coord_x, user.coord_y)
+
+
+class MeView(APIView):
+    """
+    What the app loads on launch, in one request: the profile and the IDs of
+    the places the user visited, contributed and saved.
+
+    The ETag combines the user's version token (see api/user_versions.py),
+    read from the row authentication already loaded, with the catalog
+    membership counter, which only moves when places are added, approved or
+    deleted (deleting one drops it from the lists without saving the user),
+    so an unchanged bundle costs a 304 with no query of its own.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        user = request.user
+        # Versions first: a change landing before the reads only costs a refetch.
+        etag = make_etag("me", user.pk, user.version.hex, current_membership())
+        if etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+        place_ids = {"visited": [], "contributed": [], "saved": []}
+        rows = Visit.objects.filter(user=user).values_list(Value("visited"), "place_id").union(
+            Place.objects.filter(created_by=user).values_list(Value("contributed"), "id"),
+            SavedPlace.objects.filter(user=user).values_list(Value("saved"), "place_id"),
+            all=True,
+        )
+        for kind, place_id in rows:
+            place_ids[kind].append(place_id)
+
+        user = position_buffer.apply([user])[0]
+        return Response({
+            "profile": ProfileSerializer(user).data,
+            "visited_place_ids": sorted(place_ids["visited"]),
+            "contributed_place_ids": sorted(place_ids["contributed"]),
+            "saved_place_ids": sorted(place_ids["saved"]),
+        }, headers={"ETag": etag})
+
+
+class HeartbeatView(APIView):
+    """
+    Lightweight position updates.
+
+    Positions are buffered and written back in batches (see api/positions.py),
+    so a heartbeat costs no database write of its own. It also keeps the
+    user online (see api/presence.py). Entering a place's geofence records
+    the visit and answers with what was visited.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = HeartbeatSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        coord_x, coord_y = serializer.validated_data['coord_x'], serializer.validated_data['coord_y']
+        # The position shows in user/me/ once flushed, which bumps the version then.
+        position_buffer.push(request.user.pk, coord_x, coord_y)
+        if presence.touch(request.user.pk):
+            bump_user_versions([request.user.pk])
+            user_index.sync(request.user)
+        live_hub.publish(live_hub.user_event(request.user, coord_x, coord_y))
+
+        visited, user = auto_visit(request.user, coord_x, coord_y)
+        if not visited:
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        return Response({
+            "visited": [{"place_id": place.pk, "place_name": place.name, "xp_gained": place.xp_reward} for place in visited],
+            "user_xp": user.xp,
+            "user_level": user.level,
+        }, status=status.HTTP_200_OK)
 
 
 class PlaceListCreateView(generics.ListCreateAPIView):
     queryset = Place.objects.all()
     serializer_class = PlaceSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = OptionalCursorPagination
+    renderer_classes = [ORJSONRenderer, BrowsableAPIRenderer]
     filter_backends = [DjangoFilterBackend]
     filterset_fields = {
         'type': ['exact'],
@@ -75,8 +171,69 @@ class PlaceListCreateView(generics.ListCreateAPIView):
         qs = Place.objects.all()
         if not self.request.user.is_superuser:
             qs = qs.filter(approved=True)
+        if self.request.method == "GET":
+            fields = requested_fields(self.request, PlaceSerializer.Meta.fields)
+            if fields is not None:
+                if self.request.user.is_superuser and PlaceSerializer.wants_approved(self.request):
+                    fields.append("approved")
+                qs = qs.only(*fields)
         return qs
 
+    def list(self, request, *args, **kwargs):
+        version = current_version()
+        # Deltas only follow the version; full lists also follow visit counts.
+        stamp = 0 if "since" in request.query_params else visit_stamp()
+        etag = make_etag("catalog", version, stamp, int(request.user.is_superuser), hashlib.md5(request.GET.urlencode().encode()).hexdigest())
+        headers = {"ETag": etag, "X-Catalog-Version": str(version)}
+        if etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        if "since" in request.query_params:
+            response = self.delta(request, version)
+        else:
+            response = self.fast_list(request) or super().list(request, *args, **kwargs)
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    def fast_list(self, request):
+        """Unpaginated list built from values() rows, or None when the regular path is needed."""
+        if self.paginator.requested(request):
+            return None
+        rows = place_rows(self.filter_queryset(self.get_queryset()), request)
+        if rows is None:
+            return None
+        response = Response(rows)
+        response.fast_json = True
+        return response
+
+    def delta(self, request, version):
+        """
+        Places changed and deleted after catalog version ``since``.
+
+        ``version`` was read before querying, so everything up to it is
+        included; later writes may show up too and are harmlessly resent.
+        """
+        serializer = CatalogSinceSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        since = serializer.validated_data["since"]
+
+        changed = self.filter_queryset(self.get_queryset()).filter(version__gt=since)
+        deleted = list(PlaceTombstone.objects.filter(version__gt=since).values_list("place_id", flat=True))
+        if not request.user.is_superuser:
+            # Unapproved places are invisible to regular users, so to them an
+            # unapproval looks like a delete.
+            deleted += Place.objects.filter(version__gt=since, approved=False).values_list("id", flat=True)
+
+        rows = place_rows(changed, request)
+        response = Response({
+            "version": version,
+            "changed": rows if rows is not None else self.get_serializer(changed, many=True).data,
+            "deleted": deleted,
+        })
+        response.fast_json = rows is not None
+        return response
+
     def perform_create(self, serializer):
         if self.request.user.is_superuser:
             serializer.save(created_by=self.request.user, approved=True)
@@ -84,6 +241,47 @@ class PlaceListCreateView(generics.ListCreateAPIView):
             serializer.save(created_by=self.request.user, approved=False)
 
 
+class NearbyPlacesView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        serializer = NearbyPlacesSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+        x, y = params['coord_x'], params['coord_y']
+
+        if 'k' in params:
+            matches = place_index.nearest(x, y, params['k'], max_radius=params.get('radius'))
+        else:
+            matches = place_index.within_radius(x, y, params['radius'], limit=settings.NEARBY_PLACES_LIMIT)
+
+        places = Place.objects.in_bulk([place_id for _, place_id in matches])
+        data = []
+        for distance, place_id in matches:
+            place = places.get(place_id)
+            # Another worker may have unapproved or deleted it since our last reload.
+            if place is None or not place.approved:
+                continue
+            row = PlaceSerializer(place, context={'request': request}).data
+            row['distance'] = round(distance, 1)
+            data.append(row)
+        return Response(data)
+
+
+class PlaceSearchView(APIView):
+    permission_classes = [permissions.AllowAny]
+    renderer_classes = [ORJSONRenderer, BrowsableAPIRenderer]
+
+    def get(self, request):
+        serializer = PlaceSearchSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+        origin = (params['coord_x'], params['coord_y']) if 'coord_x' in params else None
+        response = Response(search_index.search(params['q'], limit=params['limit'], origin=origin))
+        response.fast_json = True
+        return response
+
+
 class PlaceDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Place.objects.all()
     serializer_class = PlaceSerializer
@@ -99,9 +297,8 @@ class VisitPlaceView(APIView):
 
         place_id = serializer.validated_data['place_id']
         place = get_object_or_404(Place, id=place_id)
-        user = request.user
 
-        visit, created = Visit.objects.get_or_create(user=user, place=place)
+        created, user, total_visits = record_visit(request.user, place)
 
         if not created:
             return Response({
@@ -109,26 +306,70 @@ class VisitPlaceView(APIView):
                 "place_name": place.name,
                 "user_xp": user.xp,
                 "user_level": user.level,
-                "total_visits_to_place": place.visits,
+                "total_visits_to_place": total_visits,
             }, status=status.HTTP_200_OK)
 
-        place.visits += 1
-        user.xp += place.xp_reward
-        place.save()
-        check_and_level_up(user)
-        user.save()
-
-        update_user_badges(user)
-
         return Response({
             "message": "Place visited!",
             "place_name": place.name,
             "user_xp": user.xp,
             "user_level": user.level,
-            "total_visits_to_place": place.visits,
+            "total_visits_to_place": total_visits,
         }, status=status.HTTP_201_CREATED)
 
 
+class BatchVisitView(APIView):
+    """
+    Replays visits collected offline in one request.
+
+    Each item gets its own status: ``visited``, ``already_visited``,
+    ``duplicate`` (the place appeared earlier in the batch) or ``not_found``.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = BatchVisitSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data['visits']
+
+        places = Place.objects.in_bulk({item['place_id'] for item in items})
+        pending, seen = [], set()
+        for item in items:
+            place = places.get(item['place_id'])
+            if place is not None and place.pk not in seen:
+                seen.add(place.pk)
+                pending.append((place, item.get('visited_at')))
+
+        created, user, totals = record_visits(request.user, pending)
+
+        results, reported = [], set()
+        for item in items:
+            place_id = item['place_id']
+            place = places.get(place_id)
+            if place is None:
+                results.append({"place_id": place_id, "status": "not_found"})
+                continue
+            if place_id in reported:
+                item_status = "duplicate"
+            elif place_id in created:
+                item_status = "visited"
+            else:
+                item_status = "already_visited"
+            reported.add(place_id)
+            results.append({
+                "place_id": place_id,
+                "status": item_status,
+                "xp_gained": place.xp_reward if item_status == "visited" else 0,
+                "total_visits_to_place": totals[place_id],
+            })
+
+        return Response({
+            "results": results,
+            "user_xp": user.xp,
+            "user_level": user.level,
+        }, status=status.HTTP_200_OK)
+
+
 class ApprovePlaceView(APIView):
     permission_classes = [IsSuperUserOrReadOnly]
 
@@ -151,8 +392,24 @@ class SavedPlaceView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        place_ids = SavedPlace.objects.filter(user=request.user).values_list('place_id', flat=True)
-        return Response({"saved_place_ids": list(place_ids)})
+        if request.query_params.get('expand') in ('1', 'true'):
+            return self.expanded(request)
+        place_ids, next_link, paginated = paginate_ids(request, SavedPlace.objects.filter(user=request.user), 'place_id', self)
+        data = {"saved_place_ids": place_ids}
+        if paginated:
+            data["next"] = next_link
+        return Response(data)
+
+    def expanded(self, request):
+        """The saved places themselves, read with one joined query."""
+        queryset = SavedPlace.objects.filter(user=request.user).select_related('place')
+        paginator = OptionalCursorPagination()
+        page = paginator.paginate_queryset(queryset, request, self)
+        serializer = SavedPlaceSerializer(page if page is not None else queryset, many=True, context={'request': request})
+        data = {"saved_places": serializer.data}
+        if page is not None:
+            data["next"] = paginator.get_next_link()
+        return Response(data)
 
     def post(self, request):
         serializer = SavedPlaceSerializer(data=request.data)
@@ -161,6 +418,8 @@ class SavedPlaceView(APIView):
         place_id = serializer.validated_data['place_id']
         place = get_object_or_404(Place, id=place_id)
         saved_place, created = SavedPlace.objects.get_or_create(user=request.user, place=place)
+        if created:
+            bump_user_versions([request.user.pk])
 
         if not created:
             return Response({'message': 'Place already saved.'}, status=200)
@@ -175,16 +434,82 @@ class SavedPlaceView(APIView):
         try:
             saved = SavedPlace.objects.get(user=request.user, place_id=place_id)
             saved.delete()
+            bump_user_versions([request.user.pk])
             return Response({'message': 'Place removed from saved list.'}, status=200)
         except SavedPlace.DoesNotExist:
             return Response({'error': 'Place not found in your saved list.'}, status=404)
 
 
-class VisibleUsersView(generics.ListAPIView):
-    serializer_class = ProfileSerializer
+class SavedPlaceBulkView(APIView):
+    """
+    Save or unsave many places at once.
+
+    Each direction is one lookup plus one set-based INSERT or DELETE,
+    however many places are sent.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def place_ids(self, request):
+        serializer = SavedPlaceIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return list(dict.fromkeys(serializer.validated_data['place_ids']))
+
+    def post(self, request):
+        place_ids = self.place_ids(request)
+        already = SavedPlace.objects.filter(user=request.user, place=OuterRef('pk'))
+        found = dict(Place.objects.filter(pk__in=place_ids).annotate(saved=Exists(already)).values_list('id', 'saved'))
+        new = [place_id for place_id in place_ids if found.get(place_id) is False]
+        # ignore_conflicts: a concurrent save of the same place is not an error.
+        SavedPlace.objects.bulk_create([SavedPlace(user=request.user, place_id=place_id) for place_id in new], ignore_conflicts=True)
+        if new:
+            bump_user_versions([request.user.pk])
+        return Response({
+            "saved": new,
+            "already_saved": [place_id for place_id in place_ids if found.get(place_id)],
+            "not_found": [place_id for place_id in place_ids if place_id not in found],
+        }, status=status.HTTP_201_CREATED if new else status.HTTP_200_OK)
+
+    def delete(self, request):
+        place_ids = self.place_ids(request)
+        saved = SavedPlace.objects.filter(user=request.user, place_id__in=place_ids)
+        removed = set(saved.values_list('place_id', flat=True))
+        if removed:
+            saved.delete()
+            bump_user_versions([request.user.pk])
+        return Response({
+            "removed": [place_id for place_id in place_ids if place_id in removed],
+            "not_saved": [place_id for place_id in place_ids if place_id not in removed],
+        })
+
+
+class VisibleUsersView(APIView):
+    def get(self, request):
+        # Paged over the IDs in memory, only the page's rows are fetched.
+        user_ids, next_link, paginated = paginate_id_set(request, presence.online_ids(), self)
+        users = position_buffer.apply(list(in_batches(CustomUser.objects.all(), user_ids)))
+        data = ProfileSerializer(users, many=True).data
+        if paginated:
+            return Response({"next": next_link, "previous": None, "results": data})
+        return Response(data)
 
-    def get_queryset(self):
-        return CustomUser.objects.filter(online=True)
+
+class NearbyUsersView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        serializer = NearbyUsersSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+        # One spare slot so dropping the caller still leaves a full page.
+        limit = settings.NEARBY_USERS_LIMIT + 1
+
+        if 'radius' in params:
+            users = user_index.within_radius(params['coord_x'], params['coord_y'], params['radius'], limit)
+        else:
+            users = user_index.within_bbox(params['min_x'], params['min_y'], params['max_x'], params['max_y'], limit)
+
+        users = [user for user in users if user['id'] != request.user.id]
+        return Response(users[:settings.NEARBY_USERS_LIMIT])
 
 
 class SuggestedPlacesView(APIView):
@@ -194,89 +519,74 @@ class SuggestedPlacesView(APIView):
         user = request.user
         api_key = settings.OPENROUTER_API_KEY
 
-        visited_places = Place.objects.filter(visit__user=user, approved=True)
-        visited_place_ids = visited_places.values_list("id", flat=True)
+        visited_places, top_categories, cache_key = suggestion_inputs(user)
+        cached = suggestion_cache.get(cache_key)
+        if cached is not None:
+            return Response({"suggestions": cached})
 
-        if visited_places.exists():
-            category_counts = Counter(place.category for place in visited_places if place.category)
-            top_categories = [cat for cat, _ in category_counts.most_common(3)]
-        else:
-            top_categories = (
-                Place.objects.filter(approved=True)
-                .values("category")
-                .annotate(num_places=Count("id"))
-                .order_by("-num_places")
-                .values_list("category", flat=True)[:3]
-            )
-
-        unvisited_places = (
-            Place.objects
-            .filter(approved=True)
-            .exclude(id__in=visited_place_ids)
-            .filter(category__in=top_categories)
-        )
+        suggestions, place_data = None, []
+        if settings.SUGGESTION_MODE != "local":
+            place_data = candidate_places(visited_places, top_categories)
+            if settings.SUGGESTION_MODE == "hybrid":
+                suggestions = call_with_deadline(get_place_recommendations, settings.SUGGESTION_LLM_DEADLINE, place_data, top_categories, api_key,
+                                                 on_late=cache_late_answer(cache_key, place_data))
+            else:
+                suggestions = get_place_recommendations(place_data, top_categories, api_key)
 
-        place_data = [
-            {
-                "id": place.id,
-                "name": place.name,
-                "description": place.description,
-                "category": place.category,
-                "visits": place.visits,
-                "approved": place.approved
-            }
-            for place in unvisited_places
-        ]
-
-        suggestions = get_place_recommendations(place_data, top_categories, api_key)
-        try:
-            suggested_ids = [int(pid.strip()) for pid in suggestions.split(",") if pid.strip().isdigit()]
-        except ValueError:
-            return Response({"error": "Invalid ID format returned from LLM"}, status=500)
-
-        return Response({"suggestions": suggested_ids})
+        return Response({"suggestions": finish_suggestions(user, visited_places, cache_key, suggestions, place_data)})
 
 
 class ContributedPlacesView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        place_ids = Place.objects.filter(created_by=request.user).values_list('id', flat=True)
-        return Response({"contributed_place_ids": list(place_ids)})
+        place_ids, next_link, paginated = paginate_ids(request, Place.objects.filter(created_by=request.user), 'id', self)
+        data = {"contributed_place_ids": place_ids}
+        if paginated:
+            data["next"] = next_link
+        return Response(data)
 
 
 class VisitedPlacesView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request):
-        place_ids = Place.objects.filter(visit__user=request.user).values_list('id', flat=True).distinct()
-        return Response({"visited_place_ids": list(place_ids)})
+        # Visit is unique per (user, place), so no join or DISTINCT is needed.
+        place_ids, next_link, paginated = paginate_ids(request, Visit.objects.filter(user=request.user), 'place_id', self)
+        data = {"visited_place_ids": place_ids}
+        if paginated:
+            data["next"] = next_link
+        return Response(data)
 
 
 class UserLeaderboardView(APIView):
     permission_classes = [permissions.AllowAny]
 
     def get(self, request):
-        users = CustomUser.objects.order_by('-level', '-xp')[:100]
-        data = []
-        for rank, user in enumerate(users, start=1):
-            data.append({
-                'rank': rank,
-                'id': user.id,
-                'username': user.username,
-                'level': user.level,
-                'xp': user.xp,
-                'avatar': user.avatar,
-            })
-        return Response(data)
+        serializer = LeaderboardPageSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        page_size = serializer.validated_data['page_size']
+        offset = (serializer.validated_data['page'] - 1) * page_size
+        return Response(leaderboard.page(offset, page_size))
+
+
+class MyLeaderboardRankView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        entry = leaderboard.entry(request.user.id)
+        if entry is None:
+            # Signed up through another worker since our last reload.
+            leaderboard.update(request.user)
+            entry = leaderboard.entry(request.user.id)
+        entry['total_users'] = len(leaderboard)
+        return Response(entry)
 
 class PlacesLeaderboardView(APIView):
     permission_classes = [permissions.AllowAny]
 
     def get(self, request):
-        places = Place.objects.annotate(
-            unique_visitors=Count('visit__user', distinct=True)
-        ).order_by('-unique_visitors', '-visits')[:100]
+        places = Place.objects.only('id', 'name', 'unique_visitors', 'visits').order_by('-unique_visitors', '-visits')[:100]
 
         leaderboard = []
         for rank, place in enumerate(places, start=1):
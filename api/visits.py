@@ -0,0 +1,120 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .catalog import forget_visit_stamp
+from .models import CustomUser, Place, Visit
+from .utils import check_and_level_up, update_user_badges
+
+
+def record_visit(user, place):
+    """
+    Record the first visit of ``user`` to ``place`` and credit its XP.
+
+    Returns:
+        tuple: (created, user, total_visits_to_place). When the visit already
+        existed nothing is written and the passed-in values are returned.
+    """
+    created, user, totals = record_visits(user, [(place, None)])
+    return bool(created), user, totals[place.pk]
+
+
+def record_visits(user, visits):
+    """
+    Record the first visits of ``user`` to several places and credit their XP.
+
+    ``visits`` is a list of ``(place, visited_at)`` pairs; ``visited_at`` may be
+    None for "now" and is clamped to now when it lies in the future. Places
+    the user already visited are skipped, repeated places count once.
+
+    Everything happens in one transaction with the same handful of queries
+    no matter how many places are visited or were visited before. The place
+    counters are bumped in the database and the user row is locked before
+    XP, level and badges are recomputed, so concurrent visits never lose an
+    increment. XP and levels are credited in visit order, exactly as if the
+    visits had been recorded one by one.
+
+    Returns:
+        tuple: (set of newly visited place IDs, user, {place_id: total visits}).
+        When nothing was new nothing is written and the passed-in values are
+        returned.
+    """
+    places = {}
+    for place, visited_at in visits:
+        places.setdefault(place.pk, (place, visited_at))
+    if not places:
+        return set(), user, {}
+
+    with transaction.atomic():
+        created = _insert_visits(user, places.values())
+        if not created:
+            return set(), user, {place_id: place.visits for place_id, (place, _) in places.items()}
+
+        Place.objects.filter(pk__in=list(created)).update(visits=F('visits') + 1, unique_visitors=F('unique_visitors') + 1)
+        totals = dict(Place.objects.filter(pk__in=list(places)).values_list('id', 'visits'))
+
+        user = CustomUser.objects.select_for_update().get(pk=user.pk)
+        badges_changed = False
+        for place_id in sorted(created, key=created.get):
+            place = places[place_id][0]
+            user.xp += place.xp_reward
+            check_and_level_up(user)
+            badges_changed |= update_user_badges(user, place)
+        update_fields = ['xp', 'level', 'badge_progress']
+        if badges_changed:
+            update_fields.append('badges')
+        user.save(update_fields=update_fields)
+        # The counters moved, so the catalog list ETag must too (see api/catalog.py).
+        transaction.on_commit(forget_visit_stamp)
+
+    return set(created), user, totals
+
+
+def _insert_visits(user, visits):
+    """
+    Bulk insert the Visit rows that do not exist yet.
+
+    Tries the insert straight away, which is the common case. When that hits
+    the unique constraint, drops the places the user has visited by now and
+    tries again; concurrent requests can cause several rounds, but each one
+    drops at least one row.
+
+    Returns:
+        dict: {place_id: visited_at} for the rows inserted
+    """
+    now = timezone.now()
+    rows = [
+        Visit(user_id=user.pk, place=place, visited_at=min(visited_at or now, now))
+        for place, visited_at in visits
+    ]
+    while rows:
+        try:
+            with transaction.atomic():
+                Visit.objects.bulk_create(rows)
+            return {row.place_id: row.visited_at for row in rows}
+        except IntegrityError:
+            existing = set(
+                Visit.objects.filter(user_id=user.pk, place_id__in=[row.place_id for row in rows])
+                .values_list('place_id', flat=True)
+            )
+            if not existing:
+                # Not a repeated visit, e.g. the place was deleted meanwhile.
+                raise
+            rows = [row for row in rows if row.place_id not in existing]
+    return {}
+
+
+def unique_visitor_count():
+    """
+    Expression counting distinct visitors of the outer Place row.
+
+    Used to reconcile ``Place.unique_visitors``.
+    """
+    visitors = (
+        Visit.objects.filter(place=OuterRef('pk'))
+        .order_by().values('place')
+        .annotate(count=Count('user', distinct=True))
+        .values('count')
+    )
+    return Coalesce(Subquery(visitors), 0)
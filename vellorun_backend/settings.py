@@ -24,9 +24,86 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = os.getenv("DJANGO_SECRET_KEY", "unsafe-dev-key")
 DEBUG = os.getenv("DEBUG", "True") == "True"
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Redis server shared by every worker, see CACHES below
+CACHE_URL = os.getenv("CACHE_URL")
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
+# Where Google ID token signing keys come from, see api/google_auth.py
+GOOGLE_KEY_SOURCE = os.getenv("GOOGLE_KEY_SOURCE", "api.google_auth.HTTPKeySource")
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 
+# Spatial index over approved places, see api/spatial.py
+PLACE_INDEX_CELL_DEG = float(os.getenv("PLACE_INDEX_CELL_DEG", "0.002"))
+PLACE_INDEX_TTL = int(os.getenv("PLACE_INDEX_TTL", "300"))
+NEARBY_PLACES_LIMIT = int(os.getenv("NEARBY_PLACES_LIMIT", "100"))
+# Place search index, see api/search.py. With a position, a place
+# SEARCH_DISTANCE_SCALE_M away scores up to 1 + SEARCH_DISTANCE_BOOST / e times its text score
+SEARCH_INDEX_TTL = int(os.getenv("SEARCH_INDEX_TTL", "300"))
+SEARCH_DISTANCE_SCALE_M = float(os.getenv("SEARCH_DISTANCE_SCALE_M", "500"))
+SEARCH_DISTANCE_BOOST = float(os.getenv("SEARCH_DISTANCE_BOOST", "1"))
+# How long a worker may serve a cached catalog version before rereading it
+CATALOG_VERSION_CACHE_TTL = int(os.getenv("CATALOG_VERSION_CACHE_TTL", "5"))
+
+# Live position index over online users
+USER_INDEX_CELL_DEG = float(os.getenv("USER_INDEX_CELL_DEG", "0.002"))
+USER_INDEX_TTL = int(os.getenv("USER_INDEX_TTL", "30"))
+NEARBY_USERS_LIMIT = int(os.getenv("NEARBY_USERS_LIMIT", "200"))
+# Heartbeat positions are written back every POSITION_FLUSH_INTERVAL seconds
+# (0 writes each one straight away), POSITION_FLUSH_BATCH users per UPDATE.
+# MemoryPositions is per worker, use api.positions.CachePositions with a
+# shared cache to run several
+POSITION_BACKEND = os.getenv("POSITION_BACKEND", "api.positions.MemoryPositions")
+POSITION_FLUSH_INTERVAL = float(os.getenv("POSITION_FLUSH_INTERVAL", "2"))
+POSITION_FLUSH_BATCH = int(os.getenv("POSITION_FLUSH_BATCH", "500"))
+# Presence (api/presence.py): heartbeats keep a user online for PRESENCE_TTL
+# seconds; the online column is synced every PRESENCE_SYNC_INTERVAL seconds (0
+# leaves it to presence.sync()). MemoryPresence is per worker, use
+# api.presence.CachePresence with a shared cache to run several
+PRESENCE_BACKEND = os.getenv("PRESENCE_BACKEND", "api.presence.MemoryPresence")
+PRESENCE_TTL = int(os.getenv("PRESENCE_TTL", "60"))
+PRESENCE_SYNC_INTERVAL = float(os.getenv("PRESENCE_SYNC_INTERVAL", "15"))
+PRESENCE_SYNC_BATCH = int(os.getenv("PRESENCE_SYNC_BATCH", "500"))
+# Live map stream (api/live.py): LocalBackend only reaches streams in the same
+# worker, run several workers with api.live.RedisBackend and LIVE_REDIS_URL
+LIVE_BACKEND = os.getenv("LIVE_BACKEND", "api.live.LocalBackend")
+LIVE_REDIS_URL = os.getenv("LIVE_REDIS_URL", "redis://localhost:6379/0")
+LIVE_KEEPALIVE = float(os.getenv("LIVE_KEEPALIVE", "15"))
+
+# Position updates within GEOFENCE_RADIUS_M meters of an approved place visit it (0 turns this off)
+GEOFENCE_RADIUS_M = float(os.getenv("GEOFENCE_RADIUS_M", "30"))
+# Users whose fences and credited places each worker remembers, least recently seen dropped first
+GEOFENCE_TRACKED_USERS = int(os.getenv("GEOFENCE_TRACKED_USERS", "10000"))
+
+# How long an authenticated user is served from the cache, see api/authentication.py.
+# Off (0) without a shared cache, other workers could not drop stale copies
+AUTH_USER_CACHE_TTL = int(os.getenv("AUTH_USER_CACHE_TTL", "60" if CACHE_URL else "0"))
+
+# Request metrics served at api/metrics/, see api/metrics.py. Requests slower than
+# SLOW_REQUEST_MS are logged with their queries; set METRICS_TOKEN to protect the endpoint.
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Most visits accepted by one POST to visit/batch/
+VISIT_BATCH_LIMIT = int(os.getenv("VISIT_BATCH_LIMIT", "200"))
+# Most place IDs one bulk save or unsave may carry
+SAVED_PLACES_BULK_LIMIT = int(os.getenv("SAVED_PLACES_BULK_LIMIT", "200"))
+
+# In-memory user leaderboard, reloaded from the database every LEADERBOARD_TTL seconds
+LEADERBOARD_TTL = int(os.getenv("LEADERBOARD_TTL", "300"))
+
+# LLM place suggestions cache, see api/suggestions.py
+SUGGESTION_CACHE_SIZE = int(os.getenv("SUGGESTION_CACHE_SIZE", "10000"))
+SUGGESTION_CACHE_TTL = int(os.getenv("SUGGESTION_CACHE_TTL", "900"))
+# Local rankings are cached per grid cell of this many meters around the user
+SUGGESTION_CACHE_CELL_M = float(os.getenv("SUGGESTION_CACHE_CELL_M", "250"))
+# "llm" asks OpenRouter only, "local" uses the in-process recommender only and
+# "hybrid" asks OpenRouter but falls back to the local ranking when it errors
+# or has not answered within SUGGESTION_LLM_DEADLINE seconds.
+SUGGESTION_MODE = os.getenv("SUGGESTION_MODE", "hybrid")
+SUGGESTION_LLM_DEADLINE = float(os.getenv("SUGGESTION_LLM_DEADLINE", "3"))
+SUGGESTION_LLM_WORKERS = int(os.getenv("SUGGESTION_LLM_WORKERS", "8"))
+SUGGESTION_LLM_TIMEOUT = float(os.getenv("SUGGESTION_LLM_TIMEOUT", "10"))
+SUGGESTION_DISTANCE_SCALE_M = float(os.getenv("SUGGESTION_DISTANCE_SCALE_M", "1000"))
+
 ALLOWED_HOSTS = ['*']
 
 
@@ -48,6 +125,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -86,6 +164,30 @@ DATABASES = {
     if DATABASE_URL else {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Take the write lock up front and wait for it, so concurrent visits
+        # queue up instead of failing with "database is locked".
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # A file rather than shared memory so threaded tests get real locking.
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/ref/settings/#caches
+# Per process unless CACHE_URL points every worker at the same redis server.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_URL,
+    } if CACHE_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
@@ -137,7 +239,7 @@ CORS_ALLOW_ALL_ORIGINS = True
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',